@@ -0,0 +1,82 @@
+"""Micro-benchmark: tiles codecs, encode and decode time vs size, for each codec preset, images and labels.
+
+Usage: python bench_codecs.py [--tiles 50] [--ts 512]
+"""
+
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+import mercantile
+
+from abd_model.core import make_palette
+from abd_model.tiles import tile_codec, tile_image_to_file, tile_image_from_file, tile_label_to_file, tile_label_from_file
+
+
+def synthetic_image(ts, C, seed):
+    """Smooth, aerial imagery like, image: low frequencies plus some noise."""
+    rng = np.random.RandomState(seed)
+    low = rng.randint(0, 255, (ts // 32, ts // 32, C)).astype(np.float32)
+    image = np.kron(low, np.ones((32, 32, 1), dtype=np.float32))
+    image = (image + np.roll(image, 16, axis=0) + np.roll(image, 16, axis=1)) / 3
+    image += rng.normal(0, 8, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def synthetic_label(ts, seed):
+    """Blocky, buildings like, binary label."""
+    rng = np.random.RandomState(seed)
+    label = np.zeros((ts, ts), dtype=np.uint8)
+    for _ in range(20):
+        x, y, w, h = rng.randint(0, ts, 2).tolist() + rng.randint(8, ts // 8, 2).tolist()
+        label[y : y + h, x : x + w] = 1
+    return label
+
+
+def bench(name, tiles, write, read, root):
+    start = time.perf_counter()
+    paths = [write(i, tile) for i, tile in enumerate(tiles)]
+    encode = (time.perf_counter() - start) / len(tiles)
+    start = time.perf_counter()
+    for path in paths:
+        read(path)
+    decode = (time.perf_counter() - start) / len(tiles)
+    size = sum(os.path.getsize(path) for path in paths) / len(tiles)
+    print("| {:<24}| {:>11.1f} | {:>11.1f} | {:>13.1f} |".format(name, encode * 1000, decode * 1000, size / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tiles", type=int, default=50)
+    parser.add_argument("--ts", type=int, default=512)
+    args = parser.parse_args()
+
+    tiles = [mercantile.Tile(x, 0, 18) for x in range(args.tiles)]
+    palette, transparency = make_palette(["transparent", "deeppink"])
+    codecs = ["default", "fast", "small", "raw", "webp:lossless", "jpeg:90"]
+
+    print("| {:<24}| {:>11} | {:>11} | {:>13} |".format("Tiles, codec", "encode (ms)", "decode (ms)", "size (KB/tile)"))
+    for C in [3, 1]:
+        images = [synthetic_image(args.ts, C, seed) for seed in range(len(tiles))]
+        for codec in codecs if C == 3 else codecs[:4]:
+            with tempfile.TemporaryDirectory() as root:
+                ext = tile_codec(codec, C)[0]
+                write = lambda i, tile: tile_image_to_file(root, tile, images[i], codec=codec) or os.path.join(
+                    root, str(tile.z), str(tile.x), "{}.{}".format(tile.y, ext)
+                )
+                bench("{} bands, {}".format(C, codec), tiles, write, tile_image_from_file, root)
+
+    labels = [synthetic_label(args.ts, seed) for seed in range(len(tiles))]
+    for codec in codecs[:4]:
+        with tempfile.TemporaryDirectory() as root:
+            ext = tile_codec(codec, label=True)[0]
+            write = lambda i, tile: tile_label_to_file(
+                root, tile, palette, transparency, labels[i], codec=codec
+            ) or os.path.join(root, str(tile.z), str(tile.x), "{}.{}".format(tile.y, ext))
+            bench("label, {}".format(codec), tiles, write, tile_label_from_file, root)
+
+
+if __name__ == "__main__":
+    main()
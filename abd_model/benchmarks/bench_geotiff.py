@@ -0,0 +1,90 @@
+"""Micro-benchmark: abd predict masks output, as a tree of palette png tiles vs a single tiled and overviewed GeoTIFF
+(abd predict --out masks.tif), written by the writers pool, then read back by abd vectorize.
+
+Usage: python bench_geotiff.py [--side 16] [--ts 512] [--bs 4] [--writers 2]
+"""
+
+import os
+import time
+import tempfile
+import argparse
+
+import cv2
+import numpy as np
+import torch
+
+from abd_model.core import Logs, make_palette
+from abd_model.tools import vectorize
+from abd_model.tools.predict import MasksWriter, MasksGeoTiff, geotiff_part, geotiff_merge
+
+
+def du(path):
+    if os.path.isfile(path):
+        return 1, os.path.getsize(path)
+    files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+    return len(files), sum(os.path.getsize(path) for path in files)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--side", type=int, default=16, help="side, in tiles, of the square masks extent")
+    parser.add_argument("--ts", type=int, default=512)
+    parser.add_argument("--bs", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    args = parser.parse_args()
+
+    palette, transparency = make_palette(["white", "red"])
+    x0, y0, z = 266520, 180600, 19
+    tiles = [(x0 + x, y0 + y, z) for y in range(args.side) for x in range(args.side)]
+    extent = (x0, y0, x0 + args.side - 1, y0 + args.side - 1, z)
+
+    np.random.seed(0)  # building like blobs: smooth noise, thresholded
+    side = args.side * args.ts
+    noise = cv2.resize(np.random.rand(side // 32, side // 32).astype(np.float32), (side, side))
+    mosaic = (noise > 0.6).astype(np.uint8)
+    masks = [
+        mosaic[y * args.ts : (y + 1) * args.ts, x * args.ts : (x + 1) * args.ts]
+        for y in range(args.side)
+        for x in range(args.side)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(tmp + "/config.toml", "w") as fp:
+            fp.write('[[classes]]\ntitle = "Background"\ncolor = "white"\n[[classes]]\ntitle = "Building"\ncolor = "red"\n')
+
+        outs = {"png tiles": tmp + "/masks", "GeoTIFF": tmp + "/masks.tif"}
+        print(
+            "| {:<10}| {:>6} | {:>15} | {:>6} | {:>9} | {:>19} | {:>9} |".format(
+                "Output", "tiles", "write (tiles/s)", "files", "disk", "vectorize (tiles/s)", "features"
+            )
+        )
+        print("|{}|{}|{}|{}|{}|{}|{}|".format("-" * 11, "-" * 8, "-" * 17, "-" * 8, "-" * 11, "-" * 21, "-" * 11))
+
+        for name, out in outs.items():
+            start = time.perf_counter()
+            geotiff = MasksGeoTiff(geotiff_part(out, 0), extent, (args.ts, args.ts), palette) if name == "GeoTIFF" else None
+            root = None if geotiff else out
+            with MasksWriter(root, palette, transparency, workers=args.writers, geotiff=geotiff) as writer:
+                for i in range(0, len(tiles), args.bs):
+                    writer.write(torch.IntTensor(tiles[i : i + args.bs]), np.stack(masks[i : i + args.bs]))
+            if geotiff:
+                geotiff_merge(out, [geotiff_part(out, 0)], [], extent, (args.ts, args.ts), palette, Logs(None))
+            write = len(tiles) / (time.perf_counter() - start)
+            files, size = du(out)
+
+            start = time.perf_counter()
+            json = tmp + "/features.json"
+            vectorize.main(argparse.Namespace(masks=out, type="Building", config=tmp + "/config.toml", out=json))
+            read = len(tiles) / (time.perf_counter() - start)
+            with open(json) as fp:
+                features = fp.read().count('"Feature"')
+
+            print(
+                "| {:<10}| {:>6} | {:>15.1f} | {:>6} | {:>6.1f} MB | {:>19.1f} | {:>9} |".format(
+                    name, len(tiles), write, files, size / 1e6, read, features
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Micro-benchmark: SemSeg multi-bands samples loading, legacy per band concatenate vs single pass buffered read.
+
+Usage: python bench_loader.py [--tiles 200] [--bands 4] [--channels 2] [--ts 512]
+"""
+
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+import rasterio
+import mercantile
+
+from abd_model.da.core import to_tensor
+from abd_model.tiles import tile_image_to_file
+from abd_model.loaders.semseg import SemSeg
+
+
+def legacy_tile_image_from_file(path, bands=None):
+    raster = rasterio.open(os.path.expanduser(path))
+    image = None
+    for i in raster.indexes if bands is None else bands:
+        data_band = raster.read(i)
+        data_band = data_band.reshape(data_band.shape[0], data_band.shape[1], 1)  # H,W -> H,W,C
+        image = np.concatenate((image, data_band), axis=2) if image is not None else data_band
+    return image
+
+
+def legacy_getitem(dataset, i):
+    image = None
+    for channel in dataset.config["channels"]:
+        tile, path = dataset.tiles[channel["name"]][i]
+        image_channel = legacy_tile_image_from_file(path, channel["bands"])
+        image = np.concatenate((image, image_channel), axis=2) if image is not None else image_channel
+    return to_tensor(dataset.config, dataset.shape_in[1:3], image, resize=False, da=False)
+
+
+def bench(name, fn, n):
+    fn(0)  # warm up
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print("{:<30}{:>10.1f} samples/s".format(name, n / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tiles", type=int, default=200)
+    parser.add_argument("--bands", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--ts", type=int, default=512)
+    args = parser.parse_args()
+
+    bands = list(range(1, args.bands + 1))
+    config = {
+        "channels": [{"name": "images{}".format(c), "bands": bands} for c in range(args.channels)],
+        "classes": [{"title": "Background"}, {"title": "Building"}],
+        "train": {},
+    }
+
+    with tempfile.TemporaryDirectory() as root:
+        tiles = [mercantile.Tile(x, 0, 18) for x in range(args.tiles)]
+        for channel in config["channels"]:
+            for tile in tiles:
+                image = np.random.randint(0, 255, (args.ts, args.ts, args.bands), dtype=np.uint8)
+                tile_image_to_file(os.path.join(root, channel["name"]), tile, image)
+
+        dataset = SemSeg(config, (args.ts, args.ts), root, mode="predict")
+        print("{} tiles, {} channels x {} bands, {}x{}".format(len(dataset), args.channels, args.bands, args.ts, args.ts))
+        bench("legacy (per band concatenate)", lambda i: legacy_getitem(dataset, i), len(dataset))
+        bench("single pass buffered read", lambda i: dataset[i], len(dataset))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Micro-benchmark: abd predict inference on a block of adjacent tiles, plain tiles vs metatiles (4 passes on buffered
+tiles) vs mosaic sliding blended windows, and masks agreement with a single pass on the whole block, seams free.
+
+Usage: python bench_mosaic.py [--encoder resnet50] [--ts 256] [--block 4] [--bs 1] [--threads CPU]
+"""
+
+import os
+import time
+import argparse
+
+import cv2
+import numpy as np
+import torch
+
+from abd_model.nn.albunet import Albunet
+from abd_model.tools.predict import mosaic_probs, probs_masks
+
+
+def masks(probs):
+    """Masks, as abd predict ones, N,C,H,W -> N,H,W."""
+
+    return probs_masks(torch.as_tensor(probs)).numpy()
+
+
+def plain(nn, canvas, ts, m, block, bs):
+    tiles = [
+        canvas[:, m + y * ts : m + (y + 1) * ts, m + x * ts : m + (x + 1) * ts] for y in range(block) for x in range(block)
+    ]
+    return np.concatenate([nn(torch.stack(tiles[i : i + bs])).numpy() for i in range(0, len(tiles), bs)])
+
+
+def metatiles(nn, canvas, ts, m, block, bs):
+    qs, hs = ts // 4, ts // 2
+    buffers = [
+        canvas[:, y * ts : (y + 1) * ts + 2 * m, x * ts : (x + 1) * ts + 2 * m] for y in range(block) for x in range(block)
+    ]
+
+    probs = []
+    for i in range(0, len(buffers), bs):  # as abd predict --metatiles: 4 passes on each buffered tile, centers kept
+        images = torch.stack(buffers[i : i + bs])
+        prob = np.zeros((images.shape[0], 2, ts, ts), dtype=np.float32)
+        prob[:, :, 0:hs, 0:hs] = nn(images[:, :, 0:ts, 0:ts]).numpy()[:, :, qs:-qs, qs:-qs]
+        prob[:, :, 0:hs, hs:] = nn(images[:, :, 0:ts, hs:]).numpy()[:, :, qs:-qs, qs:-qs]
+        prob[:, :, hs:, 0:hs] = nn(images[:, :, hs:, 0:ts]).numpy()[:, :, qs:-qs, qs:-qs]
+        prob[:, :, hs:, hs:] = nn(images[:, :, hs:, hs:]).numpy()[:, :, qs:-qs, qs:-qs]
+        probs.append(prob)
+
+    return np.concatenate(probs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--encoder", type=str, default="resnet50")
+    parser.add_argument("--ts", type=int, default=256)
+    parser.add_argument("--block", type=int, default=4, help="mosaic block side, in tiles")
+    parser.add_argument("--bs", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    ts, m, block = args.ts, args.ts // 4, args.block
+    nn = Albunet((3, ts, ts), (2, ts, ts), args.encoder).eval()
+
+    np.random.seed(0)  # smooth synthetic imagery, so outputs depend on context, as on real scenes
+    side = block * ts + 2 * m
+    canvas = cv2.resize(np.random.randint(0, 256, (side // 32, side // 32, 3), dtype=np.uint8), (side, side))
+    canvas = torch.from_numpy(np.moveaxis(canvas, 2, 0)).float()
+    coords = torch.IntTensor([[x, y, 0] for y in range(block) for x in range(block)])
+
+    with torch.no_grad():
+        reference = masks(mosaic_probs(nn, canvas, coords, (ts, ts), m, side, 1, "cpu"))  # one pass, whole block
+
+        modes = {
+            "plain": lambda: plain(nn, canvas, ts, m, block, args.bs),
+            "metatiles": lambda: metatiles(nn, canvas, ts, m, block, args.bs),
+            "mosaic": lambda: mosaic_probs(nn, canvas, coords, (ts, ts), m, 2 * (ts + m), args.bs, "cpu"),
+        }
+
+        print(
+            "| {:<10}| {:>7} | {:>14} | {:>13} | {:>16} |".format(
+                "Mode", "threads", "pixels ratio", "tiles/s", "masks agreement"
+            )
+        )
+        print("|{}|{}|{}|{}|{}|".format("-" * 11, "-" * 9, "-" * 16, "-" * 15, "-" * 18))
+        for mode, run in modes.items():
+            start = time.perf_counter()
+            probs = run()
+            tps = block * block / (time.perf_counter() - start)
+
+            windows = {"plain": ts * ts, "metatiles": 4 * ts * ts}
+            if mode == "mosaic":
+                n = int(np.ceil((side - m) / (2 * ts + m)))
+                windows[mode] = (n * min(2 * (ts + m), side)) ** 2 / (block * block)
+            agreement = 100 * np.mean(masks(probs) == reference)
+            print(
+                "| {:<10}| {:>7} | {:>13.2f}x | {:>13.2f} | {:>15.3f}% |".format(
+                    mode, args.threads, windows[mode] / (ts * ts), tps, agreement
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
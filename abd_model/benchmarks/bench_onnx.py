@@ -0,0 +1,90 @@
+"""Micro-benchmark: abd predict model inference on CPU, eager PyTorch vs ONNX Runtime, for Albunet at 512x512.
+
+Usage: python bench_onnx.py [--encoder resnet50] [--ts 512] [--batches 1 4] [--runs 3] [--threads CPU]
+"""
+
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+import torch
+
+from abd_model.nn.albunet import Albunet
+from abd_model.tools.predict import onnx_session
+
+
+def throughput(run, batch, runs):
+    run(batch)  # warm up
+    start = time.perf_counter()
+    for _ in range(runs):
+        out = run(batch)
+
+    return runs * batch.shape[0] / (time.perf_counter() - start), out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--encoder", type=str, default="resnet50")
+    parser.add_argument("--ts", type=int, default=512)
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    nn = Albunet((3, args.ts, args.ts), (2, args.ts, args.ts), args.encoder).eval()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "albunet.onnx")
+        torch.onnx.export(
+            nn,
+            torch.rand(1, 3, args.ts, args.ts),
+            path,
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes={"input": {0: "num_batch"}, "output": {0: "num_batch"}},
+        )
+
+        import onnx  # metadata, as abd export embeds them
+
+        model = onnx.load(path)
+        for key, value in {"uuid": "bench", "nn": "Albunet", "encoder": args.encoder, "loader": "SemSeg"}.items():
+            prop = model.metadata_props.add()
+            prop.key, prop.value = key, value
+        for key in ["shape_in", "shape_out"]:
+            prop = model.metadata_props.add()
+            prop.key, prop.value = key, "[3, {0}, {0}]".format(args.ts)
+        onnx.save(model, path)
+
+        print(
+            "| {:<6}| {:>7} | {:>15} | {:>15} | {:>15} | {:>7} | {:>12} |".format(
+                "Batch", "threads", "eager (tiles/s)", "ORT basic", "ORT all", "speedup", "masks equal"
+            )
+        )
+        print("|{}|{}|{}|{}|{}|{}|{}|".format("-" * 7, "-" * 9, "-" * 17, "-" * 17, "-" * 17, "-" * 9, "-" * 14))
+
+        sessions = [onnx_session(path, args.threads, level)[0] for level in ["basic", "all"]]
+        for bs in args.batches:
+            batch = torch.rand(bs, 3, args.ts, args.ts)
+            with torch.no_grad():
+                eager, out = throughput(lambda batch: nn(batch).numpy(), batch, args.runs)
+
+            timings, outs = [], []
+            for session in sessions:
+                ort, ort_out = throughput(lambda batch: session.run(None, {"input": batch.numpy()})[0], batch, args.runs)
+                timings.append(ort)
+                outs.append(ort_out)
+
+            equal = np.mean(np.around(out) == np.around(outs[-1])) * 100  # masks are rounded probabilities
+            print(
+                "| {:<6}| {:>7} | {:>15.2f} | {:>15.2f} | {:>15.2f} | {:>6.2f}x | {:>11.3f}% |".format(
+                    bs, args.threads, eager, *timings, timings[-1] / eager, equal
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Micro-benchmark: abd tile raster reads, warped on the fly from a source raster, vs aligned window reads from a
+pre-warped, tiles grid aligned, Cloud Optimized GeoTIFF (cf abd warp), at its zoom and coarser ones.
+
+Usage: python bench_prewarp.py [--size 8192] [--zoom 19] [--levels 3] [--tiles 256]
+"""
+
+import time
+import tempfile
+import argparse
+
+import numpy as np
+import mercantile
+import rasterio
+from rasterio.warp import transform_bounds
+
+from abd_model.core import Logs
+from abd_model.tools import tile
+from abd_model.tools.warp import warp
+from bench_tile import synthetic_raster
+
+
+def reads(path, tiles, ts, block):
+    args = argparse.Namespace(bands=[1, 2, 3], warp_threads=1, label=False, nodata=0)
+    corners = [mercantile.Tile(min(t.x for t in tiles), min(t.y for t in tiles), tiles[0].z)]
+    corners.append(mercantile.Tile(max(t.x for t in tiles), max(t.y for t in tiles), tiles[0].z))
+
+    tile._warps.clear()  # cold, for each run
+    start = time.perf_counter()
+    for tiles_block in tile.tiles_blocks(tiles, block):
+        tile.raster_block(args, path, corners, tiles_block, ts, ts)
+
+    return len(tiles) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=8192)
+    parser.add_argument("--zoom", type=int, default=19)
+    parser.add_argument("--levels", type=int, default=3, help="zoom levels to bench, from --zoom one")
+    parser.add_argument("--tiles", type=int, default=256, help="max tiles, by zoom")
+    parser.add_argument("--block", type=int, default=4)
+    parser.add_argument("--ts", type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tmp + "/raster.tif"
+        synthetic_raster(path, args.size, "lzw")
+
+        with rasterio.open(path) as raster:
+            bounds = transform_bounds(raster.crs, "EPSG:4326", *raster.bounds)
+        warp_args = argparse.Namespace(zoom=args.zoom, bands=[1, 2, 3], priority="first", nodata=0, compress="deflate")
+        warp_args.__dict__.update({"workers": 1, "block": args.block, "warp_threads": 1, "label": False})
+        start = time.perf_counter()
+        with rasterio.Env(GDAL_TIFF_OVR_BLOCKSIZE=args.ts):
+            warp(warp_args, [path], tmp + "/cog.tif", None, args.ts, args.ts, Logs(None))
+        print("Pre-warp, once: {:.1f}s".format(time.perf_counter() - start))
+        print()
+
+        print(
+            "| {:<8}| {:>6} | {:>16} | {:>16} | {:>7} |".format(
+                "Zoom", "tiles", "warped (tiles/s)", "aligned (tiles/s)", "speedup"
+            )
+        )
+        print("|{}|{}|{}|{}|{}|".format("-" * 9, "-" * 8, "-" * 18, "-" * 19, "-" * 9))
+
+        for zoom in range(args.zoom, args.zoom - args.levels, -1):
+            tiles = list(mercantile.tiles(*bounds, zoom))
+            side = int(np.sqrt(args.tiles))  # square subset, inside the raster coverage
+            x0, y0 = min(t.x for t in tiles) + 1, min(t.y for t in tiles) + 1
+            tiles = [t for t in tiles if x0 <= t.x < x0 + side and y0 <= t.y < y0 + side]
+
+            timings = [reads(path, tiles, args.ts, args.block), reads(tmp + "/cog.tif", tiles, args.ts, args.block)]
+            print(
+                "| {:<8}| {:>6} | {:>16.1f} | {:>17.1f} | {:>6.1f}x |".format(
+                    zoom, len(tiles), *timings, timings[1] / timings[0]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Micro-benchmark: abd predict inputs, tiled to disk by abd tile then read back by the predict loader, vs tiled on the
+fly from rasters (abd predict --rasters), with no intermediate tiles.
+
+Usage: python bench_rasters.py [--size 4096] [--zoom 19] [--tiles 256] [--block 4] [--codec default]
+"""
+
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+import mercantile
+import rasterio
+from rasterio.warp import transform_bounds
+
+from abd_model.core import Logs
+from abd_model.tiles import TilesManifest, Cover, tile_codec
+from abd_model.loaders.semseg import SemSeg
+from abd_model.tools import tile
+from abd_model.tools.predict import rasters_dataset
+from bench_tile import synthetic_raster
+
+
+def du(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--zoom", type=int, default=19)
+    parser.add_argument("--tiles", type=int, default=256)
+    parser.add_argument("--block", type=int, default=4)
+    parser.add_argument("--ts", type=int, default=512)
+    parser.add_argument("--codec", type=str, default="default", help="abd tile codec, of intermediate tiles")
+    args = parser.parse_args()
+
+    config = {"channels": [{"name": "images", "bands": [1, 2, 3]}], "classes": [], "train": {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tmp + "/raster.tif"
+        synthetic_raster(path, args.size, "lzw")
+
+        with rasterio.open(path) as raster:
+            tiles = list(mercantile.tiles(*transform_bounds(raster.crs, "EPSG:4326", *raster.bounds), args.zoom))
+        side = int(np.sqrt(args.tiles))  # square subset, inside the raster coverage
+        x0, y0 = min(t.x for t in tiles) + 1, min(t.y for t in tiles) + 1
+        cover = [t for t in tiles if x0 <= t.x < x0 + side and y0 <= t.y < y0 + side]
+
+        tile_args = argparse.Namespace(rasters=[path], zoom=args.zoom, bands=[1, 2, 3], priority="first", block=args.block)
+        tile_args.__dict__.update({"nodata": 0, "nodata_threshold": 100, "keep_borders": False, "label": False})
+        tile_args.__dict__.update({"warp_threads": 1, "codec": args.codec, "out": tmp + "/dataset/images"})
+        tile_args.cover = Cover(cover)
+        manifest = TilesManifest(tmp + "/out", "predict", {})
+
+        # Before: abd tile, to disk, then abd predict loader reads
+        tile._warps.clear()
+        start = time.perf_counter()
+        dataset, _ = rasters_dataset(tile_args, config, manifest, (args.ts, args.ts), Logs(None))
+        ext = tile_codec(args.codec, 3)[0]
+        for task in dataset.tasks:
+            tile.worker_block(tile_args, args.ts, args.ts, ext, None, task)
+        tiled = time.perf_counter() - start
+        loader = SemSeg(config, (args.ts, args.ts), tmp + "/dataset", mode="predict")
+        before = {}
+        for i in range(len(loader)):
+            image, xyz = loader[i]
+            before[tuple(xyz.tolist())] = image
+        elapsed_before = time.perf_counter() - start
+
+        # After: abd predict --rasters, tiled on the fly
+        tile._warps.clear()
+        start = time.perf_counter()
+        dataset, _ = rasters_dataset(tile_args, config, manifest, (args.ts, args.ts), Logs(None))
+        after = {}
+        for i in range(len(dataset)):
+            images, xyzs = dataset[i][:2]
+            after.update({tuple(xyz.tolist()): image for image, xyz in zip(images, xyzs)})
+        elapsed_after = time.perf_counter() - start
+
+        equal = before.keys() == after.keys() and all((before[key] == after[key]).all() for key in before.keys())
+        print(
+            "| {:<26}| {:>6} | {:>9} | {:>14} | {:>13} |".format(
+                "Inputs", "tiles", "tiles/s", "disk written", "tensors equal"
+            )
+        )
+        print("|{}|{}|{}|{}|{}|".format("-" * 27, "-" * 8, "-" * 11, "-" * 16, "-" * 15))
+        print(
+            "| {:<26}| {:>6} | {:>9.1f} | {:>11.1f} MB | {:>13} |".format(
+                "abd tile ({}), then read".format(ext),
+                len(before),
+                len(before) / elapsed_before,
+                du(tmp + "/dataset") / 1e6,
+                "-",
+            )
+        )
+        print(
+            "| {:<26}| {:>6} | {:>9.1f} | {:>11.1f} MB | {:>13} |".format(
+                "on the fly, from raster", len(after), len(after) / elapsed_after, 0, str(equal)
+            )
+        )
+        print()
+        print("abd tile alone: {:.1f} tiles/s".format(len(before) / tiled))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Micro-benchmark: abd predict on covers with a share of empty tiles (nodata, or near constant, e.g water or collars),
+every tile inferred, vs empty ones checked in the loader, given an empty mask, and the others repacked in full batches.
+
+Usage: python bench_skip.py [--encoder resnet50] [--ts 256] [--tiles 32] [--bs 4] [--shares 0 25 50 75]
+"""
+
+import os
+import time
+import tempfile
+import argparse
+
+import cv2
+import numpy as np
+import torch
+
+from abd_model.core import make_palette
+from abd_model.nn.albunet import Albunet
+from abd_model.tools.predict import EmptyTiles, MasksWriter, blocks_batches, probs_masks
+
+
+class Tiles(torch.utils.data.Dataset):
+    """In memory predict dataset: C,H,W images tensors, and their x, y, z tiles."""
+
+    def __init__(self, images):
+        self.images = images
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, i):
+        return self.images[i], torch.IntTensor([i, 0, 19])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--encoder", type=str, default="resnet50")
+    parser.add_argument("--ts", type=int, default=256)
+    parser.add_argument("--tiles", type=int, default=32)
+    parser.add_argument("--bs", type=int, default=4)
+    parser.add_argument("--shares", type=int, nargs="+", default=[0, 25, 50, 75], help="empty tiles shares, in %")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    nn = Albunet((3, args.ts, args.ts), (2, args.ts, args.ts), args.encoder).eval()
+    palette, transparency = make_palette(["white", "red"])
+    rng = np.random.RandomState(0)
+
+    print(
+        "| {:<7}| {:>6} | {:>16} | {:>16} | {:>7} | {:>14} |".format(
+            "Empty", "tiles", "before (tiles/s)", "after (tiles/s)", "speedup", "after batches"
+        )
+    )
+    print("|{}|{}|{}|{}|{}|{}|".format("-" * 8, "-" * 8, "-" * 18, "-" * 18, "-" * 9, "-" * 16))
+
+    with torch.no_grad(), tempfile.TemporaryDirectory() as tmp:
+        nn(torch.zeros(1, 3, args.ts, args.ts))  # warm up
+
+        for share in args.shares:
+            images = []
+            for i in range(args.tiles):
+                if i * share // 100 != (i + 1) * share // 100:  # empty, spread: either nodata, or near constant
+                    image = np.zeros((args.ts, args.ts, 3), dtype=np.uint8) if i % 2 else np.full((args.ts, args.ts, 3), 42)
+                else:
+                    low = rng.randint(0, 256, (args.ts // 32, args.ts // 32, 3)).astype(np.uint8)
+                    image = cv2.resize(low, (args.ts, args.ts))
+                images.append(torch.from_numpy(np.moveaxis(image, 2, 0)).float())
+            dataset = Tiles(images)
+
+            start = time.perf_counter()
+            with MasksWriter(os.path.join(tmp, "before"), palette, transparency) as writer:
+                for i in range(0, len(dataset), args.bs):
+                    batch = [dataset[j] for j in range(i, min(i + args.bs, len(dataset)))]
+                    tiles = torch.stack([tile for _, tile in batch])
+                    writer.write(tiles, probs_masks(nn(torch.stack([image for image, _ in batch]))).numpy())
+            before = len(dataset) / (time.perf_counter() - start)
+
+            start, batches = time.perf_counter(), 0
+            chunks = EmptyTiles(dataset, args.bs, (args.ts, args.ts), 0, 1.0)
+            with MasksWriter(os.path.join(tmp, "after"), palette, transparency) as writer:
+                blocks = (chunks[i] for i in range(len(chunks)))
+                for images, tiles in blocks_batches(blocks, args.bs, writer, (args.ts, args.ts)):
+                    writer.write(tiles, probs_masks(nn(images)).numpy())
+                    batches += 1
+            after = len(dataset) / (time.perf_counter() - start)
+
+            print(
+                "| {:<7}| {:>6} | {:>16.2f} | {:>16.2f} | {:>6.2f}x | {:>14} |".format(
+                    "{}%".format(share), len(dataset), before, after, after / before, batches
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
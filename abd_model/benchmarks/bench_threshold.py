@@ -0,0 +1,90 @@
+"""Micro-benchmark: new masks at another threshold, by abd predict again (inference, then masks writes), vs abd threshold
+on the uint8 quantized probabilities stored by abd predict --probs, and their disk footprint.
+
+Usage: python bench_threshold.py [--encoder resnet50] [--ts 256] [--tiles 32] [--bs 4] [--workers CPU]
+"""
+
+import os
+import time
+import tempfile
+import argparse
+
+import cv2
+import numpy as np
+import torch
+
+from abd_model.core import make_palette
+from abd_model.nn.albunet import Albunet
+from abd_model.tools import threshold
+from abd_model.tools.predict import MasksWriter, probs_masks, probs_quantize
+
+
+def du(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--encoder", type=str, default="resnet50")
+    parser.add_argument("--ts", type=int, default=256)
+    parser.add_argument("--tiles", type=int, default=32)
+    parser.add_argument("--bs", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    nn = Albunet((3, args.ts, args.ts), (2, args.ts, args.ts), args.encoder).eval()
+    palette, transparency = make_palette(["white", "red"])
+
+    np.random.seed(0)  # smooth synthetic imagery
+    images = []
+    for i in range(args.tiles):
+        low = np.random.randint(0, 256, (args.ts // 32, args.ts // 32, 3)).astype(np.uint8)
+        images.append(torch.from_numpy(np.moveaxis(cv2.resize(low, (args.ts, args.ts)), 2, 0)).float())
+
+    with torch.no_grad(), tempfile.TemporaryDirectory() as tmp:
+        nn(images[0][None])  # warm up
+        with open(tmp + "/config.toml", "w") as fp:
+            fp.write('[[classes]]\ntitle = "Background"\ncolor = "white"\n[[classes]]\ntitle = "Building"\ncolor = "red"\n')
+
+        start = time.perf_counter()
+        with MasksWriter(tmp + "/masks", palette, transparency, probs=(tmp + "/probs", "png", 1)) as writer:
+            for i in range(0, args.tiles, args.bs):
+                tiles = torch.IntTensor([[x, 0, 19] for x in range(i, min(i + args.bs, args.tiles))])
+                probs = nn(torch.stack(images[i : i + args.bs]))
+                writer.write(tiles, probs_masks(probs).numpy(), probs_quantize(probs).numpy())
+        predict = args.tiles / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        threshold.main(
+            argparse.Namespace(
+                probs=tmp + "/probs",
+                out=tmp + "/thresholded",
+                config=tmp + "/config.toml",
+                threshold=[0.5],
+                codec=None,
+                workers=args.workers,
+                block=4,
+                no_web_ui=True,
+            )
+        )
+        thresholded = args.tiles / (time.perf_counter() - start)
+
+        same = all(
+            open(os.path.join(tmp, "masks/19", str(x), "0.png"), "rb").read()
+            == open(os.path.join(tmp, "thresholded/19", str(x), "0.png"), "rb").read()
+            for x in range(args.tiles)
+        )
+        masks, probs = du(tmp + "/masks") / 1e6, du(tmp + "/probs") / 1e6
+
+    print()
+    print("| {:<26}| {:>6} | {:>9} | {:>12} |".format("New masks, by", "tiles", "tiles/s", "same masks"))
+    print("|{}|{}|{}|{}|".format("-" * 27, "-" * 8, "-" * 11, "-" * 14))
+    print("| {:<26}| {:>6} | {:>9.2f} | {:>12} |".format("abd predict, again", args.tiles, predict, "-"))
+    print("| {:<26}| {:>6} | {:>9.2f} | {:>12} |".format("abd threshold, at 0.5", args.tiles, thresholded, str(same)))
+    print()
+    print("Disk: {:.2f} MB of masks, {:.2f} MB of probabilities".format(masks, probs))
+
+
+if __name__ == "__main__":
+    main()
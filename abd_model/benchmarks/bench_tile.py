@@ -0,0 +1,96 @@
+"""Micro-benchmark: abd tile raster reads, legacy one WarpedVRT per tile, vs one WarpedVRT per raster, read by blocks.
+
+Usage: python bench_tile.py [--size 4096] [--compress lzw] [--zooms 17 18 19] [--block 4] [--tiles 256]
+"""
+
+import time
+import tempfile
+import argparse
+
+import numpy as np
+import mercantile
+import rasterio
+from rasterio.vrt import WarpedVRT
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from rasterio.warp import transform_bounds
+from rasterio.transform import from_bounds, from_origin
+
+from abd_model.tools.tile import raster_warp, tiles_blocks
+
+
+def synthetic_raster(path, size, compress):
+    """Aerial imagery like, 3 bands uint8, tiled GeoTIFF, in UTM 31N at 50cm."""
+    rng = np.random.RandomState(0)
+    low = rng.randint(0, 255, (3, size // 64, size // 64)).astype(np.uint8)
+    data = np.kron(low, np.ones((1, 64, 64), dtype=np.uint8))
+    data = np.clip(data + rng.randint(0, 16, data.shape), 0, 255).astype(np.uint8)
+    profile = {"driver": "GTiff", "dtype": "uint8", "count": 3, "width": size, "height": size, "crs": "EPSG:32631"}
+    profile.update({"transform": from_origin(500000, 5400000, 0.5, 0.5), "tiled": True, "compress": compress})
+    with rasterio.open(path, "w", **profile) as out:
+        out.write(data)
+
+
+def legacy(raster, tiles, ts):
+    for tile in tiles:
+        w, s, e, n = mercantile.xy_bounds(tile)
+        transform = from_bounds(w, s, e, n, ts, ts)
+        vrt = WarpedVRT(raster, crs="epsg:3857", resampling=Resampling.bilinear, transform=transform, width=ts, height=ts)
+        vrt.read(out_shape=(3, ts, ts), window=vrt.window(w, s, e, n))
+
+
+def blocks(raster, tiles, ts, block):
+    vrt, ul = raster_warp(raster, tiles, ts, ts)
+    for tiles_block in tiles_blocks(tiles, block):
+        x0, y0 = min(tile.x for tile in tiles_block), min(tile.y for tile in tiles_block)
+        x1, y1 = max(tile.x for tile in tiles_block), max(tile.y for tile in tiles_block)
+        vrt.read(window=Window((x0 - ul.x) * ts, (y0 - ul.y) * ts, (x1 - x0 + 1) * ts, (y1 - y0 + 1) * ts))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--compress", type=str, default="lzw")
+    parser.add_argument("--zooms", type=int, nargs="+", default=[17, 18, 19])
+    parser.add_argument("--block", type=int, default=4)
+    parser.add_argument("--tiles", type=int, default=256, help="max tiles, by zoom")
+    parser.add_argument("--ts", type=int, default=512)
+    args = parser.parse_args()
+
+    print(
+        "| {:<8}| {:>6} | {:>16} | {:>16} | {:>7} |".format(
+            "Zoom", "tiles", "legacy (tiles/s)", "blocks (tiles/s)", "speedup"
+        )
+    )
+    print("|{}|{}|{}|{}|{}|".format("-" * 9, "-" * 8, "-" * 18, "-" * 18, "-" * 9))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tmp + "/raster.tif"
+        synthetic_raster(path, args.size, args.compress)
+
+        for zoom in args.zooms:
+            with rasterio.open(path) as raster:
+                tiles = list(mercantile.tiles(*transform_bounds(raster.crs, "EPSG:4326", *raster.bounds), zoom))
+                side = int(np.sqrt(args.tiles))  # square subset, to keep blocks full as in a real coverage
+                x0, y0 = min(tile.x for tile in tiles) + 1, min(tile.y for tile in tiles) + 1
+                tiles = [tile for tile in tiles if x0 <= tile.x < x0 + side and y0 <= tile.y < y0 + side]
+
+            timings = []
+            for run in (
+                lambda raster: legacy(raster, tiles, args.ts),
+                lambda raster: blocks(raster, tiles, args.ts, args.block),
+            ):
+                with rasterio.open(path) as raster:  # cold GDAL blocks cache, for each run
+                    start = time.perf_counter()
+                    run(raster)
+                    timings.append(len(tiles) / (time.perf_counter() - start))
+
+            print(
+                "| {:<8}| {:>6} | {:>16.1f} | {:>16.1f} | {:>6.1f}x |".format(
+                    zoom, len(tiles), *timings, timings[1] / timings[0]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Micro-benchmark: abd predict post-processing, host float masks and inline writes, vs on-device uint8 masks and a
+background writers pool, with device utilisation (share of wall time the device is busy).
+
+CPU stand-in for a GPU: the device holds the host for --device_time by batch, not using it (as a GPU kernel does, while
+host threads run), and returns real Albunet outputs, computed once.
+
+Usage: python bench_writer.py [--ts 512] [--bs 4] [--batches 16] [--device_time 0.1] [--writers 2] [--codec png]
+"""
+
+import os
+import time
+import tempfile
+import argparse
+from functools import partial
+
+import numpy as np
+import torch
+import mercantile
+
+from abd_model.core import make_palette
+from abd_model.nn.albunet import Albunet
+from abd_model.tiles import tile_label_to_file
+from abd_model.tools.predict import probs_masks, MasksWriter
+
+
+def before(nn, batches, out, palette, transparency, codec):
+    busy = 0.0
+    for images, tiles in batches:
+        start = time.perf_counter()
+        outs = nn(images).data
+        busy += time.perf_counter() - start
+
+        probs = outs.cpu().numpy().astype(np.float64)  # as abd predict did: host copy, and class loop, on float64
+        for tile, prob in zip(tiles, probs):
+            mask = np.zeros(prob.shape[1:3], dtype=np.uint8)
+            for c in range(prob.shape[0]):
+                mask += np.around(prob[c, :, :]).astype(np.uint8) * c
+            tile_label_to_file(out, mercantile.Tile(*map(int, tile)), palette, transparency, mask, codec=codec)
+
+    return busy
+
+
+def after(nn, batches, out, palette=None, transparency=None, codec=None, writers=2):
+    busy = 0.0
+    with MasksWriter(out, palette, transparency, codec, writers) as writer:
+        for images, tiles in batches:
+            start = time.perf_counter()
+            outs = nn(images).data
+            busy += time.perf_counter() - start
+
+            writer.write(tiles, probs_masks(outs).cpu().numpy())
+
+    return busy
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--encoder", type=str, default="resnet50")
+    parser.add_argument("--ts", type=int, default=512)
+    parser.add_argument("--bs", type=int, default=4)
+    parser.add_argument("--batches", type=int, default=16)
+    parser.add_argument("--device_time", type=float, default=0.1, help="stand-in device inference time, by batch")
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--codec", type=str, default="png")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = Albunet((3, args.ts, args.ts), (2, args.ts, args.ts), args.encoder).eval()
+    palette, transparency = make_palette(["white", "red"])
+
+    batches = []
+    for i in range(args.batches):
+        images = torch.rand(args.bs, 3, args.ts, args.ts) * 255
+        tiles = torch.IntTensor([[i * args.bs + j, 0, 19] for j in range(args.bs)])
+        batches.append((images, tiles))
+
+    print("| {:<22}| {:>9} | {:>9} | {:>18} |".format("Post-processing", "tiles/s", "wall (s)", "device utilisation"))
+    print("|{}|{}|{}|{}|".format("-" * 23, "-" * 11, "-" * 11, "-" * 20))
+
+    with torch.no_grad(), tempfile.TemporaryDirectory() as tmp:
+        outs = model(batches[0][0])
+
+        def nn(images):
+            time.sleep(args.device_time)
+            return outs
+
+        runs = {"float64, inline writes": lambda out: before(nn, batches, out, palette, transparency, args.codec)}
+        for writers in [0, args.writers]:
+            name = "uint8, {} writers".format(writers) if writers else "uint8, inline writes"
+            runs[name] = partial(
+                after, nn, batches, palette=palette, transparency=transparency, codec=args.codec, writers=writers
+            )
+        for i, (name, run) in enumerate(runs.items()):
+            start = time.perf_counter()
+            busy = run(os.path.join(tmp, str(i)))
+            wall = time.perf_counter() - start
+            print(
+                "| {:<22}| {:>9.2f} | {:>9.1f} | {:>17.1f}% |".format(
+                    name, args.batches * args.bs / wall, wall, 100 * busy / wall
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,8 @@ import colorsys
 import webcolors
 from pathlib import Path
 
+from torch.nn.parallel import DistributedDataParallel
+
 from abd_model.tiles import tile_pixel_to_location, tiles_to_geojson
 
 
@@ -96,6 +98,18 @@ def check_model(config):
     # TODO
 
 
+#
+# Checkpoint
+#
+def load_state_dict(nn, state_dict):
+    """Load a checkpoint state dict in a model, either wrapped by DistributedDataParallel or not."""
+
+    wrapped = isinstance(nn, DistributedDataParallel)
+    strip = lambda key: key[len("module.") :] if key.startswith("module.") else key  # noqa: E731
+    state_dict = {strip(key): value for key, value in state_dict.items()}
+    nn.load_state_dict({"module." + key: value for key, value in state_dict.items()} if wrapped else state_dict)
+
+
 #
 # Logs
 #
@@ -200,4 +214,4 @@ def web_ui(out, base_url, coverage_tiles, selected_tiles, ext, template, union_t
 
     if selected_tiles:
         with open(os.path.join(out, "tiles.json"), "w", encoding="utf-8") as fp:
-            fp.write(tiles_to_geojson(selected_tiles, union_tiles))
+            tiles_to_geojson(selected_tiles, union_tiles, fp=fp)
@@ -1,81 +1,211 @@
 """PyTorch-compatible datasets. Cf: https://pytorch.org/docs/stable/data.html """
 
 import os
+import json
 import numpy as np
+import mercantile
 import torch.utils.data
 
 from abd_model.da.core import to_tensor
-from abd_model.tiles import tiles_from_dir, tile_image_from_file, tile_label_from_file, tile_image_buffer, tile_is_neighboured
+from abd_model.tiles import (
+    tiles_root,
+    tiles_store,
+    tiles_from_dir,
+    tile_image_from_file,
+    tile_label_from_file,
+    tile_image_buffer,
+    tile_is_neighboured,
+    TilesNeighbours,
+    TilesCache,
+    TilesManifest,
+    Cover,
+)
+
+PACK = ".abd_pack"  # dataset dir, decoded samples pack: images.npy (N,C,H,W), labels.npy (N,H,W), tiles.npy (N,3)
 
 
 class SemSeg(torch.utils.data.Dataset):
-    def __init__(self, config, ts, root, cover=None, tiles_weights=None, mode=None, metatiles=False, keep_borders=False):
+    def __init__(
+        self,
+        config,
+        ts,
+        root,
+        cover=None,
+        tiles_weights=None,
+        mode=None,
+        metatiles=False,
+        keep_borders=False,
+        metatiles_cache=0,
+    ):
         super().__init__()
 
         self.mode = mode
         self.config = config
         self.tiles_weights = tiles_weights
         self.metatiles = metatiles
+        self.cache = TilesCache(metatiles_cache) if metatiles else None  # per DataLoader worker, decoded neighbours
+        self.cache_stats = None  # if set, with a shared tensor, each worker reports its cache hits and misses
         self.da = True if "da" in self.config["train"].keys() and self.config["train"]["da"]["p"] > 0.0 else False
 
         assert mode in ["train", "eval", "predict"]
 
-        path = os.path.join(root, config["channels"][0]["name"])
+        path = tiles_root(root, config["channels"][0]["name"])
         self.tiles_paths = [(tile, path) for tile, path in tiles_from_dir(path, cover=cover, xyz_path=True)]
         if metatiles:
-            self.metatiles_paths = self.tiles_paths
+            self.neighbours = {config["channels"][0]["name"]: TilesNeighbours(self.tiles_paths)}  # built once
             if not keep_borders:
-                self.tiles_paths = [
-                    (tile, path) for tile, path in self.metatiles_paths if tile_is_neighboured(tile, self.metatiles_paths)
-                ]
-        self.cover = {tile for tile, path in self.tiles_paths}
+                neighbours = self.neighbours[config["channels"][0]["name"]]
+                self.tiles_paths = [(tile, path) for tile, path in self.tiles_paths if tile_is_neighboured(tile, neighbours)]
+        self.cover = Cover(tile for tile, path in self.tiles_paths)
         assert len(self.tiles_paths), "Empty Dataset"
 
         self.tiles = {}
+        self.roots = {}  # tiles dir, or pack, of each channel, and labels
         num_channels = 0
         for channel in config["channels"]:
-            path = os.path.join(root, channel["name"])
+            path = tiles_root(root, channel["name"])
+            self.roots[channel["name"]] = path
             self.tiles[channel["name"]] = [
                 (tile, path) for tile, path in tiles_from_dir(path, cover=self.cover, xyz_path=True)
             ]
             num_channels += len(channel["bands"])
 
+            if metatiles and channel["name"] not in self.neighbours:  # each channel buffered with its own tiles
+                self.neighbours[channel["name"]] = TilesNeighbours(tiles_from_dir(path, cover=cover, xyz_path=True))
+
         self.shape_in = (num_channels,) + tuple(ts)  # C,W,H
+        self.shape_image = None  # H,W,C image buffer, learned on first sample
+        self.dtype_image = None
         self.shape_out = (len(config["classes"]),) + tuple(ts)  # C,W,H
 
         if self.mode in ["train", "eval"]:
-            path = os.path.join(root, "labels")
+            path = tiles_root(root, "labels")
+            self.roots["labels"] = path
             self.tiles["labels"] = [(tile, path) for tile, path in tiles_from_dir(path, cover=self.cover, xyz_path=True)]
 
             for channel in config["channels"]:  # Order images and labels accordingly
                 self.tiles[channel["name"]].sort(key=lambda tile: tile[0])
             self.tiles["labels"].sort(key=lambda tile: tile[0])
 
+        if self.metatiles:  # Spatially ordered (zoom, then Morton), so neighbours of consecutive samples are likely in cache
+            codes = lambda tiles_paths: Cover.encode([tile for tile, _ in tiles_paths])  # noqa: E731
+            order = lambda tiles_paths: [tiles_paths[i] for i in np.argsort(codes(tiles_paths), kind="stable")]  # noqa: E731
+            self.tiles_paths = order(self.tiles_paths)
+            for name in self.tiles.keys():
+                self.tiles[name] = order(self.tiles[name])
+
         assert len(self.tiles), "Empty Dataset"
 
+        self.pack = None  # if set, a decoded samples pack is read instead of tiles files
+        self.pack_rows = None
+        self.pack_images = None  # memory mapped, lazily in each process, so workers share the same page cache
+        self.pack_labels = None
+        if self.mode in ["train", "eval"] and not self.metatiles:
+            self.pack, self.pack_rows = self.find_pack(root)
+
+    def find_pack(self, root):
+        """Return a decoded samples pack path and rows to read in it, if consistent with the dataset, or None, None."""
+
+        path = os.path.join(os.path.expanduser(root), PACK)
+        try:
+            with open(os.path.join(path, "pack.json")) as fp:
+                pack = json.load(fp)
+            tiles = np.load(os.path.join(path, "tiles.npy"))
+        except (OSError, ValueError):
+            return None, None
+
+        if pack["channels"] != [[channel["name"], channel["bands"]] for channel in self.config["channels"]]:
+            return None, None
+        if pack.get("ts") != list(self.shape_in[1:]) or len(pack.get("fingerprints", [])) != len(tiles):
+            return None, None
+
+        rows = {mercantile.Tile(*map(int, tile)): row for row, tile in enumerate(tiles)}
+        if not all(tile in rows for tile, _ in self.tiles["labels"]):
+            return None, None
+
+        fingerprints = pack["fingerprints"]  # any source tile changed since packed, and the whole pack is outdated
+        if not all(fingerprints[rows[tile]] == self.fingerprint(i) for i, (tile, _) in enumerate(self.tiles["labels"])):
+            return None, None
+
+        return path, np.array([rows[tile] for tile, _ in self.tiles["labels"]])
+
+    def fingerprint(self, i):
+        """Return a sample fingerprint, changing with any of its channels, or label, tiles."""
+
+        paths = [(tiles_store(self.roots[name]), self.tiles[name][i][1]) for name in self.tiles.keys()]
+        return TilesManifest.hash([store.fingerprint(path) for store, path in paths])
+
+    def select(self, tiles):
+        """Restrict the dataset samples to the given tiles, keeping order, and metatiles neighbours, unchanged."""
+
+        cover = tiles if isinstance(tiles, Cover) else Cover(tiles)
+        inside = lambda tiles_paths: cover.contains([tile for tile, _ in tiles_paths])  # noqa: E731
+
+        self.tiles_paths = [tile_path for tile_path, keep in zip(self.tiles_paths, inside(self.tiles_paths)) if keep]
+        for name in self.tiles.keys():
+            keeps = inside(self.tiles[name])
+            if name == "labels" and self.pack is not None:
+                self.pack_rows = self.pack_rows[keeps]
+            self.tiles[name] = [tile_path for tile_path, keep in zip(self.tiles[name], keeps) if keep]
+
+        self.cover = Cover(tile for tile, _ in self.tiles_paths)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pack_images"] = state["pack_labels"] = None  # never pickle memory mapped arrays, as it copies them
+        return state
+
     def __len__(self):
         return len(self.tiles_paths)
 
-    def __getitem__(self, i):
+    def read_pack(self, i):
+        """Return a sample tile, image and label, from the decoded samples pack, with no copy."""
+
+        if self.pack_images is None:
+            self.pack_images = np.load(os.path.join(self.pack, "images.npy"), mmap_mode="r")
+            self.pack_labels = np.load(os.path.join(self.pack, "labels.npy"), mmap_mode="r")
+
+        row = self.pack_rows[i]
+        image = np.moveaxis(self.pack_images[row], 0, 2)  # C,H,W -> H,W,C view
+        mask = self.pack_labels[row]
+        if self.da:  # data augmentation needs contiguous and writable arrays
+            image, mask = np.ascontiguousarray(image), np.array(mask)
+
+        return self.tiles["labels"][i][0], image, mask
+
+    def read(self, i):
+        """Return a sample tile, image and label (if any), decoded from tiles files."""
 
         tile = None
         mask = None
-        image = None
+        image = np.empty(self.shape_image, dtype=self.dtype_image) if self.shape_image is not None else None
 
+        c = 0
         for channel in self.config["channels"]:
 
             image_channel = None
             tile, path = self.tiles[channel["name"]][i]
             bands = None if not channel["bands"] else channel["bands"]
+            out = image[:, :, c : c + len(bands)] if image is not None else None
 
             if self.metatiles:
-                image_channel = tile_image_buffer(tile, self.metatiles_paths, bands)
+                image_channel = tile_image_buffer(tile, self.neighbours[channel["name"]], bands, out=out, cache=self.cache)
             else:
-                image_channel = tile_image_from_file(path, bands)
+                image_channel = tile_image_from_file(path, bands, out=out)
 
             assert image_channel is not None, "Dataset channel {} not retrieved: {}".format(channel["name"], path)
 
-            image = np.concatenate((image, image_channel), axis=2) if image is not None else image_channel
+            if image is None:  # First sample: learn the image buffer layout, next ones will be read straight in it
+                self.shape_image = (*image_channel.shape[0:2], self.shape_in[0])
+                self.dtype_image = image_channel.dtype
+                image = np.empty(self.shape_image, dtype=self.dtype_image)
+                image[:, :, 0 : len(bands)] = image_channel.reshape(*image_channel.shape[0:2], -1)
+
+            c += len(bands)
+
+        if self.metatiles and self.cache_stats is not None:
+            worker = torch.utils.data.get_worker_info()
+            self.cache_stats[worker.id + 1 if worker else 0] = torch.tensor([self.cache.hits, self.cache.misses])
 
         if self.mode in ["train", "eval"]:
             assert tile == self.tiles["labels"][i][0], "Dataset mask inconsistency"
@@ -83,6 +213,13 @@ class SemSeg(torch.utils.data.Dataset):
             mask = tile_label_from_file(self.tiles["labels"][i][1])
             assert mask is not None, "Dataset mask not retrieved"
 
+        return tile, image, mask
+
+    def __getitem__(self, i):
+
+        tile, image, mask = self.read_pack(i) if self.pack is not None else self.read(i)
+
+        if self.mode in ["train", "eval"]:
             weight = self.tiles_weights[tile] if self.tiles_weights is not None and tile in self.tiles_weights else 1.0
 
             image, mask = to_tensor(self.config, self.shape_in[1:3], image, mask=mask, da=self.da)
@@ -6,7 +6,14 @@ import io
 import os
 import re
 import glob
+import time
+import hashlib
+import sqlite3
+import itertools
+import threading
+import collections
 import warnings
+import multiprocessing.util
 
 import numpy as np
 from PIL import Image
@@ -16,8 +23,14 @@ import cv2
 import json
 import psycopg2
 import rasterio
+import rasterio.io
+import rasterio.warp
+import rasterio.windows
+import rasterio.enums
+import rasterio.transform
 import mercantile
-import supermercado
+import shapely.ops
+import shapely.geometry
 
 warnings.simplefilter("ignore", UserWarning)  # To prevent rasterio NotGeoreferencedWarning
 
@@ -35,10 +48,126 @@ def tile_pixel_to_location(tile, dx, dy):
     return lerp(w, e, dx), lerp(s, n, dy)  # lon, lat
 
 
+class Cover:
+    """Tiles cover, as a sorted NumPy array of unique uint64 codes: zoom prefixed Morton (Z-order) codes.
+
+    Membership, union, intersection and difference are vectorized. Iteration yields tiles, ordered on zoom then Morton.
+    On disk binary format: MAGIC header, then little endian uint64 codes.
+    """
+
+    MAGIC = b"ABDCOVER\x01\x00\x00\x00\x00\x00\x00\x00"
+    MAX_ZOOM = 29  # x and y interleaved on 58 bits, zoom on the upper 6 ones
+
+    def __init__(self, tiles=None, codes=None):
+        codes = tiles.codes if isinstance(tiles, Cover) else codes
+        codes = np.asarray(codes if codes is not None else self.encode(tiles if tiles is not None else []), dtype=np.uint64)
+        self.codes = codes if np.all(codes[1:] > codes[:-1]) else np.unique(codes)  # sorted and unique
+
+    @staticmethod
+    def spread(v):
+        v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+        v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+        v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+        return (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+
+    @staticmethod
+    def compact(v):
+        v = v & np.uint64(0x5555555555555555)
+        v = (v | (v >> np.uint64(1))) & np.uint64(0x3333333333333333)
+        v = (v | (v >> np.uint64(2))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        v = (v | (v >> np.uint64(4))) & np.uint64(0x00FF00FF00FF00FF)
+        v = (v | (v >> np.uint64(8))) & np.uint64(0x0000FFFF0000FFFF)
+        return (v | (v >> np.uint64(16))) & np.uint64(0x00000000FFFFFFFF)
+
+    @classmethod
+    def encode(cls, tiles):
+        """Return codes, from tiles, or a N,3 array of x, y, z tiles coordinates."""
+
+        if isinstance(tiles, np.ndarray):
+            xyz = tiles.astype(np.uint64).reshape(-1, 3)
+        else:
+            xyz = np.fromiter(itertools.chain.from_iterable(tiles), dtype=np.uint64).reshape(-1, 3)
+        assert not len(xyz) or xyz[:, 2].max() <= cls.MAX_ZOOM, "Cover zoom levels above {} unsupported".format(cls.MAX_ZOOM)
+        return (xyz[:, 2] << np.uint64(58)) | cls.spread(xyz[:, 0]) | (cls.spread(xyz[:, 1]) << np.uint64(1))
+
+    @classmethod
+    def decode(cls, codes):
+        """Return a N,3 array of x, y, z tiles coordinates, from codes."""
+
+        codes = np.asarray(codes, dtype=np.uint64)
+        morton = codes & np.uint64((1 << 58) - 1)
+        return np.stack((cls.compact(morton), cls.compact(morton >> np.uint64(1)), codes >> np.uint64(58)), axis=1)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a cover, from either a binary cover file, or a CSV one (fast path, only x,y,z first columns are read)."""
+
+        path = os.path.expanduser(path)
+        with open(path, "rb") as fp:
+            if fp.read(len(cls.MAGIC)) == cls.MAGIC:
+                return cls(codes=np.fromfile(fp, dtype="<u8"))
+
+        with open(path) as fp:
+            text = fp.read()
+
+        xyz = re.findall("^[ \t]*([0-9]+)[,\t][ \t]*([0-9]+)[,\t][ \t]*([0-9]+)", text, re.MULTILINE)
+        if len(xyz) != text.count("\n") + int(not text.endswith("\n")):  # blank lines, or invalid ones
+            assert len(xyz) == len(re.findall("^[ \t]*[^ \t\r\n]", text, re.MULTILINE)), "Invalid Cover"
+
+        xyz = np.fromstring(",".join(itertools.chain.from_iterable(xyz)), dtype=np.uint64, sep=",") if xyz else []
+        return cls(np.asarray(xyz, dtype=np.uint64))
+
+    def to_file(self, path):
+        """Write the cover, in the binary cover format."""
+
+        with open(os.path.expanduser(path), "wb") as fp:
+            fp.write(self.MAGIC)
+            fp.write(self.codes.astype("<u8").tobytes())
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        for x, y, z in self.decode(self.codes).tolist():
+            yield mercantile.Tile(x, y, z)
+
+    def contains(self, tiles):
+        """Vectorized membership: return a bool array, for each tile (or code, if an uint64 array) in tiles."""
+
+        plain = isinstance(tiles, np.ndarray) and tiles.dtype == np.uint64 and tiles.ndim == 1
+        codes = tiles if plain else self.encode(tiles)
+        i = np.minimum(np.searchsorted(self.codes, codes), max(len(self.codes) - 1, 0))
+        return self.codes[i] == codes if len(self.codes) else np.zeros(len(codes), dtype=bool)
+
+    def __contains__(self, tile):
+        return bool(self.contains([tuple(map(int, tile))])[0])
+
+    def union(self, other):
+        return Cover(codes=np.union1d(self.codes, other.codes))
+
+    def intersection(self, other):
+        return Cover(codes=np.intersect1d(self.codes, other.codes, assume_unique=True))
+
+    def difference(self, other):
+        return Cover(codes=np.setdiff1d(self.codes, other.codes, assume_unique=True))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+
 def tiles_from_csv(path, xyz=True, extra_columns=False):
-    """Retrieve tiles from a line-delimited csv file."""
+    """Retrieve tiles from a line-delimited csv file (or a binary cover file). Plain tiles are loaded in a Cover."""
 
     assert os.path.isfile(os.path.expanduser(path)), "'{}' seems not a valid CSV file".format(path)
+    if xyz and not extra_columns:
+        return Cover.from_file(path)
+
+    return _tiles_from_csv_rows(path, xyz, extra_columns)
+
+
+def _tiles_from_csv_rows(path, xyz, extra_columns):
     with open(os.path.expanduser(path)) as fp:
 
         for row in fp:
@@ -62,21 +191,522 @@ def tiles_from_csv(path, xyz=True, extra_columns=False):
                     yield [row[0], *map(float, row[1:])]
 
 
+class TilesIndex:
+    """On-disk index of an XYZ tiles dir, built with os.scandir, and incrementally refreshed on directories mtimes."""
+
+    NAME = ".abd_index"
+    RACY_NS = 2 * 10 ** 9  # dirs modified so close to index timestamp, are rescanned (mtime granularity safety)
+
+    def __init__(self, root):
+        self.root = os.path.expanduser(root)
+        self.path = os.path.join(self.root, self.NAME)
+        self.timestamp = 0
+        self.dirs = {}  # (z, x) -> (mtime_ns, [(y, filename)])
+
+        try:
+            with open(self.path) as fp:
+                index = json.load(fp)
+            self.timestamp = index["timestamp"]
+            for key, (mtime, names) in index["dirs"].items():
+                z, x = map(int, key.split("/"))
+                self.dirs[(z, x)] = (mtime, [(int(y), name) for y, name in names])
+        except (OSError, ValueError, KeyError):
+            self.timestamp = 0
+            self.dirs = {}
+
+        self.refresh()
+
+    def scan(self, z, x):
+        """Scan a single z/x dir, returning its tiles sorted by y."""
+
+        names = []
+        try:
+            for entry in os.scandir(os.path.join(self.root, str(z), str(x))):
+                y = re.match("(?P<y>[0-9]+).*\\.", entry.name)
+                if y:
+                    names.append((int(y["y"]), entry.name))
+        except OSError:
+            pass
+
+        return sorted(names)
+
+    def refresh(self):
+        """Rescan only dirs whose mtime changed since last index update, and save the index if needed."""
+
+        dirs = {}
+        timestamp = time.time_ns()
+        try:
+            zs = [entry for entry in os.scandir(self.root) if entry.name.isdigit() and entry.is_dir()]
+        except OSError:
+            zs = []
+
+        for z in zs:
+            for x in os.scandir(z.path):
+                if not (x.name.isdigit() and x.is_dir()):
+                    continue
+
+                key = (int(z.name), int(x.name))
+                mtime = x.stat().st_mtime_ns
+                if key in self.dirs and self.dirs[key][0] == mtime and mtime < self.timestamp - self.RACY_NS:
+                    dirs[key] = self.dirs[key]
+                else:
+                    dirs[key] = (mtime, self.scan(*key))
+
+        # racy dirs, rescanned as modified too close to the index timestamp, but since out of the window: to be reused next
+        racy = any(self.timestamp - self.RACY_NS <= mtime < timestamp - self.RACY_NS for mtime, _ in dirs.values())
+        dirty = dirs != self.dirs or racy
+        self.dirs = dirs
+        if dirty:
+            self.timestamp = timestamp
+            self.save()
+
+    def save(self):
+        """Atomically write the index, if the tiles dir is writable."""
+
+        index = {
+            "timestamp": self.timestamp,
+            "dirs": {"{}/{}".format(z, x): [mtime, names] for (z, x), (mtime, names) in self.dirs.items()},
+        }
+
+        try:
+            tmp = "{}.{}".format(self.path, os.getpid())
+            with open(tmp, "w") as fp:
+                json.dump(index, fp, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def tiles(self):
+        """Yield every (tile, path) from the index."""
+
+        for (z, x) in sorted(self.dirs.keys()):
+            for y, name in self.dirs[(z, x)][1]:
+                yield mercantile.Tile(x, y, z), os.path.join(self.root, str(z), str(x), name)
+
+
+_tiles_indexes = {}
+
+
+def tiles_index(root):
+    """Return the, per process cached, index of an XYZ tiles dir."""
+
+    root = os.path.expanduser(root)
+    if root not in _tiles_indexes:
+        _tiles_indexes[root] = TilesIndex(root)
+
+    return _tiles_indexes[root]
+
+
+class TilesDir:
+    """XYZ tiles dir storage: a file per tile, as root/z/x/y.ext"""
+
+    def __init__(self, root):
+        self.root = os.path.expanduser(root)
+
+    def path(self, tile, ext):
+        return os.path.join(self.root, str(tile.z), str(tile.x), "{}.{}".format(tile.y, ext))
+
+    def tiles(self):
+        """Yield every (tile, path) in the store, sorted on z, x, y."""
+
+        index = tiles_index(self.root)
+        index.refresh()
+        yield from index.tiles()
+
+    def exists(self, path):
+        return os.path.isfile(path)
+
+    def fingerprint(self, path):
+        """Return a cheap tile fingerprint, changing with its content: size and mtime."""
+
+        stat = os.stat(path)
+        return "{}:{}".format(stat.st_size, stat.st_mtime_ns)
+
+    def remove(self, tile):
+        for path in glob.glob(os.path.join(self.root, str(tile.z), str(tile.x), "{}.*".format(tile.y))):
+            os.remove(path)
+        tiles_resolvers_forget(self.root, tile)
+
+    def read(self, path):
+        with open(path, "rb") as fp:
+            return fp.read()
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fp:
+            fp.write(data)
+
+        xyz = _tiles_xyz_path.search(path)
+        if xyz:
+            tiles_resolvers_forget(self.root, mercantile.Tile(int(xyz["x"]), int(xyz["y"]), int(xyz["z"])), xyz["ext"])
+
+    def flush(self):
+        pass
+
+
+class TilesPack:
+    """MBTiles (SQLite) tiles pack storage: every tile in a single file, reads and writes batched in transactions.
+
+    Tiles in a pack are addressed with virtual paths, as pack.mbtiles/z/x/y.ext, so packs and dirs can be used alike.
+    Writes are kept pending until BATCH tiles (or BATCH_BYTES) are reached, and then written in a single transaction,
+    holding the write lock as short as possible, so several processes can fill the same pack.
+    """
+
+    BATCH = 256
+    BATCH_BYTES = 64 * 2 ** 20
+
+    def __init__(self, path):
+        self.root = os.path.expanduser(path)
+        self.lock = threading.RLock()  # a connection and pending writes, shared by threads
+        self.pid = None
+        self.db = None
+        self.inherited = []  # connections inherited from a fork, never to be used nor closed
+        self.ext = None
+        self.pending = {}  # (z, x, y) -> data, not yet written
+        self.pending_bytes = 0
+        self.reads = 0  # reads done in the current read transaction
+
+    def connect(self, create=False):
+        """Return the SQLite connection of the current process, or None if the pack doesn't exist (and not create)."""
+
+        if self.pid != os.getpid():  # SQLite connections must not be shared across a fork
+            if self.db is not None:
+                self.inherited.append(self.db)
+            self.pid, self.db, self.ext, self.pending, self.pending_bytes, self.reads = os.getpid(), None, None, {}, 0, 0
+            multiprocessing.util.Finalize(self, self.flush, exitpriority=10)  # also on multiprocessing workers exit
+
+        if self.db is None and (create or os.path.isfile(self.root)):
+            if create and os.path.dirname(self.root):
+                os.makedirs(os.path.dirname(self.root), exist_ok=True)
+
+            self.db = sqlite3.connect(self.root, timeout=600, isolation_level=None, check_same_thread=False)
+            if create:
+                self.db.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer, nor the writer readers
+                self.db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)")
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS tiles "
+                    "(zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)"
+                )
+                self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
+
+        if self.db is not None and self.ext is None:
+            try:
+                row = self.db.execute("SELECT value FROM metadata WHERE name = 'format'").fetchone()
+                self.ext = row[0] if row else None
+            except sqlite3.OperationalError:  # empty pack, being created
+                pass
+
+        return self.db
+
+    def key(self, path):
+        z, x, y = os.path.relpath(path, self.root).split(os.sep)
+        return int(z), int(x), int(y.split(".")[0])
+
+    def path(self, tile, ext):
+        return os.path.join(self.root, str(tile.z), str(tile.x), "{}.{}".format(tile.y, ext))
+
+    def tiles(self):
+        """Yield every (tile, path) in the store, sorted on z, x, y."""
+
+        with self.lock:
+            self.flush()
+            db = self.connect()
+            self.end_reads()  # to see tiles written meanwhile, by others
+            query = "SELECT zoom_level, tile_column, tile_row FROM tiles ORDER BY zoom_level, tile_column, tile_row DESC"
+            rows = db.execute(query).fetchall() if db is not None else []
+
+        for z, x, row in rows:
+            tile = mercantile.Tile(x, (1 << z) - 1 - row, z)  # MBTiles rows are TMS ones, y flipped
+            yield tile, self.path(tile, self.ext)
+
+    def exists(self, path):
+        """Return True if the tile is pending or stored, as of now: outside of any read transaction, as remove()."""
+
+        z, x, y = self.key(path)
+        with self.lock:
+            db = self.connect()
+            if (z, x, y) in self.pending:
+                return True
+            if db is None:
+                return False
+
+            self.end_reads()  # to see tiles written meanwhile, by others
+            query = "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?"
+            return db.execute(query, (z, x, (1 << z) - 1 - y)).fetchone() is not None
+
+    def fingerprint(self, path):
+        """Return a cheap tile fingerprint, changing with its content, with no tile data read: size and rowid (tiles in a
+        pack have no mtime, but every write gets a new rowid, cf flush)."""
+
+        z, x, y = self.key(path)
+        with self.lock:
+            self.flush()
+            db = self.connect()
+            self.end_reads()
+            query = "SELECT length(tile_data), rowid FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?"
+            row = db.execute(query, (z, x, (1 << z) - 1 - y)).fetchone() if db is not None else None
+
+        if row is None:
+            raise FileNotFoundError(path)
+
+        return "{}:{}".format(*row)
+
+    def remove(self, tile):
+        with self.lock:
+            self.pending.pop((tile.z, tile.x, tile.y), None)
+            db = self.connect()
+            if db is None:
+                return
+
+            self.end_reads()
+            query = "DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?"
+            db.execute(query, (tile.z, tile.x, (1 << tile.z) - 1 - tile.y))
+        tiles_resolvers_forget(self.root, tile)
+
+    def read(self, path):
+        data = self.get(path)
+        if data is None:
+            raise FileNotFoundError(path)
+
+        return data
+
+    def get(self, path):
+        """Return tile data, pending or stored, reading up to BATCH tiles within the same read transaction."""
+
+        z, x, y = self.key(path)
+        with self.lock:
+            db = self.connect()
+            if (z, x, y) in self.pending:
+                return self.pending[(z, x, y)]
+            if db is None:
+                return None
+
+            if not self.reads:
+                db.execute("BEGIN")
+            self.reads += 1
+            query = "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?"
+            row = db.execute(query, (z, x, (1 << z) - 1 - y)).fetchone()
+            if self.reads >= self.BATCH:
+                self.end_reads()
+
+        return row[0] if row else None
+
+    def end_reads(self):
+        if self.reads and self.db is not None:
+            self.db.execute("COMMIT")
+            self.reads = 0
+
+    def write(self, path, data):
+        ext = os.path.splitext(path)[1][1:]
+        with self.lock:
+            self.connect()
+            self.ext = self.ext if self.ext else ext
+            assert self.ext == ext, "Unable to write {} tile, in a {} tiles pack: {}".format(ext, self.ext, self.root)
+
+            z, x, y = self.key(path)
+            self.pending[(z, x, y)] = data
+            self.pending_bytes += len(data)
+            tiles_resolvers_forget(self.root, mercantile.Tile(x, y, z), ext)
+            if len(self.pending) >= self.BATCH or self.pending_bytes >= self.BATCH_BYTES:
+                self.flush()
+
+    def flush(self):
+        """Write all pending tiles, in a single transaction."""
+
+        with self.lock:
+            if not self.pending or self.pid != os.getpid():
+                return
+
+            db = self.connect(create=True)
+            self.end_reads()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("DELETE FROM metadata WHERE name = 'format'")
+                db.execute("INSERT INTO metadata (name, value) VALUES ('format', ?)", (self.ext,))
+
+                # rowids never reused, even for a removed tile, so a tile fingerprint changes on each write
+                row = db.execute("SELECT value FROM metadata WHERE name = 'abd_rowid'").fetchone()
+                rowid = max(int(row[0]) if row else 0, db.execute("SELECT max(rowid) FROM tiles").fetchone()[0] or 0)
+                db.executemany(
+                    "INSERT OR REPLACE INTO tiles (rowid, zoom_level, tile_column, tile_row, tile_data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (rowid + i, z, x, (1 << z) - 1 - y, data)
+                        for i, ((z, x, y), data) in enumerate(self.pending.items(), 1)
+                    ],
+                )
+                db.execute("DELETE FROM metadata WHERE name = 'abd_rowid'")
+                db.execute("INSERT INTO metadata (name, value) VALUES ('abd_rowid', ?)", (str(rowid + len(self.pending)),))
+                db.execute("COMMIT")
+            except:
+                db.execute("ROLLBACK")
+                raise
+
+            self.pending, self.pending_bytes = {}, 0
+
+
+def tiles_pack(path):
+    """Return True if path is a tiles pack (i.e .mbtiles), rather than an XYZ tiles dir."""
+
+    return os.path.splitext(str(path))[1].lower() == ".mbtiles"
+
+
+def tiles_geotiff(path):
+    """Return True if path is a single GeoTIFF mosaic of tiles (i.e .tif), rather than an XYZ tiles dir."""
+
+    return os.path.splitext(str(path))[1].lower() in [".tif", ".tiff"]
+
+
+def tiles_out_dir(out):
+    """Return the dir to write logs and side files in, for an output tiles dir (itself), or tiles pack or GeoTIFF (its
+    dir)."""
+
+    out = os.path.expanduser(out)
+    return os.path.dirname(os.path.abspath(out)) if tiles_pack(out) or tiles_geotiff(out) else out
+
+
+def tiles_root(root, name):
+    """Return root/name tiles dir path, or root/name.mbtiles if such a tiles pack exists instead."""
+
+    path = os.path.join(os.path.expanduser(root), name)
+    return path + ".mbtiles" if not os.path.isdir(path) and os.path.isfile(path + ".mbtiles") else path
+
+
+_tiles_stores = {}
+_tiles_pack_path = re.compile("(.*?\\.mbtiles)(?:{}|$)".format(re.escape(os.sep)), re.IGNORECASE)
+
+
+def tiles_store(root):
+    """Return the, per process cached, storage of an XYZ tiles dir, or of a tiles pack (from its path or a tile one)."""
+
+    root = os.path.expanduser(root)
+    pack = _tiles_pack_path.match(root)
+    root = pack[1] if pack else root
+    if root not in _tiles_stores:
+        _tiles_stores[root] = TilesPack(root) if pack else TilesDir(root)
+
+    return _tiles_stores[root]
+
+
+def tile_open(path):
+    """Return what a tile reader can open: the tile file path, or if in a tiles pack, the tile data as a file object."""
+
+    path = os.path.expanduser(path)
+    return io.BytesIO(tiles_store(path).read(path)) if _tiles_pack_path.match(path) else path
+
+
+def source_fingerprint(path):
+    """Return a cheap source file fingerprint: absolute path, size and mtime."""
+
+    path = os.path.abspath(os.path.expanduser(path))
+    stat = os.stat(path)
+    return {"path": path, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+class TilesManifest:
+    """Provenance manifest of an output tiles dir or pack: for each tile, the signature of the inputs it was made from.
+
+    A signature hashes the run parameters (e.g config, checkpoint) and the tile own sources (e.g rasters fingerprints),
+    both recorded in the manifest, and optionally an unrecorded fingerprint (e.g of the tile image inputs).
+    Reruns so only regenerate tiles whose signature changed, and could remove stale tiles, no longer made by any input.
+    Stored as JSON, in root/.abd_manifest.json, or beside a pack (or GeoTIFF) as pack.mbtiles.abd_manifest.json, and kept
+    apart by scope, so several tools, or runs, could share the same output.
+    """
+
+    NAME = ".abd_manifest.json"
+
+    def __init__(self, root, scope, params):
+        self.root = os.path.expanduser(root)
+        single = tiles_pack(self.root) or tiles_geotiff(self.root)  # single file output, manifest beside it
+        self.path = self.root + self.NAME if single else os.path.join(self.root, self.NAME)
+
+        self.data = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as fp:
+                self.data = json.load(fp)
+        self.data.setdefault(scope, {"params": {}, "provenances": {}, "tiles": {}})
+        self.params = self.data[scope]["params"]  # params digest -> params
+        self.provenances = self.data[scope]["provenances"]  # provenance digest -> {"params": digest, "sources": [...]}
+        self.tiles = self.data[scope]["tiles"]  # "z/x/y" -> [signature, provenance digest, written]
+
+        self.digest = self.hash(params)
+        self.params[self.digest] = params
+
+    @staticmethod
+    def hash(data):
+        return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def key(tile):
+        return "{}/{}/{}".format(tile.z, tile.x, tile.y)
+
+    def signature(self, sources=None, fingerprint=""):
+        """Return the signature, and provenance digest, of a tile made from sources (recorded) and a fingerprint."""
+
+        provenance = {"params": self.digest, "sources": sources if sources else []}
+        digest = self.hash(provenance)
+        self.provenances.setdefault(digest, provenance)
+        return self.hash([digest, fingerprint]), digest
+
+    def fresh(self, tile, signature, ext=None):
+        """Return True if the tile was already made from the same inputs, and its output, if any, is still there."""
+
+        previous = self.tiles.get(self.key(tile))
+        if not previous or previous[0] != signature[0]:
+            return False
+
+        store = tiles_store(self.root)
+        return not previous[2] or ext is None or store.exists(store.path(tile, ext))
+
+    def written(self, tile):
+        previous = self.tiles.get(self.key(tile))
+        return bool(previous and previous[2])
+
+    def update(self, tile, signature, written=True):
+        self.tiles[self.key(tile)] = [*signature, bool(written)]
+
+    def stale(self, tiles):
+        """Return tiles in the manifest, but not among the given (current coverage) ones."""
+
+        current = set(self.key(tile) for tile in tiles)
+        stale = [list(map(int, key.split("/"))) for key in self.tiles.keys() if key not in current]
+        return [mercantile.Tile(x, y, z) for z, x, y in stale]
+
+    def remove(self, tiles):
+        """Remove tiles outputs, and their manifest entries."""
+
+        store = tiles_store(self.root)
+        for tile in tiles:
+            store.remove(tile)
+            self.tiles.pop(self.key(tile), None)
+
+    def save(self):
+        provenances = set(provenance for _, provenance, _ in self.tiles.values())
+        for digest in [digest for digest in self.provenances.keys() if digest not in provenances]:
+            del self.provenances[digest]
+        params = set(provenance["params"] for provenance in self.provenances.values())
+        for digest in [digest for digest in self.params.keys() if digest not in params]:
+            del self.params[digest]
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as fp:
+            json.dump(self.data, fp)
+        os.replace(self.path + ".tmp", self.path)  # atomic, an interrupted run keeps the previous manifest
+
+
 def tiles_from_dir(root, cover=None, xyz=True, xyz_path=False):
     """Loads files from an on-disk dir."""
     root = os.path.expanduser(root)
 
     if xyz is True:
-        paths = glob.glob(os.path.join(root, "[0-9]*/[0-9]*/[0-9]*.*"))
-
-        for path in paths:
-            tile_xyz = re.match(os.path.join(root, "(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+).+"), path)
-            if not tile_xyz:
-                continue
-            tile = mercantile.Tile(int(tile_xyz["x"]), int(tile_xyz["y"]), int(tile_xyz["z"]))
+        tiles = tiles_store(root).tiles()
+        if cover is not None:  # vectorized membership, rather than a lookup by tile
+            tiles = list(tiles)
+            cover = cover if isinstance(cover, Cover) else Cover(cover)
+            tiles = [tile for tile, inside in zip(tiles, cover.contains([tile for tile, _ in tiles])) if inside]
 
-            if cover is not None and tile not in cover:
-                continue
+        for tile, path in tiles:
 
             if xyz_path is True:
                 yield tile, path
@@ -90,16 +720,66 @@ def tiles_from_dir(root, cover=None, xyz=True, xyz_path=False):
             return path
 
 
+class TilesResolver:
+    """Resolve (x, y, z) to a tile path in an XYZ tiles dir, with a dict lookup, and a filesystem check on miss only."""
+
+    def __init__(self, root):
+        self.root = os.path.expanduser(root)
+        self.store = tiles_store(self.root)
+        self.paths = {}
+        for tile, path in tiles_from_dir(self.root, xyz_path=True):
+            self.paths.setdefault((tile.x, tile.y, tile.z), []).append(path)
+
+        self.exts = {os.path.splitext(paths[0])[1] for paths in self.paths.values()}  # learnt once, by dir
+
+    def __call__(self, x, y, z):
+        """Return tile and path, or None if not found."""
+
+        key = (int(x), int(y), int(z))
+        if key not in self.paths:
+            path = os.path.join(self.root, str(key[2]), str(key[0]), str(key[1]))
+            if self.exts:
+                paths = [path + ext for ext in self.exts if self.store.exists(path + ext)]
+            elif tiles_pack(self.root):
+                paths = []
+            else:
+                paths = glob.glob(path + ".*")
+            if not paths:
+                return None
+            self.paths[key] = paths
+
+        assert len(self.paths[key]) == 1, "ambiguous tile path"
+
+        return mercantile.Tile(*key), self.paths[key][0]
+
+    def forget(self, tile, ext=None):
+        """Forget a tile resolved path, and learn a new extension if any, so the tile is looked up again on next call."""
+
+        self.paths.pop((int(tile.x), int(tile.y), int(tile.z)), None)
+        if ext:
+            self.exts.add("." + ext)
+
+
+_tiles_resolvers = {}
+_tiles_xyz_path = re.compile("(?P<z>[0-9]+){0}(?P<x>[0-9]+){0}(?P<y>[0-9]+)\\.(?P<ext>[^.{0}]+)$".format(re.escape(os.sep)))
+
+
 def tile_from_xyz(root, x, y, z):
     """Retrieve a single tile from a slippy map dir."""
 
-    path = glob.glob(os.path.join(os.path.expanduser(root), str(z), str(x), str(y) + ".*"))
-    if not path:
-        return None
+    root = os.path.expanduser(root)
+    if root not in _tiles_resolvers:
+        _tiles_resolvers[root] = TilesResolver(root)
+
+    return _tiles_resolvers[root](x, y, z)
 
-    assert len(path) == 1, "ambiguous tile path"
 
-    return mercantile.Tile(x, y, z), path[0]
+def tiles_resolvers_forget(root, tile, ext=None):
+    """Forget a tile path cached by tile_from_xyz, as the tile is written (with ext) or removed, to look it up again."""
+
+    resolver = _tiles_resolvers.get(os.path.expanduser(root))
+    if resolver is not None:
+        resolver.forget(tile, ext)
 
 
 def tile_bbox(tile, mercator=False):
@@ -124,26 +804,119 @@ def tile_bbox(tile, mercator=False):
         assert False, "Unable to open tile"
 
 
-def tiles_to_geojson(tiles, union=True):
-    """Convert tiles to their footprint GeoJSON."""
+def tiles_in_footprint(raster, tiles, nodata=None, crs=None, size=1024):
+    """Vectorized cheap validity test, before any warp: return a bool array, False for tiles surely all nodata.
+
+    Raster footprint is computed at low resolution (lowest fitting overview, if any), from its dataset mask and, if
+    a nodata value is provided, from pixels being nodata on every band. Then dilated and reprojected on tiles grid.
+    """
+
+    if not tiles:
+        return np.zeros(0, dtype=bool)
+
+    z = tiles[0].z
+    xs, ys = np.array([tile.x for tile in tiles]), np.array([tile.y for tile in tiles])
+    x0, y0, nx, ny = xs.min(), ys.min(), xs.max() - xs.min() + 1, ys.max() - ys.min() + 1
+    k = max(1, min(8, 4096 // max(nx, ny)))  # grid pixels by tile side
+    west, _, _, north = mercantile.xy_bounds(mercantile.Tile(int(x0), int(y0), z))
+    _, south, east, _ = mercantile.xy_bounds(mercantile.Tile(int(x0 + nx - 1), int(y0 + ny - 1), z))
+
+    crs = crs if crs else raster.crs
+    bounds = rasterio.warp.transform_bounds("EPSG:3857", crs, west, south, east, north)
+    window = rasterio.windows.from_bounds(*bounds, transform=raster.transform).round_offsets().round_lengths()
+    window = window.intersection(rasterio.windows.Window(0, 0, raster.width, raster.height))  # only tiles extent
+
+    scale = max(1.0, max(window.width, window.height) / size)
+    h, w = max(1, round(window.height / scale)), max(1, round(window.width / scale))
+    footprint = np.ones((h, w), dtype=bool)
+    if any(rasterio.enums.MaskFlags.all_valid not in flags for flags in raster.mask_flag_enums):
+        footprint &= raster.dataset_mask(window=window, out_shape=(h, w)) > 0
+    if nodata is not None:
+        footprint &= np.any(raster.read(window=window, out_shape=(raster.count, h, w)) != nodata, axis=0)
+    footprint = cv2.dilate(footprint.astype(np.uint8), np.ones((3, 3), np.uint8))  # low resolution sampling margin
+    transform = raster.window_transform(window) * rasterio.Affine.scale(window.width / w, window.height / h)
+
+    grid = np.zeros((ny * k, nx * k), dtype=np.uint8)
+    rasterio.warp.reproject(
+        footprint,
+        grid,
+        src_transform=transform,
+        src_crs=crs,
+        dst_transform=rasterio.transform.from_bounds(west, south, east, north, nx * k, ny * k),
+        dst_crs="EPSG:3857",
+        resampling=rasterio.enums.Resampling.max,
+    )
+    grid = grid.reshape(ny, k, nx, k).max(axis=(1, 3))
+
+    return grid[ys - y0, xs - x0] > 0
+
+
+def tiles_union(tiles):
+    """Union tiles footprints, yielding GeoJSON Polygons geometries (EPSG:4326).
+
+    Runs of adjacent tiles are first merged, row by row, on the integer tiles grid, and identical runs on consecutive
+    rows are stacked in rectangles. So polygons union only deals with few rectangles, rather than every single tile.
+    """
+
+    rows = collections.defaultdict(list)
+    for tile in tiles:
+        rows[(int(tile.z), int(tile.y))].append(int(tile.x))
+
+    rectangles = []
+    for z in sorted({z for z, y in rows.keys()}):
+        opened = {}  # (x0, x1) run -> first row
+        previous = None
+        for y in sorted(y for _z, y in rows.keys() if _z == z):
+            xs = sorted(set(rows[(z, y)]))
+            runs = set()
+            x0 = xs[0]
+            for x, next_x in zip(xs, xs[1:] + [None]):
+                if next_x != x + 1:
+                    runs.add((x0, x))
+                    x0 = next_x
+
+            for run in list(opened.keys()):
+                if run not in runs or y != previous + 1:
+                    rectangles.append((z, *run, opened.pop(run), previous))
+            for run in runs:
+                opened.setdefault(run, y)
+            previous = y
+
+        rectangles.extend([(z, *run, y0, previous) for run, y0 in opened.items()])
+
+    polygons = []
+    for z, x0, x1, y0, y1 in rectangles:
+        w, n = mercantile.ul(x0, y0, z)
+        e, s = mercantile.ul(x1 + 1, y1 + 1, z)
+        polygons.append(shapely.geometry.box(w, s, e, n))
+
+    union = shapely.ops.unary_union(polygons)
+    for polygon in getattr(union, "geoms", [union]):
+        if not polygon.is_empty:
+            yield shapely.geometry.mapping(polygon)
+
+
+def tiles_to_geojson(tiles, union=True, fp=None):
+    """Convert tiles to their footprint GeoJSON. Streamed in fp file object if provided, returned as string if not."""
+
+    out = fp if fp is not None else io.StringIO()
+    out.write('{"type":"FeatureCollection","features":[')
 
     first = True
-    geojson = '{"type":"FeatureCollection","features":['
-
     if union:  # smaller tiles union geometries (but losing properties)
-        tiles = [str(tile.z) + "-" + str(tile.x) + "-" + str(tile.y) + "\n" for tile in tiles]
-        for feature in supermercado.uniontiles.union(tiles, True):
-            geojson += json.dumps(feature) if first else "," + json.dumps(feature)
+        for geometry in tiles_union(tiles):
+            geom = '"geometry":{}'.format(json.dumps(geometry))
+            out.write('{}{{"type":"Feature","properties":{{}},{}}}'.format("," if not first else "", geom))
             first = False
     else:  # keep each tile geometry and properties (but fat)
         for tile in tiles:
             prop = '"properties":{{"x":{},"y":{},"z":{}}}'.format(tile.x, tile.y, tile.z)
             geom = '"geometry":{}'.format(json.dumps(mercantile.feature(tile, precision=6)["geometry"]))
-            geojson += '{}{{"type":"Feature",{},{}}}'.format("," if not first else "", geom, prop)
+            out.write('{}{{"type":"Feature",{},{}}}'.format("," if not first else "", geom, prop))
             first = False
 
-    geojson += "]}"
-    return geojson
+    out.write("]}")
+    return out.getvalue() if fp is None else None
 
 
 def tiles_to_granules(tiles, pg):
@@ -154,9 +927,8 @@ def tiles_to_granules(tiles, pg):
     assert db
 
     granules = set()
-    tiles = [str(tile.z) + "-" + str(tile.x) + "-" + str(tile.y) + "\n" for tile in tiles]
-    for feature in supermercado.uniontiles.union(tiles, True):
-        geom = json.dumps(feature["geometry"])
+    for geometry in tiles_union(tiles):
+        geom = json.dumps(geometry)
         query = """SELECT id FROM abd.s2_granules
                    WHERE ST_Intersects(geom, ST_SetSRID(ST_GeomFromGeoJSON('{}'), 4326))""".format(
             geom
@@ -167,63 +939,124 @@ def tiles_to_granules(tiles, pg):
     return granules
 
 
-def tile_image_from_file(path, bands=None, force_rgb=False):
-    """Return a multiband image numpy array, from an image file path, or None."""
+def tile_image_from_file(path, bands=None, force_rgb=False, out=None):
+    """Return a multiband image numpy array, from an image file path, or None.
+
+    If out is set, with a preallocated H,W,C array (or view), all requested bands are read into it, in a single pass.
+    """
 
     try:
         if path[-3:] == "png" and force_rgb:  # PIL PNG Color Palette handling
-            return np.array(Image.open(os.path.expanduser(path)).convert("RGB"))
+            image = np.array(Image.open(tile_open(path)).convert("RGB"))
         elif path[-3:] == "png":
-            return np.array(Image.open(os.path.expanduser(path)))
+            image = np.array(Image.open(tile_open(path)))
         else:
-            raster = rasterio_open(os.path.expanduser(path))
+            raster = rasterio_open(tile_open(path))
     except:
         return None
 
-    image = None
-    for i in raster.indexes if bands is None else bands:
-        data_band = raster.read(i)
-        data_band = data_band.reshape(data_band.shape[0], data_band.shape[1], 1)  # H,W -> H,W,C
-        image = np.concatenate((image, data_band), axis=2) if image is not None else data_band
+    if path[-3:] == "png":
+        if out is None:
+            return image
+
+        image = image.reshape(image.shape[0], image.shape[1], -1)  # H,W -> H,W,C
+        assert out.shape == image.shape, "Unable to read {} in a {} buffer".format(path, out.shape)
+        out[:] = image
+        return out
+
+    with raster:
+        indexes = list(raster.indexes if bands is None else bands)
+        if out is None:
+            out = np.empty((raster.height, raster.width, len(indexes)), dtype=raster.dtypes[indexes[0] - 1])
+
+        assert out.shape == (raster.height, raster.width, len(indexes)), "Unable to read {} in a {} buffer".format(
+            path, out.shape
+        )
+        raster.read(indexes, out=np.moveaxis(out, 2, 0))  # H,W,C buffer seen as C,H,W
+
+    return out
+
 
-    assert image is not None, "Unable to open {}".format(path)
-    return image
+TILE_CODECS = {  # preset: (labels, 1 band images, 3 bands images, others images)
+    "default": ("png:optimize", "png", "webp", "tiff:lzw"),
+    "fast": ("png:1", "png:1", "png:1", "tiff:none"),
+    "small": ("png:9", "png:9", "webp:90", "tiff:deflate"),
+    "raw": ("tiff:none", "tiff:none", "tiff:none", "tiff:none"),
+}
+TILE_LABELS_TIFF = {"": "tiff_lzw", "none": None, "lzw": "tiff_lzw", "deflate": "tiff_adobe_deflate", "zstd": "zstd"}  # PIL
 
 
-def tile_image_to_file(root, tile, image, ext=None):
-    """ Write an image tile on disk. """
+def tile_codec(codec=None, C=3, label=False):
+    """Return ext, format and option to encode a tile, from a codec preset name, or a format[:option] (e.g png:1).
+
+    Options: png:[0-9|optimize], webp:[1-100|lossless], jpeg:[1-100], tiff:[none|lzw|deflate|zstd]
+    """
+
+    codec = codec if codec else "default"
+    if codec in TILE_CODECS:
+        labels, gray, rgb, others = TILE_CODECS[codec]
+        codec = labels if label else gray if C == 1 else rgb if C == 3 else others
+
+    ext, _, option = codec.partition(":")
+    fmt = {"jpg": "jpeg", "tif": "tiff"}.get(ext.lower(), ext.lower())
+
+    assert fmt in ["png", "webp", "jpeg", "tiff"], "Unsupported tile codec: {}".format(codec)
+    assert not label or fmt in ["png", "tiff"], "Labels tiles codec must be either png or tiff, not {}".format(codec)
+    assert not label or fmt != "tiff" or option in TILE_LABELS_TIFF, "Unsupported labels tiles codec: {}".format(codec)
+    assert label or fmt == "tiff" or C <= 4, "Tiles with {} bands need a tiff codec, not {}".format(C, codec)
+    assert label or fmt not in ["webp", "jpeg"] or C in [1, 3], "{} codec needs 1 or 3 bands tiles".format(codec)
+
+    return ext, fmt, option
+
+
+def tile_image_encode(image, fmt, option=""):
+    """Encode a H,W,C image, in the given format and option, and return it as bytes."""
 
     H, W, C = image.shape
 
-    root = os.path.expanduser(root)
-    path = os.path.join(root, str(tile.z), str(tile.x)) if isinstance(tile, mercantile.Tile) else root
-    os.makedirs(path, exist_ok=True)
+    if fmt == "png":
+        out = io.BytesIO()
+        params = {"optimize": True} if option == "optimize" else {"compress_level": int(option)} if option else {}
+        Image.fromarray(image.reshape(H, W) if C == 1 else image).save(out, format="PNG", **params)
+        return out.getvalue()
+
+    if fmt in ["webp", "jpeg"]:
+        if fmt == "webp":
+            params = [cv2.IMWRITE_WEBP_QUALITY, 101 if option == "lossless" else int(option)] if option else []
+        else:
+            params = [cv2.IMWRITE_JPEG_QUALITY, int(option)] if option else []
+
+        image = image if image.dtype == np.uint8 else image.astype(np.uint8)
+        ok, data = cv2.imencode("." + fmt, cv2.cvtColor(image, cv2.COLOR_RGB2BGR) if C == 3 else image, params)
+        assert ok
+        return data.tobytes()
+
+    if fmt == "tiff":
+        compress = option if option else "lzw"
+        params = {"compress": compress} if compress != "none" else {}
+        with rasterio.io.MemoryFile() as memfile:
+            with memfile.open(driver="GTiff", height=H, width=W, count=C, dtype=image.dtype, **params) as raster:
+                raster.write(np.moveaxis(image, 2, 0))  # H,W,C -> C,H,W
+            return memfile.read()
 
-    if C == 1:
-        ext = "png"
-    elif C == 3:
-        ext = ext if ext is not None else "webp"  # allow to switch to jpeg (for old browser)
-    else:
-        ext = "tiff"
 
+def tile_image_to_file(root, tile, image, ext=None, codec=None):
+    """ Write an image tile, in a tiles dir or pack. """
+
+    H, W, C = image.shape
+
+    codec = codec if codec else ext if C == 3 else None  # ext allow to switch to jpeg (for old browser)
+    ext, fmt, option = tile_codec(codec, C)
+
+    store = tiles_store(root)
     if isinstance(tile, mercantile.Tile):
-        path = os.path.join(path, "{}.{}".format(str(tile.y), ext))
+        path = store.path(tile, ext)
     else:
-        path = os.path.join(path, "{}.{}".format(tile, ext))
+        assert isinstance(store, TilesDir), "Tiles packs only store XYZ tiles"
+        path = os.path.join(store.root, "{}.{}".format(tile, ext))
 
     try:
-        if C == 1:
-            Image.fromarray(image.reshape(H, W), mode="L").save(path)
-        elif C == 3:
-            try:
-                cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
-            except:
-                image = image.astype('uint8')
-                cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
-        else:
-            rasterio.open(path, "w", driver="GTiff", compress="lzw", height=H, width=W, count=C, dtype=image.dtype).write(
-                np.moveaxis(image, 2, 0)  # H,W,C -> C,H,W
-            )
+        store.write(path, tile_image_encode(image, fmt, option))
     except:
         assert False, "Unable to write {}".format(path)
 
@@ -232,35 +1065,48 @@ def tile_label_from_file(path, silent=True):
     """Return a numpy array, from a label file path, or None."""
 
     try:
-        return np.array(Image.open(os.path.expanduser(path))).astype(int)
+        return np.array(Image.open(tile_open(path))).astype(int)
     except:
         assert silent, "Unable to open existing label: {}".format(path)
 
 
-def tile_label_to_file(root, tile, palette, transparency, label, append=False, margin=0):
-    """ Write a label (or a mask) tile on disk. """
+def tile_label_encode(label, palette, transparency, fmt, option=""):
+    """Encode a H,W label (or mask), with its palette, in the given format and option, and return it as bytes."""
+
+    out = io.BytesIO()
+    image = Image.fromarray(label, mode="P")
+    image.putpalette(palette)
+
+    if fmt == "png":
+        params = {"optimize": True} if option == "optimize" else {"compress_level": int(option)} if option else {}
+        if transparency is not None:
+            params["transparency"] = transparency
+        image.save(out, format="PNG", **params)
+
+    if fmt == "tiff":
+        image.save(out, format="TIFF", compression=TILE_LABELS_TIFF[option])
+
+    return out.getvalue()
 
-    root = os.path.expanduser(root)
-    dir_path = os.path.join(root, str(tile.z), str(tile.x)) if isinstance(tile, mercantile.Tile) else root
-    path = os.path.join(dir_path, "{}.png".format(str(tile.y)))
+
+def tile_label_to_file(root, tile, palette, transparency, label, append=False, margin=0, codec=None):
+    """ Write a label (or a mask) tile, in a tiles dir or pack. """
+
+    ext, fmt, option = tile_codec(codec, label=True)
+
+    store = tiles_store(root)
+    path = store.path(tile, ext)
 
     if len(label.shape) == 3:  # H,W,C -> H,W
         assert label.shape[2] == 1
         label = label.reshape((label.shape[0], label.shape[1]))
 
-    if append and os.path.isfile(path):
+    if append and store.exists(path):
         previous = tile_label_from_file(path, silent=False)
         label = np.uint8(np.maximum(previous, label))
-    else:
-        os.makedirs(dir_path, exist_ok=True)
 
     try:
-        out = Image.fromarray(label, mode="P")
-        out.putpalette(palette)
-        if transparency is not None:
-            out.save(path, optimize=True, transparency=transparency)
-        else:
-            out.save(path, optimize=True)
+        store.write(path, tile_label_encode(label, palette, transparency, fmt, option))
     except:
         assert False, "Unable to write {}".format(path)
 
@@ -278,56 +1124,80 @@ def tile_image_from_url(requests_session, url, timeout=10):
         return None
 
 
+class TilesNeighbours(dict):
+    """Neighbours index: for each tile, paths of its 3x3 surrounding tiles, or None if missing.
+
+    Paths are ordered as (upper, center, bottom) x (left, center, right): ul, uc, ur, cl, cc, cr, bl, bc, br
+    """
+
+    def __init__(self, tiles):
+        super().__init__()
+
+        paths = {mercantile.Tile(*map(int, tile)): path for tile, path in tiles}
+        for tile in paths.keys():
+            x, y, z = tile
+            self[tile] = tuple(paths.get(mercantile.Tile(x + dx, y + dy, z)) for dy in (-1, 0, 1) for dx in (-1, 0, 1))
+
+        self.neighboured = {tile for tile, neighbours in self.items() if None not in neighbours}
+
+
 def tile_is_neighboured(tile, tiles):
     """Check if a tile is surrounded by others tiles"""
 
-    tiles = dict(tiles)
-    try:
-        # 3x3 matrix (upper, center, bottom) x (left, center, right)
-        tiles[mercantile.Tile(x=int(tile.x) - 1, y=int(tile.y) - 1, z=int(tile.z))]  # ul
-        tiles[mercantile.Tile(x=int(tile.x) + 0, y=int(tile.y) - 1, z=int(tile.z))]  # uc
-        tiles[mercantile.Tile(x=int(tile.x) + 1, y=int(tile.y) - 1, z=int(tile.z))]  # ur
-        tiles[mercantile.Tile(x=int(tile.x) - 1, y=int(tile.y) + 0, z=int(tile.z))]  # cl
-        tiles[mercantile.Tile(x=int(tile.x) + 1, y=int(tile.y) + 0, z=int(tile.z))]  # cr
-        tiles[mercantile.Tile(x=int(tile.x) - 1, y=int(tile.y) + 1, z=int(tile.z))]  # bl
-        tiles[mercantile.Tile(x=int(tile.x) + 0, y=int(tile.y) + 1, z=int(tile.z))]  # bc
-        tiles[mercantile.Tile(x=int(tile.x) + 1, y=int(tile.y) + 1, z=int(tile.z))]  # br
-    except KeyError:
-        return False
-
-    return True
-
-
-def tile_image_buffer(tile, tiles, bands):
-    """Buffers a tile image adding borders on all sides based on adjacent tile, or zeros padded if not possible."""
-
-    def tile_image_neighbour(tile, dx, dy, tiles, bands):
-        """Retrieves neighbour tile image if exists."""
-        try:
-            path = tiles[mercantile.Tile(x=int(tile.x) + dx, y=int(tile.y) + dy, z=int(tile.z))]
-        except KeyError:
-            return None
+    tiles = tiles if isinstance(tiles, TilesNeighbours) else TilesNeighbours(tiles)
+
+    return mercantile.Tile(*map(int, tile)) in tiles.neighboured
+
+
+class TilesCache:
+    """Bounded LRU cache of decoded tiles images, with hits and misses counters."""
+
+    def __init__(self, size):
+        self.size = size
+        self.images = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def image(self, path, bands=None):
+        """Return a tile image, from cache if available, or read from file. Cached images are shared, don't modify."""
+
+        key = (path, tuple(bands) if bands is not None else None)
+        if key in self.images:
+            self.hits += 1
+            self.images.move_to_end(key)
+            return self.images[key]
+
+        self.misses += 1
+        image = tile_image_from_file(path, bands)
+        if self.size:
+            self.images[key] = image
+            if len(self.images) > self.size:
+                self.images.popitem(last=False)
+
+        return image
+
+
+def tile_image_buffer(tile, tiles, bands, out=None, cache=None):
+    """Buffers a tile image adding borders on all sides based on adjacent tile, or zeros padded if not possible.
+
+    If out is set, with a preallocated H,W,C array (or view), the buffered image is written into it.
+    If cache is set, with a TilesCache, neighbours already decoded are retrieved from it.
+    """
 
-        return tile_image_from_file(path, bands)
+    read = cache.image if cache is not None else tile_image_from_file
+    tiles = tiles if isinstance(tiles, TilesNeighbours) else TilesNeighbours(tiles)
+    neighbours = [read(path, bands) if path else None for path in tiles[mercantile.Tile(*map(int, tile))]]
 
-    tiles = dict(tiles)
     # 3x3 matrix (upper, center, bottom) x (left, center, right)
-    ul = tile_image_neighbour(tile, -1, -1, tiles, bands)
-    uc = tile_image_neighbour(tile, +0, -1, tiles, bands)
-    ur = tile_image_neighbour(tile, +1, -1, tiles, bands)
-    cl = tile_image_neighbour(tile, -1, +0, tiles, bands)
-    cc = tile_image_neighbour(tile, +0, +0, tiles, bands)
-    cr = tile_image_neighbour(tile, +1, +0, tiles, bands)
-    bl = tile_image_neighbour(tile, -1, +1, tiles, bands)
-    bc = tile_image_neighbour(tile, +0, +1, tiles, bands)
-    br = tile_image_neighbour(tile, +1, +1, tiles, bands)
+    ul, uc, ur, cl, cc, cr, bl, bc, br = neighbours
 
     b = len(bands)
     ts = cc.shape[1]
     o = int(ts / 4)
     oo = o * 2
 
-    img = np.zeros((ts + oo, ts + oo, len(bands))).astype(np.uint8)
+    img = np.zeros((ts + oo, ts + oo, len(bands)), dtype=np.uint8) if out is None else out
+    assert img.shape == (ts + oo, ts + oo, b), "Unable to buffer {} in a {} buffer".format(tile, img.shape)
 
     # fmt:off
     img[0:o,        0:o,        :] = ul[-o:ts, -o:ts, :] if ul is not None else np.zeros((o,   o, b)).astype(np.uint8)
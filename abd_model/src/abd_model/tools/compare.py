@@ -4,14 +4,14 @@ import json
 import torch
 import concurrent.futures as futures
 
-from PIL import Image
 from tqdm import tqdm
 import numpy as np
 
 from mercantile import feature
 
 from abd_model.core import web_ui, Logs, load_module, load_config
-from abd_model.tiles import tiles_from_dir, tile_from_xyz, tiles_from_csv, tile_image_from_file, tile_image_to_file
+from abd_model.tiles import tiles_from_dir, tiles_from_csv, tiles_pack, tiles_out_dir, TilesResolver
+from abd_model.tiles import tile_image_from_file, tile_label_from_file, tile_image_to_file, tile_codec
 
 
 def add_parser(subparser, formatter_class):
@@ -24,11 +24,14 @@ def add_parser(subparser, formatter_class):
     inp = parser.add_argument_group("Inputs")
     choices = ["side", "stack", "list"]
     inp.add_argument("--mode", type=str, default="side", choices=choices, help="compare mode [default: side]")
-    inp.add_argument("--labels", type=str, help="path to tiles labels directory [required for metrics filtering]")
-    inp.add_argument("--masks", type=str, help="path to tiles masks directory [required for metrics filtering)")
+    help = "path to tiles labels directory or .mbtiles pack [required for metrics filtering]"
+    inp.add_argument("--labels", type=str, help=help)
+    help = "path to tiles masks directory or .mbtiles pack [required for metrics filtering]"
+    inp.add_argument("--masks", type=str, help=help)
     help = "path to config file [required for metrics filtering, if no global config setting]"
     inp.add_argument("--config", type=str, help=help)
-    inp.add_argument("--images", type=str, nargs="+", help="path to images directories [required for stack or side modes]")
+    help = "path to images directories or .mbtiles packs [required for stack or side modes]"
+    inp.add_argument("--images", type=str, nargs="+", help=help)
     inp.add_argument("--cover", type=str, help="path to csv tiles cover file, to filter tiles to tile [optional]")
     inp.add_argument("--workers", type=int, help="number of workers [default: CPU]")
 
@@ -44,7 +47,9 @@ def add_parser(subparser, formatter_class):
     out.add_argument("--vertical", action="store_true", help="output vertical image aggregate [optionnal for side mode]")
     out.add_argument("--geojson", action="store_true", help="output results as GeoJSON [optionnal for list mode]")
     out.add_argument("--format", type=str, default="webp", help="output images file format [default: webp]")
-    out.add_argument("--out", type=str, help="output path")
+    help = "tiles codec, either a preset: default, fast, small, raw or a format:option (e.g png:1, webp:90, tiff:none)"
+    out.add_argument("--codec", type=str, help=help)
+    out.add_argument("--out", type=str, help="output path (directory, or .mbtiles pack, for side and stack modes)")
 
     ui = parser.add_argument_group("Web UI")
     ui.add_argument("--web_ui_base_url", type=str, help="alternate Web UI base URL")
@@ -64,7 +69,7 @@ def main(args):
         config = load_config(args.config)
 
     args.out = os.path.expanduser(args.out)
-    cover = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))] if args.cover else None
+    cover = tiles_from_csv(os.path.expanduser(args.cover)) if args.cover else None
 
     args_minmax = set()
     args.min = {(m[0], m[1]): m[2] for m in args.min} if args.min else dict()
@@ -86,6 +91,9 @@ def main(args):
     if not args.workers:
         args.workers = os.cpu_count()
 
+    if args.codec:
+        args.format = tile_codec(args.codec)[0]
+
     print("neo compare {} on CPU, with {} workers".format(args.mode, args.workers), file=sys.stderr, flush=True)
 
     if args.images:
@@ -106,10 +114,14 @@ def main(args):
             assert sorted(tiles_masks) == sorted(tiles_labels), "Label and Mask directories are not consistent"
             tiles = tiles_masks
 
+    resolvers = [TilesResolver(root) for root in args.images] if args.images else []
+    if args.masks and args.labels:
+        labels, masks = TilesResolver(args.labels), TilesResolver(args.masks)
+
     tiles_list = []
     tiles_compare = []
     progress = tqdm(total=len(tiles), ascii=True, unit="tile")
-    log = False if args.mode == "list" else Logs(os.path.join(args.out, "log"))
+    log = False if args.mode == "list" else Logs(os.path.join(tiles_out_dir(args.out), "log"))
 
     with futures.ThreadPoolExecutor(args.workers) as executor:
 
@@ -118,8 +130,8 @@ def main(args):
 
             if args.masks and args.labels:
 
-                label = np.array(Image.open(os.path.join(args.labels, z, x, "{}.png".format(y))))
-                mask = np.array(Image.open(os.path.join(args.masks, z, x, "{}.png".format(y))))
+                label = tile_label_from_file(labels(x, y, z)[1])
+                mask = tile_label_from_file(masks(x, y, z)[1])
 
                 assert label.shape == mask.shape, "Inconsistent tiles (size or dimensions)"
 
@@ -142,8 +154,8 @@ def main(args):
             tiles_compare.append(tile)
 
             if args.mode == "side":
-                for i, root in enumerate(args.images):
-                    img = tile_image_from_file(tile_from_xyz(root, x, y, z)[1], force_rgb=True)
+                for i, resolver in enumerate(resolvers):
+                    img = tile_image_from_file(resolver(x, y, z)[1], force_rgb=True)
 
                     if i == 0:
                         side = np.zeros((img.shape[0], img.shape[1] * len(args.images), 3))
@@ -157,11 +169,11 @@ def main(args):
                     else:
                         side[:, i * image_shape[0] : (i + 1) * image_shape[0], :] = img
 
-                tile_image_to_file(args.out, tile, np.uint8(side))
+                tile_image_to_file(args.out, tile, np.uint8(side), ext=args.format, codec=args.codec)
 
             elif args.mode == "stack":
-                for i, root in enumerate(args.images):
-                    tile_image = tile_image_from_file(tile_from_xyz(root, x, y, z)[1], force_rgb=True)
+                for i, resolver in enumerate(resolvers):
+                    tile_image = tile_image_from_file(resolver(x, y, z)[1], force_rgb=True)
 
                     if i == 0:
                         image_shape = tile_image.shape[0:2]
@@ -170,7 +182,7 @@ def main(args):
                         assert image_shape == tile_image.shape[0:2], "Unconsistent image size to compare"
                         stack = stack + (tile_image / len(args.images))
 
-                tile_image_to_file(args.out, tile, np.uint8(stack))
+                tile_image_to_file(args.out, tile, np.uint8(stack), ext=args.format, codec=args.codec)
 
             elif args.mode == "list":
                 tiles_list.append([tile, metrics])
@@ -214,6 +226,9 @@ def main(args):
 
     base_url = args.web_ui_base_url if args.web_ui_base_url else "."
 
+    if tiles_pack(args.out):
+        args.no_web_ui = True  # Web UI needs XYZ tiles dirs
+
     if args.mode == "side" and not args.no_web_ui:
         template = "compare.html" if not args.web_ui_template else args.web_ui_template
         web_ui(args.out, base_url, tiles, tiles_compare, args.format, template, union_tiles=False)
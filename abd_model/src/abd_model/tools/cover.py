@@ -12,7 +12,7 @@ from mercantile import tiles, xy_bounds
 from rasterio import open as rasterio_open
 from rasterio.warp import transform_bounds
 
-from abd_model.tiles import tiles_from_dir, tiles_from_csv, tiles_to_geojson
+from abd_model.tiles import tiles_from_dir, tiles_from_csv, tiles_to_geojson, tiles_in_footprint, Cover
 from abd_model.geojson import geojson_srid, geojson_parse_feature
 
 
@@ -25,13 +25,18 @@ def add_parser(subparser, formatter_class):
     inp.add_argument("--dir", type=str, help="plain tiles dir path")
     inp.add_argument("--bbox", type=str, help="a lat/lon bbox: xmin,ymin,xmax,ymax or a bbox: xmin,xmin,xmax,xmax,EPSG:xxxx")
     inp.add_argument("--geojson", type=str, nargs="+", help="path to GeoJSON features files")
-    inp.add_argument("--cover", type=str, help="a cover file path")
+    inp.add_argument("--cover", type=str, nargs="+", help="cover file paths (CSV or binary cover), several ones with --op")
     inp.add_argument("--raster", type=str, nargs="+", help="a raster file path")
     inp.add_argument("--sql", type=str, help="SQL to retrieve geometry features (e.g SELECT geom FROM a_table)")
 
     db = parser.add_argument_group("Spatial DataBase [required with --sql input]")
     db.add_argument("--pg", type=str, help="PostgreSQL dsn using psycopg2 syntax (e.g 'dbname=db user=postgres')")
 
+    algebra = parser.add_argument_group("Set algebra [with several --cover inputs]")
+    choices = ["union", "intersection", "difference"]
+    help = "set operation, applied in turn between --cover inputs (e.g a - b - c with difference)"
+    algebra.add_argument("--op", type=str, choices=choices, help=help)
+
     tile = parser.add_argument_group("Tiles")
     tile.add_argument("--no_xyz", action="store_true", help="if set, tiles are not expected to be XYZ based.")
 
@@ -39,10 +44,13 @@ def add_parser(subparser, formatter_class):
     out.add_argument("--zoom", type=int, help="zoom level of tiles [required, except with --dir or --cover inputs]")
     help = "Output type (default: cover)"
     out.add_argument("--crs", type=str, help="CRS of input rasters")
+    help = "nodata value of input rasters, to skip tiles nodata on every band, besides rasters masks [optional]"
+    out.add_argument("--nodata", type=int, choices=range(0, 256), metavar="[0-255]", help=help)
     out.add_argument("--type", type=str, choices=["cover", "extent", "geojson"], default="cover", help=help)
     out.add_argument("--union", action="store_true", help="if set, union adjacent tiles, imply --type geojson")
     out.add_argument("--splits", type=str, help="if set, shuffle and split in several cover subpieces (e.g 50/15/35)")
-    out.add_argument("--out", type=str, nargs="*", help="cover output paths [required except with --type extent]")
+    help = "cover output paths, binary cover format if .cover extension [required except with --type extent]"
+    out.add_argument("--out", type=str, nargs="*", help=help)
 
     parser.set_defaults(func=main)
 
@@ -54,6 +62,8 @@ def main(args):
     assert not (args.type != "extent" and not args.out), "--out mandatory [except with --type extent]"
     assert not (args.union and args.type != "geojson"), "--union imply --type geojson"
     assert not (args.sql and not args.pg), "--sql option imply --pg"
+    assert not (args.cover and len(args.cover) > 1 and not args.op), "Several --cover inputs imply --op"
+    assert not (args.op and not args.cover), "--op option imply --cover inputs"
     assert (
         int(args.bbox is not None)
         + int(args.geojson is not None)
@@ -77,6 +87,7 @@ def main(args):
     if args.raster:
         print("abd cover from {} at zoom {}".format(args.raster, args.zoom), file=sys.stderr, flush=True)
         cover = set()
+        skipped = set()
         for raster_file in args.raster:
             with rasterio_open(os.path.expanduser(raster_file)) as r:
                 try:
@@ -88,8 +99,14 @@ def main(args):
                     print("WARNING: projection error, SKIPPING: {}".format(raster_file), file=sys.stderr, flush=True)
                     continue
 
-                cover.update([tile for tile in tiles(w, s, e, n, args.zoom)])
+                raster_tiles = list(tiles(w, s, e, n, args.zoom))
+                valid = tiles_in_footprint(r, raster_tiles, args.nodata, args.crs)  # cheap footprint, before any warp
+                cover.update([tile for tile, inside in zip(raster_tiles, valid) if inside])
+                skipped.update([tile for tile, inside in zip(raster_tiles, valid) if not inside])
 
+        skipped = len(skipped - cover)
+        if skipped:
+            print("abd cover: {} tiles skipped, as nodata on rasters footprints".format(skipped), file=sys.stderr)
         cover = list(cover)
 
     if args.geojson:
@@ -150,7 +167,10 @@ def main(args):
 
     if args.cover:
         print("abd cover from {}".format(args.cover), file=sys.stderr, flush=True)
-        cover = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))]
+        cover = tiles_from_csv(os.path.expanduser(args.cover[0]))
+        for path in args.cover[1:]:
+            cover = getattr(cover, args.op)(tiles_from_csv(os.path.expanduser(path)))
+        cover = list(cover)
 
     if args.dir:
         print("abd cover from {}".format(args.dir), file=sys.stderr, flush=True)
@@ -159,16 +179,14 @@ def main(args):
     assert len(cover), "Empty tiles inputs"
 
     _cover = []
+    _zoomed = set()
     extent_w, extent_s, extent_n, extent_e = (180.0, 90.0, -180.0, -90.0)
     for tile in tqdm(cover, ascii=True, unit="tile"):
         if args.zoom and tile.z != args.zoom:
             w, s, n, e = transform_bounds("EPSG:3857", "EPSG:4326", *xy_bounds(tile))
             for t in tiles(w, s, n, e, args.zoom):
-                unique = True
-                for _t in _cover:
-                    if _t == t:
-                        unique = False
-                if unique:
+                if t not in _zoomed:
+                    _zoomed.add(t)
                     _cover.append(t)
         else:
             if args.type == "extent":
@@ -210,8 +228,12 @@ def main(args):
             if os.path.dirname(args.out[i]) and not os.path.isdir(os.path.dirname(args.out[i])):
                 os.makedirs(os.path.dirname(args.out[i]), exist_ok=True)
 
+            if args.type == "cover" and os.path.splitext(args.out[i])[1] == ".cover":
+                Cover(cover).to_file(args.out[i])
+                continue
+
             with open(args.out[i], "w") as fp:
                 if args.type == "geojson":
-                    fp.write(tiles_to_geojson(cover, union=args.union))
+                    tiles_to_geojson(cover, union=args.union, fp=fp)
                 else:
                     csv.writer(fp).writerows(cover)
@@ -1,11 +1,13 @@
 import os
 import sys
+import json
 import torch
 import numpy as np
 from tqdm import tqdm
 from torch.utils.data import DataLoader
 from abd_model.core import load_config, check_classes, check_channels
-from abd_model.tiles import tiles_from_dir, tile_label_from_file, tiles_from_csv
+from abd_model.tiles import tiles_root, tiles_from_dir, tile_label_from_file, tiles_from_csv
+from abd_model.loaders.semseg import SemSeg, PACK
 
 
 def add_parser(subparser, formatter_class):
@@ -16,8 +18,9 @@ def add_parser(subparser, formatter_class):
     parser.add_argument("--cover", type=str, help="path to csv tiles cover file, to filter tiles dataset on [optional]")
     parser.add_argument("--workers", type=int, help="number of workers [default: CPU]")
 
-    choices = ["check", "weights"]
-    parser.add_argument("--mode", type=str, default="check", choices=choices, help="dataset mode [default: check]")
+    choices = ["check", "weights", "pack"]
+    help = "dataset mode, pack: decode once the dataset, in a memory mapped samples pack, used by train [default: check]"
+    parser.add_argument("--mode", type=str, default="check", choices=choices, help=help)
     parser.set_defaults(func=main)
 
 
@@ -25,7 +28,7 @@ class LabelsDataset(torch.utils.data.Dataset):
     def __init__(self, root, num_classes, cover=None):
         super().__init__()
         self.num_classes = num_classes
-        self.tiles = [path for tile, path in tiles_from_dir(os.path.join(root, "labels"), cover=cover, xyz_path=True)]
+        self.tiles = [path for tile, path in tiles_from_dir(tiles_root(root, "labels"), cover=cover, xyz_path=True)]
         assert len(self.tiles), "Empty Dataset"
 
     def __len__(self):
@@ -49,10 +52,62 @@ def compute_classes_weights(dataset, classes, cover, workers):
     return weights.round(3, out=weights).tolist()
 
 
+class PackDataset(torch.utils.data.Dataset):
+    def __init__(self, dataset):
+        super().__init__()
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, i):
+        tile, image, mask = self.dataset.read(i)
+        assert image.dtype == np.uint8, "Only 8 bits images datasets can be packed: {}".format(tile)
+        image = torch.from_numpy(np.ascontiguousarray(np.moveaxis(image, 2, 0)))  # H,W,C -> C,H,W
+        mask = torch.from_numpy(mask.astype(np.uint8))
+        return i, image, mask, torch.IntTensor([tile.x, tile.y, tile.z]), self.dataset.fingerprint(i)
+
+
+def pack_dataset(dataset, config, cover, workers):
+    """Decode once all dataset samples, and write them in memory mappable arrays, in the dataset PACK dir."""
+
+    samples = SemSeg(config, config["model"]["ts"], dataset, cover, mode="train")
+    _, image, mask = samples.read(0)
+    H, W, C = image.shape
+
+    path = os.path.join(os.path.expanduser(dataset), PACK)
+    os.makedirs(path, exist_ok=True)
+    if os.path.isfile(os.path.join(path, "pack.json")):
+        os.remove(os.path.join(path, "pack.json"))  # previous pack invalidated, until the new one is complete
+
+    N = len(samples)
+    images = np.lib.format.open_memmap(os.path.join(path, "images.npy"), mode="w+", dtype=np.uint8, shape=(N, C, H, W))
+    labels = np.lib.format.open_memmap(os.path.join(path, "labels.npy"), mode="w+", dtype=np.uint8, shape=(N, H, W))
+    tiles = np.zeros((N, 3), dtype=np.int64)
+    fingerprints = [None] * N  # each sample source tiles, for train to check the pack is still consistent with them
+
+    loader = DataLoader(PackDataset(samples), batch_size=workers, num_workers=workers)
+    for rows, image, mask, tile, fingerprint in tqdm(loader, desc="Pack", unit="batch", ascii=True):
+        images[rows] = image.numpy()
+        labels[rows] = mask.numpy()
+        tiles[rows] = tile.numpy()
+        for row, row_fingerprint in zip(rows.tolist(), fingerprint):
+            fingerprints[row] = row_fingerprint
+
+    images.flush()
+    labels.flush()
+    np.save(os.path.join(path, "tiles.npy"), tiles)
+    with open(os.path.join(path, "pack.json"), "w") as fp:
+        channels = [[channel["name"], channel["bands"]] for channel in config["channels"]]
+        json.dump({"channels": channels, "ts": list(samples.shape_in[1:]), "fingerprints": fingerprints}, fp)
+
+    return N, images.nbytes + labels.nbytes
+
+
 def main(args):
 
     assert os.path.isdir(os.path.expanduser(args.dataset)), "--dataset path is not a directory"
-    args.cover = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))] if args.cover else None
+    args.cover = tiles_from_csv(os.path.expanduser(args.cover)) if args.cover else None
     config = load_config(args.config)
 
     if not args.workers:
@@ -70,3 +125,9 @@ def main(args):
         check_classes(config)
         weights = compute_classes_weights(args.dataset, config["classes"], args.cover, args.workers)
         print(",".join(map(str, weights)))
+
+    if args.mode == "pack":
+        check_classes(config)
+        check_channels(config)
+        samples, size = pack_dataset(args.dataset, config, args.cover, args.workers)
+        print("{} samples packed, in {:.1f} GB".format(samples, size / 2 ** 30), file=sys.stderr, flush=True)
@@ -8,7 +8,7 @@ from tqdm import tqdm
 from mercantile import xy_bounds
 
 from abd_model.core import web_ui, Logs
-from abd_model.tiles import tiles_from_csv, tile_image_from_url, tile_image_to_file
+from abd_model.tiles import tiles_from_csv, tile_image_from_url, tile_image_to_file, tile_codec
 
 
 def add_parser(subparser, formatter_class):
@@ -29,6 +29,8 @@ def add_parser(subparser, formatter_class):
 
     out = parser.add_argument_group("Output")
     out.add_argument("--format", type=str, default="webp", help="file format to save images in [default: webp]")
+    help = "tiles codec, either a preset: default, fast, small, raw or a format:option (e.g png:1, webp:90, tiff:none)"
+    out.add_argument("--codec", type=str, help=help)
     out.add_argument("--out", type=str, required=True, help="output directory path [required]")
 
     ui = parser.add_argument_group("Web UI")
@@ -45,6 +47,7 @@ def main(args):
     assert len(tiles), "Empty cover: {}".format(args.cover)
 
     args.workers = min(os.cpu_count(), args.rate) if not args.workers else args.workers
+    args.format = tile_codec(args.codec)[0] if args.codec else args.format
 
     if os.path.dirname(os.path.expanduser(args.out)):
         os.makedirs(os.path.expanduser(args.out), exist_ok=True)
@@ -86,7 +89,7 @@ def main(args):
                         return tile, url, False
 
                 try:
-                    tile_image_to_file(args.out, tile, res)
+                    tile_image_to_file(args.out, tile, res, ext=args.format, codec=args.codec)
                 except OSError:
                     return tile, url, False
 
@@ -40,7 +40,7 @@ def add_parser(subparser, formatter_class):
 
 def main(args):
     config = load_config(args.config)
-    args.cover = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))] if args.cover else None
+    args.cover = tiles_from_csv(os.path.expanduser(args.cover)) if args.cover else None
     if args.classes_weights:
         try:
             args.classes_weights = list(map(float, args.classes_weights.split(",")))
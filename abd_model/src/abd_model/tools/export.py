@@ -1,12 +1,13 @@
 import os
 import sys
+import json
 import uuid
 import torch
 import torch.onnx
 import torch.autograd
 
 import abd_model as abd
-from abd_model.core import load_module
+from abd_model.core import load_module, load_state_dict
 
 
 def add_parser(subparser, formatter_class):
@@ -84,6 +85,8 @@ def main(args):
     print("Model: {}".format(nn_name, file=sys.stderr))
     print("UUID: {}".format(UUID, file=sys.stderr))
 
+    load_state_dict(nn, chkpt["state_dict"])  # plain model, whether the checkpoint was saved from DDP or not
+
     if args.type == "pth":
 
         states = {
@@ -108,24 +111,32 @@ def main(args):
 
     else:
 
-        try:  # https://github.com/pytorch/pytorch/issues/9176
-            nn.module.state_dict(chkpt["state_dict"])
-        except AttributeError:
-            nn.state_dict(chkpt["state_dict"])
-
         nn.eval()
 
         batch = torch.rand(1, *shape_in)
 
         if args.type == "onnx":
+            import onnx  # optional dependency, only for ONNX export
+
             torch.onnx.export(
                 nn,
                 torch.autograd.Variable(batch),
                 args.out,
-                input_names=["input", "shape_in", "shape_out"],
+                input_names=["input"],
                 output_names=["output"],
                 dynamic_axes={"input": {0: "num_batch"}, "output": {0: "num_batch"}},
             )
 
+            metadata = {"uuid": str(UUID), "nn": nn_name, "encoder": encoder, "loader": loader, "doc_string": doc_string}
+            metadata.update({"shape_in": json.dumps(list(shape_in)), "shape_out": json.dumps(list(shape_out))})
+            metadata.update({"model_version": json.dumps(chkpt.get("model_version")), "producer_version": abd.__version__})
+            model = onnx.load(args.out)  # metadata embedded, so abd predict could run the ONNX model alone
+            for key, value in metadata.items():
+                prop = model.metadata_props.add()
+                prop.key, prop.value = key, value
+            onnx.save(model, args.out)  # weights inlined, so a side external data file, if any, is obsolete
+            if os.path.isfile(args.out + ".data"):
+                os.remove(args.out + ".data")
+
         if args.type == "jit":
             torch.jit.trace(nn, batch).save(args.out)
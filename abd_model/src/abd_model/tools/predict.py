@@ -1,6 +1,12 @@
 import os
+import json
+import time
 import uuid
+import threading
+import collections
 from tqdm import tqdm
+import concurrent.futures as futures
+from functools import partial
 
 import math
 import mercantile
@@ -12,8 +18,21 @@ import torch.multiprocessing as mp
 from torch.utils.data import DataLoader
 from torch.nn.parallel import DistributedDataParallel
 
-from abd_model.core import load_config, load_module, check_classes, check_channels, make_palette, web_ui, Logs
-from abd_model.tiles import tile_label_to_file, tiles_from_csv
+import rasterio
+from rasterio import open as rasterio_open
+from rasterio.shutil import copy as rasterio_copy
+from rasterio.windows import Window
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+
+from abd_model.core import load_config, load_module, load_state_dict, check_classes, check_channels, make_palette, web_ui
+from abd_model.core import Logs
+from abd_model.tiles import tiles_from_csv, tiles_pack, tiles_store, tiles_out_dir, tile_label_to_file, tile_codec
+from abd_model.tiles import tile_image_to_file, tiles_geotiff
+from abd_model.tiles import tiles_root, source_fingerprint, TilesManifest, TilesCache, Cover
+from abd_model.tools.tile import tiles_blocks, composite_block, is_nodata, worker_footprint
+from abd_model.tools.tile import rasters_coverage, rasters_tiles_map, rasters_priority, rasters_tasks
+from abd_model.da.core import to_tensor
 
 
 def add_parser(subparser, formatter_class):
@@ -22,19 +41,77 @@ def add_parser(subparser, formatter_class):
     )
 
     inp = parser.add_argument_group("Inputs")
-    inp.add_argument("--dataset", type=str, help="predict dataset directory path [required]")
-    inp.add_argument("--checkpoint", type=str, required=True, help="path to the trained model to use [required]")
+    inp.add_argument("--dataset", type=str, help="predict dataset directory path [required, if no --rasters]")
+    help = "path to the trained model to use, either a .pth checkpoint, or an exported .onnx one [required]"
+    inp.add_argument("--checkpoint", type=str, required=True, help=help)
     inp.add_argument("--config", type=str, help="path to config file [required, if no global config setting]")
     inp.add_argument("--cover", type=str, help="path to csv tiles cover file, to filter tiles to predict [optional]")
+    help = "if set, tiles all nodata, or near constant, get an empty mask, with no inference"
+    inp.add_argument("--skip_empty", action="store_true", help=help)
+    help = "with --skip_empty, near constant tiles max pixels standard deviation, on every band [default: 1.0]"
+    inp.add_argument("--skip_std", type=float, default=1.0, help=help)
+    help = "path to csv tiles cover file, of tiles to get an empty mask, with no inference (e.g water, clouds) [optional]"
+    inp.add_argument("--skip_cover", type=str, help=help)
+
+    ras = parser.add_argument_group("Rasters")
+    help = (
+        "path to raster files to predict, tiled on the fly, with no intermediate tiles dataset [required, if no --dataset]"
+    )
+    ras.add_argument("--rasters", type=str, nargs="+", help=help)
+    ras.add_argument("--zoom", type=int, help="zoom level of tiles [required, with --rasters]")
+    ras.add_argument("--bands", type=str, help="list of 1-n index bands to select (e.g 1,2,3) [default: all]")
+    help = "on overlapping rasters, first valid pixel from: first or last listed raster, or finest resolution one"
+    ras.add_argument(
+        "--priority", type=str, default="first", choices=["first", "last", "finest"], help=help + " [default: first]"
+    )
+    help = "nodata pixel value, used to skip coverage border's tiles, and with --skip_empty, all nodata ones [default: 0]"
+    ras.add_argument("--nodata", type=int, default=0, choices=range(0, 256), metavar="[0-255]", help=help)
+    help = "Skip tile if nodata pixel ratio > threshold. [default: 100]"
+    ras.add_argument("--nodata_threshold", type=int, default=100, choices=range(0, 101), metavar="[0-100]", help=help)
 
     out = parser.add_argument_group("Outputs")
-    out.add_argument("--out", type=str, required=True, help="output directory path [required]")
+    help = "output directory, or .mbtiles pack, or .tif single GeoTIFF in EPSG:3857, tiled and overviewed, path [required]"
+    out.add_argument("--out", type=str, required=True, help=help)
     out.add_argument("--metatiles", action="store_true", help="if set, use surrounding tiles to avoid margin effects")
-    out.add_argument("--keep_borders", action="store_true", help="if set, with --metatiles, force borders tiles to be kept")
+    help = "if set, force borders tiles to be kept: with --metatiles, unneighboured ones, with --rasters, nodata bordered"
+    out.add_argument("--keep_borders", action="store_true", help=help)
+    help = "if set, predict by mosaic blocks of N x N adjacent tiles, with sliding and blended windows [default: none]"
+    out.add_argument("--mosaic", type=int, metavar="N", help=help)
+    help = "with --mosaic, margin read around each block, and overlap between blended windows, in pixels [default: ts/4]"
+    out.add_argument("--mosaic_overlap", type=int, help=help)
+    help = "with --mosaic, sliding window side, in pixels, bounding memory use [default: 2 x (ts + overlap), ts with .onnx]"
+    out.add_argument("--mosaic_window", type=int, help=help)
+    help = "tiles codec, either a preset: default, fast, small, raw or a format:option (e.g png:1, webp:90, tiff:none)"
+    out.add_argument("--codec", type=str, help=help)
+    help = (
+        "output directory, or .mbtiles pack, path, to also store classes probabilities, as uint8 quantized tiles [optional]"
+    )
+    out.add_argument("--probs", type=str, help=help)
+    help = "with --probs, probabilities tiles codec, a lossless format:option (e.g png:1, tiff:zstd) [default: png, or tiff]"
+    out.add_argument("--probs_codec", type=str, help=help)
+    out.add_argument("--force", action="store_true", help="if set, predict again all tiles, even already up to date ones")
+    out.add_argument("--remove_stale", action="store_true", help="if set, remove masks no longer in dataset coverage")
 
     perf = parser.add_argument_group("Performances")
+    help = "device to predict on: cuda, sharded on every GPU, or cpu, sharded on --processes [default: cuda if available]"
+    perf.add_argument("--device", type=str, choices=["cuda", "cpu"], help=help)
+    perf.add_argument("--processes", type=int, default=1, help="with cpu device, number of processes [default: 1]")
+    help = "with cpu device, number of intra-op threads, per process [default: CPU / processes]"
+    perf.add_argument("--threads", type=int, help=help)
+    help = "with an .onnx checkpoint, ONNX Runtime graph optimizations level [default: all]"
+    perf.add_argument(
+        "--onnx_optimization", type=str, default="all", choices=["disable", "basic", "extended", "all"], help=help
+    )
     perf.add_argument("--bs", type=int, help="batch size [default: CPU/GPU]")
-    perf.add_argument("--workers", type=int, help="number of pre-processing images workers, per GPU [default: batch_size]")
+    help = "number of pre-processing images workers, per GPU or process [default: batch_size on GPU, 1 on CPU]"
+    perf.add_argument("--workers", type=int, help=help)
+    help = "number of background threads, encoding and writing masks, per GPU or process (0 to write inline) [default: 2]"
+    perf.add_argument("--writers", type=int, default=2, help=help)
+    help = "with --metatiles or --mosaic, number of decoded tiles kept in cache, per worker [default: 64]"
+    perf.add_argument("--metatiles_cache", type=int, default=64, help=help)
+    help = "with --rasters, side, in tiles, of blocks of adjacent tiles warped and read at once, per worker [default: 4]"
+    perf.add_argument("--block", type=int, default=4, help=help)
+    perf.add_argument("--warp_threads", type=int, default=1, help="with --rasters, threads for each warp [default: 1]")
 
     ui = parser.add_argument_group("Web UI")
     ui.add_argument("--web_ui_base_url", type=str, help="alternate Web UI base URL")
@@ -44,56 +121,622 @@ def add_parser(subparser, formatter_class):
     parser.set_defaults(func=main)
 
 
-def gpu_worker(rank, world_size, lock_file, args, config, dataset, palette, transparency):
+class ShardSampler(torch.utils.data.Sampler):
+    """Split a dataset in contiguous shards, one per process, keeping dataset order and without any padding."""
+
+    def __init__(self, dataset, num_replicas, rank):
+        self.start = rank * len(dataset) // num_replicas
+        self.end = (rank + 1) * len(dataset) // num_replicas
+
+    def __iter__(self):
+        return iter(range(self.start, self.end))
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class MosaicBlocks(torch.utils.data.Dataset):
+    """Predict dataset of mosaic blocks: up to size x size adjacent tiles, read as a single image, plus a margin from
+    surrounding tiles. Each sample is a C,H,W image, and its N,3 tiles (x, y, z), the image origin on their min x, y."""
+
+    def __init__(self, dataset, size, margin, cache=0):
+        super().__init__()
+
+        self.dataset = dataset
+        self.size = size
+        self.margin = margin
+        self.cache = TilesCache(cache)  # per DataLoader worker, decoded blocks rings are likely read again by next block
+        self.paths = {channel["name"]: dict(dataset.tiles[channel["name"]]) for channel in dataset.config["channels"]}
+        self.select(dataset.cover)
+
+    @property
+    def cover(self):
+        return self.dataset.cover
+
+    @property
+    def tiles(self):
+        return self.dataset.tiles
+
+    def select(self, tiles):
+        """Restrict the predicted tiles, and so blocks. Surrounding tiles are still read, as blocks context."""
+
+        self.dataset.select(tiles)
+        self.blocks = tiles_blocks([tile for tile, _ in self.dataset.tiles_paths], self.size)
+
+    def context(self, name, tile):
+        """Return paths of every channel tile a tile prediction depends on: its whole block, and the ring around it."""
+
+        x0, y0 = tile.x // self.size * self.size, tile.y // self.size * self.size
+        r = range(-1, self.size + 1)
+        return tuple(self.paths[name].get(mercantile.Tile(x0 + dx, y0 + dy, tile.z)) for dy in r for dx in r)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, i):
+
+        block = self.blocks[i]
+        x0, y0 = min(tile.x for tile in block), min(tile.y for tile in block)
+        x1, y1 = max(tile.x for tile in block), max(tile.y for tile in block)
+        H, W = self.dataset.shape_in[1:3]
+        m = self.margin
+
+        image = None
+        c = 0
+        for channel in self.dataset.config["channels"]:
+            bands = channel["bands"]
+            for y in range(y0 - 1, y1 + 2):
+                for x in range(x0 - 1, x1 + 2):
+                    path = self.paths[channel["name"]].get(mercantile.Tile(x, y, block[0].z))
+                    if not path:
+                        continue  # missing tile, zeros padded
+
+                    tile_image = self.cache.image(path, bands)
+                    assert tile_image is not None, "Dataset channel {} not retrieved: {}".format(channel["name"], path)
+                    if image is None:
+                        shape = ((y1 - y0 + 1) * H + 2 * m, (x1 - x0 + 1) * W + 2 * m, self.dataset.shape_in[0])
+                        image = np.zeros(shape, dtype=tile_image.dtype)
+
+                    top, left = m + (y - y0) * H, m + (x - x0) * W  # tile position in block image, clipped to it
+                    t, l, b, r = max(top, 0), max(left, 0), min(top + H, image.shape[0]), min(left + W, image.shape[1])
+                    if t < b and l < r:
+                        part = tile_image.reshape(H, W, -1)[t - top : b - top, l - left : r - left]
+                        image[t:b, l:r, c : c + len(bands)] = part
+            c += len(bands)
+
+        tiles = torch.IntTensor([[tile.x, tile.y, tile.z] for tile in block])
+        return to_tensor(self.dataset.config, (W, H), image, resize=False, da=False), tiles
+
+
+def image_empty(image, ts, nodata, std):
+    """Check if a C,H,W image tensor, cropped on its W,H ts center (e.g from a metatile), is all nodata, or near constant."""
+
+    top, left = (image.shape[1] - ts[1]) // 2, (image.shape[2] - ts[0]) // 2
+    image = image[:, top : top + ts[1], left : left + ts[0]]
+    return bool((image == nodata).all()) or image.flatten(1).std(dim=1).max().item() <= std
+
+
+class EmptyTiles(torch.utils.data.Dataset):
+    """Predict dataset of chunks of consecutive tiles, but the empty ones, so only tiles worth an inference are batched.
+    Each sample is a N,C,H,W images tensor, its N,3 tiles (x, y, z), no tiles removed, and the M,3 empty tiles."""
+
+    def __init__(self, dataset, chunk, ts, nodata, std):
+        super().__init__()
+
+        self.dataset = dataset
+        self.chunk = chunk
+        self.ts = ts
+        self.nodata = nodata
+        self.std = std
+
+    @property
+    def cover(self):
+        return self.dataset.cover
+
+    @property
+    def cache_stats(self):
+        return self.dataset.cache_stats
+
+    @cache_stats.setter
+    def cache_stats(self, cache_stats):
+        self.dataset.cache_stats = cache_stats
+
+    def __len__(self):
+        return math.ceil(len(self.dataset) / self.chunk)
+
+    def __getitem__(self, i):
+
+        images, tiles, empty = [], [], []
+        for j in range(i * self.chunk, min((i + 1) * self.chunk, len(self.dataset))):
+            image, tile = self.dataset[j]
+            if image_empty(image, self.ts, self.nodata, self.std):
+                empty.append(tile)
+                continue
+
+            images.append(image)
+            tiles.append(tile)
+
+        images = torch.stack(images) if images else torch.zeros((0, *image.shape))
+        tiles = torch.stack(tiles) if tiles else torch.zeros((0, 3), dtype=torch.int)
+        empty = torch.stack(empty) if empty else torch.zeros((0, 3), dtype=torch.int)
+        return images, tiles, torch.zeros((0, 3), dtype=torch.int), empty
+
+
+class RastersBlocks(torch.utils.data.Dataset):
+    """Predict dataset tiled on the fly from rasters, as abd tile does: blocks of adjacent tiles, warped and read at once.
+    Each sample is a N,C,H,W images tensor, its N,3 tiles (x, y, z), the M,3 tiles removed, as nodata, and the K,3
+    empty ones, with --skip_empty."""
+
+    def __init__(self, args, config, tasks, ts):
+        super().__init__()
+
+        self.args = args  # bands, nodata, nodata_threshold, keep_borders, warp_threads and label, as abd tile ones
+        self.config = config
+        self.tasks = tasks
+        self.ts = ts
+        self.bands = [band - 1 for band in config["channels"][0]["bands"]]  # channel bands, among rasters ones
+        self.cover = Cover(tile for _, block in tasks for tile, _ in block)
+
+    def select(self, tiles):
+        """Restrict the dataset to the given tiles, blocks still read at once."""
+
+        cover = tiles if isinstance(tiles, Cover) else Cover(tiles)
+        tasks = []
+        for rasters, block in self.tasks:
+            keeps = cover.contains([tile for tile, _ in block])
+            block = [tile_covers for tile_covers, keep in zip(block, keeps) if keep]
+            if block:
+                tasks.append((rasters, block))
+
+        self.tasks = tasks
+        self.cover = Cover(tile for _, block in tasks for tile, _ in block)
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __getitem__(self, i):
+
+        rasters, block = self.tasks[i]
+        W, H = self.ts
+        images = composite_block(self.args, rasters, block, W, H)  # warps kept, by DataLoader worker
 
-    dist.init_process_group(backend="nccl", init_method="file://" + lock_file, world_size=world_size, rank=rank)
-    torch.cuda.set_device(rank)
-    chkpt = torch.load(args.checkpoint, map_location=torch.device(rank))
-    nn_module = load_module("abd_model.nn.{}".format(chkpt["nn"].lower()))
-    nn = getattr(nn_module, chkpt["nn"])(chkpt["shape_in"], chkpt["shape_out"], chkpt["encoder"].lower()).to(rank)
-    nn = DistributedDataParallel(nn, device_ids=[rank], find_unused_parameters=True)
+        tensors, tiles, nodata, empty = [], [], [], []
+        for tile, _ in block:
+            image = images[tile]
+            if is_nodata(image, self.args.nodata, self.args.nodata_threshold, self.args.keep_borders):
+                nodata.append(tile)
+                continue
 
-    chkpt = torch.load(os.path.expanduser(args.checkpoint), map_location="cuda:{}".format(rank))
-    assert nn.module.version == chkpt["model_version"], "Model Version mismatch"
-    nn.load_state_dict(chkpt["state_dict"])
+            image = to_tensor(self.config, (W, H), image[:, :, self.bands], resize=False, da=False)
+            if self.args.skip_empty and image_empty(image, self.ts, self.args.nodata, self.args.skip_std):
+                empty.append(tile)
+                continue
 
-    sampler = torch.utils.data.distributed.DistributedSampler(dataset, num_replicas=world_size, rank=rank)
-    loader = DataLoader(dataset, batch_size=args.bs, shuffle=False, num_workers=args.workers, sampler=sampler)
+            tensors.append(image)
+            tiles.append(tile)
+
+        images = torch.stack(tensors) if tensors else torch.zeros((0, len(self.bands), H, W))
+        xyz = lambda tiles: torch.IntTensor([[tile.x, tile.y, tile.z] for tile in tiles]).view(-1, 3)  # noqa: E731
+        return images, xyz(tiles), xyz(nodata), xyz(empty)
+
+
+def blocks_batches(blocks, bs, writer, shape):
+    """Yield batches of bs tiles (but the last one), repacked from blocks of variable number of tiles. Tiles removed,
+    as nodata, have their previous outputs, if any, removed as obsolete, and empty ones get an H,W shape empty mask."""
+
+    images, tiles = [], []
+    for block_images, block_tiles, nodata, empty in blocks:
+        writer.remove(nodata)
+        writer.write_empty(empty, shape)
+        images.append(block_images)
+        tiles.append(block_tiles)
+
+        while sum(len(block_tiles) for block_tiles in tiles) >= bs:
+            images, tiles = [torch.cat(images)], [torch.cat(tiles)]
+            yield images[0][:bs], tiles[0][:bs]
+            images, tiles = [images[0][bs:]], [tiles[0][bs:]]
+
+    if sum(len(block_tiles) for block_tiles in tiles):
+        yield torch.cat(images), torch.cat(tiles)
+
+
+def mosaic_probs(nn, image, tiles, ts, margin, window, bs, device):
+    """Predict a mosaic block image by sliding windows, blending their overlaps, and return each block tile output."""
+
+    def starts(length, window):  # as few windows as possible, evenly spread, overlapping at least on margin
+        window = min(window, length)
+        n = math.ceil((length - margin) / max(window - margin, 1))
+        return [round(i * (length - window) / max(n - 1, 1)) for i in range(n)], window
+
+    _, Hc, Wc = image.shape
+    ys, wh = starts(Hc, window)
+    xs, ww = starts(Wc, window)
+
+    def ramp(n):  # linear, from window borders, on overlap width
+        return torch.clamp(torch.min(torch.arange(1.0, n + 1), torch.arange(float(n), 0.0, -1)) / (margin + 1), max=1)
+
+    weight = (ramp(wh)[:, None] * ramp(ww)[None, :]).to(device)  # linear blending, fading out on each window borders
+
+    acc, norm = None, torch.zeros((Hc, Wc), device=device)
+    windows = [(y, x) for y in ys for x in xs]
+    for i in range(0, len(windows), bs):
+        batch = torch.stack([image[:, y : y + wh, x : x + ww] for y, x in windows[i : i + bs]])
+        outs = nn(batch.to(device)).data
+        acc = torch.zeros((outs.shape[1], Hc, Wc), device=device) if acc is None else acc
+        for (y, x), out in zip(windows[i : i + bs], outs):
+            acc[:, y : y + wh, x : x + ww] += out * weight
+            norm[y : y + wh, x : x + ww] += weight
+
+    probs = acc / norm
+    H, W = ts
+    x0, y0 = tiles[:, 0].min().item(), tiles[:, 1].min().item()
+    tops = [margin + (y - y0) * H for y in tiles[:, 1].tolist()]
+    lefts = [margin + (x - x0) * W for x in tiles[:, 0].tolist()]
+    return torch.stack([probs[:, top : top + H, left : left + W] for top, left in zip(tops, lefts)])
+
+
+def probs_masks(probs):
+    """Return N,H,W uint8 masks, from N,C,H,W outputs: sum of class indexes, for classes whose output, clamped on [0, 1]
+    and quantized as probs_quantize, is above 0.5, modulo 256. So abd threshold at 0.5 gives back the very same masks."""
+
+    probs = probs_quantize(probs)
+    masks = torch.zeros(probs.shape[0:3], dtype=torch.long, device=probs.device)
+    for c in range(1, probs.shape[3] + 1):  # class 0 adds nothing
+        masks += (probs[:, :, :, c - 1] > 0.5 * 255).long() * c
+
+    return (masks & 255).to(torch.uint8)  # i.e remainder by 256, as an uint8 accumulation would wrap
+
+
+def probs_quantize(probs):
+    """Return N,H,W,C-1 uint8 probabilities, from N,C,H,W outputs: every class but background, clamped on [0, 1], by 1/255
+    steps."""
+
+    return torch.round(torch.clamp(probs[:, 1:], 0, 1) * 255).to(torch.uint8).permute(0, 2, 3, 1)
+
+
+class MasksWriter:
+    """Bounded pool of background threads, encoding and writing masks tiles, and optionally probabilities ones, while
+    next batches are predicted."""
+
+    def __init__(self, root, palette, transparency, codec=None, workers=2, probs=None, geotiff=None):
+        self.write_args = (root, palette, transparency, codec)  # with no root, no masks tiles
+        self.probs_args = probs if probs else (None, None, 0)  # probabilities tiles root, codec, and bands
+        self.geotiff = geotiff  # MasksGeoTiff to write masks in, rather than as tiles
+        self.executor = futures.ThreadPoolExecutor(workers) if workers else None
+        self.pending = collections.deque()
+        self.bound = 2 * workers  # batches in flight, so host memory use stays bounded
+        self.empty = 0
+
+    def write(self, tiles, masks, probs=None):
+        """Write a batch of masks, as N,3 tiles (x, y, z) and N,H,W uint8 masks, and N,H,W,C-1 uint8 probabilities."""
+
+        if self.executor is None:
+            return self.write_batch(tiles, masks, probs)
+
+        self.pending.append(self.executor.submit(self.write_batch, tiles, masks, probs))
+        while len(self.pending) > self.bound:
+            self.pending.popleft().result()  # raise, if a write failed
+
+    def write_empty(self, tiles, shape):
+        """Write empty masks, of H,W shape, with no inference, for N,3 tiles (x, y, z)."""
+
+        if len(tiles):
+            masks = np.zeros((len(tiles), *shape), dtype=np.uint8) if self.write_args[0] else None  # GeoTIFF: left sparse
+            probs = np.zeros((len(tiles), *shape, self.probs_args[2]), dtype=np.uint8) if self.probs_args[0] else None
+            if masks is not None or probs is not None:
+                self.write(tiles, masks, probs)
+            self.empty += len(tiles)
+
+    def remove(self, tiles):
+        """Remove previous masks, and probabilities, if any, of N,3 tiles (x, y, z)."""
+
+        for root in [self.write_args[0], self.probs_args[0]]:
+            store = tiles_store(root) if root else None
+            for tile in tiles if store else []:
+                store.remove(mercantile.Tile(*map(int, tile)))
+
+    def write_batch(self, tiles, masks, probs=None):
+        if masks is not None and self.geotiff is not None:
+            self.geotiff.write(tiles, masks)
+        elif masks is not None and self.write_args[0]:
+            write_masks(*self.write_args, tiles, masks)
+        if probs is not None:
+            write_probs(*self.probs_args[0:2], tiles, probs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        while self.pending:
+            self.pending.popleft().result()
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.geotiff is not None:
+            self.geotiff.close()
+
+
+def write_masks(root, palette, transparency, codec, tiles, masks):
+    """Encode and write a batch of masks tiles, in a tiles dir or pack."""
+
+    for tile, mask in zip(tiles, masks):
+        x, y, z = list(map(int, tile))
+        tile_label_to_file(root, mercantile.Tile(x, y, z), palette, transparency, mask, codec=codec)
+
+
+def write_probs(root, codec, tiles, probs):
+    """Encode and write a batch of uint8 probabilities tiles, in a tiles dir or pack."""
+
+    for tile, prob in zip(tiles, probs):
+        x, y, z = list(map(int, tile))
+        tile_image_to_file(root, mercantile.Tile(x, y, z), prob, codec=codec)
+
+
+class MasksGeoTiff:
+    """Single tiled GeoTIFF in EPSG:3857, on a tiles grid extent (x0, y0, x1, y1, z), masks written in it tile by tile, as
+    whole internal blocks. Sparse: blocks never written (e.g empty masks) take no space, and are read as background."""
+
+    def __init__(self, path, extent, shape, palette):
+        x0, y0, x1, y1, z = extent
+        H, W = shape
+        w, _, _, n = mercantile.xy_bounds(mercantile.Tile(x0, y0, z))
+        _, s, e, _ = mercantile.xy_bounds(mercantile.Tile(x1, y1, z))
+        width, height = (x1 - x0 + 1) * W, (y1 - y0 + 1) * H
+
+        profile = {"driver": "GTiff", "width": width, "height": height, "count": 1, "dtype": "uint8", "crs": "EPSG:3857"}
+        profile.update({"transform": from_bounds(w, s, e, n, width, height), "tiled": True, "BIGTIFF": "IF_SAFER"})
+        profile.update({"blockxsize": min(W, 512), "blockysize": min(H, 512), "compress": "deflate", "SPARSE_OK": True})
+
+        self.path = path
+        self.profile = profile
+        self.colormap = {c: tuple(palette[3 * c : 3 * c + 3]) for c in range(len(palette) // 3)}
+        self.origin = (x0, y0)
+        self.raster = None  # opened on first write, so never inherited by forked processes (e.g DataLoader workers)
+        self.lock = threading.Lock()  # a GDAL dataset is not thread safe: writers threads write in turn
+
+    def open(self):
+        if self.raster is None:
+            self.raster = rasterio_open(self.path, "w", **self.profile)
+            self.raster.write_colormap(1, self.colormap)
+        return self.raster
+
+    def write(self, tiles, masks):
+        """Write a batch of masks, as N,3 tiles (x, y, z) and N,H,W uint8 masks."""
+
+        x0, y0 = self.origin
+        for tile, mask in zip(tiles, masks):
+            x, y, _ = list(map(int, tile))
+            H, W = mask.shape
+            with self.lock:
+                self.open().write(mask, 1, window=Window((x - x0) * W, (y - y0) * H, W, H))
+
+    def close(self):
+        with self.lock:
+            self.open().close()
+
+
+def geotiff_extent(tiles):
+    """Return the tiles grid extent, as x0, y0, x1, y1, z, of tiles, all at the same zoom."""
+
+    tiles = list(tiles)
+    assert len(set(tile.z for tile in tiles)) == 1, "A single zoom level is expected, with a GeoTIFF output"
+    xs, ys = [tile.x for tile in tiles], [tile.y for tile in tiles]
+    return min(xs), min(ys), max(xs), max(ys), tiles[0].z
+
+
+def geotiff_part(out, rank):
+    """Return the path of the GeoTIFF part, a GPU or process writes its masks in."""
+
+    return "{}.{}.tmp.tif".format(out, rank)
+
+
+def geotiff_merge(out, parts, fresh, extent, shape, palette, log):
+    """Merge masks GeoTIFF parts, and fresh tiles masks from the previous GeoTIFF, if any, in a single GeoTIFF on the
+    whole extent, with overviews and a COG layout."""
+
+    tmp = out + ".tmp.tif"  # overviews must be ahead of full resolution data, in a COG: so a copy is needed
+    if len(parts) == 1 and not fresh:
+        os.replace(parts[0], tmp)
+    else:
+        geotiff = MasksGeoTiff(tmp, extent, shape, palette)
+        if fresh:
+            with rasterio_open(out) as src:  # previous extent could differ: windows from tiles bounds
+                for tile in fresh:
+                    window = src.window(*mercantile.xy_bounds(tile)).round_offsets().round_lengths()
+                    mask = src.read(1, window=window)
+                    if mask.any():
+                        geotiff.write([tile], mask[None])
+
+        for part in parts:
+            with rasterio_open(part) as src:
+                for (i, j), window in src.block_windows(1):
+                    if src.get_tag_item("BLOCK_OFFSET_{}_{}".format(j, i), "TIFF", bidx=1):  # sparse blocks: none
+                        geotiff.open().write(src.read(1, window=window), 1, window=window)
+            os.remove(part)
+        geotiff.close()
+
+    with rasterio_open(tmp, "r+") as dst, rasterio.Env(GDAL_TIFF_OVR_BLOCKSIZE=min(dst.block_shapes[0])):
+        H, W = dst.block_shapes[0]
+        factors = [2]  # overviews, down to a single block
+        while dst.width // factors[-1] > W or dst.height // factors[-1] > H:
+            factors.append(factors[-1] * 2)
+        dst.build_overviews(factors, Resampling.mode)  # majority class
+        dst.update_tags(ns="rio_overview", resampling="mode")
+        width, height = dst.width, dst.height
+
+    profile = {"tiled": True, "blockxsize": W, "blockysize": H, "compress": "deflate", "BIGTIFF": "IF_SAFER"}
+    rasterio_copy(tmp, out, driver="GTiff", copy_src_overviews=True, **profile)
+    os.remove(tmp)
+
+    log.log("abd predict - GeoTIFF {}: {}x{} pixels, {} overviews".format(out, width, height, len(factors)))
+
+
+def onnx_session(path, threads, optimization):
+    """Return an ONNX Runtime CPU inference session, and the checkpoint like metadata embedded by abd export."""
+
+    import onnxruntime  # optional dependency, only for ONNX models
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = {
+        "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[optimization]
+    session = onnxruntime.InferenceSession(os.path.expanduser(path), options, providers=["CPUExecutionProvider"])
+
+    metadata = session.get_modelmeta().custom_metadata_map
+    assert "nn" in metadata, "Missing metadata in ONNX model, export it again with abd export: {}".format(path)
+    chkpt = {key: metadata[key] for key in ["uuid", "nn", "encoder", "loader"]}
+    chkpt.update({key: tuple(json.loads(metadata[key])) for key in ["shape_in", "shape_out"]})
+
+    return session, chkpt
+
+
+def worker(rank, world_size, lock_file, args, config, dataset, palette, transparency):
+
+    if args.device == "cuda":
+        dist.init_process_group(backend="nccl", init_method="file://" + lock_file, world_size=world_size, rank=rank)
+        torch.cuda.set_device(rank)
+        device = torch.device("cuda", rank)
+    else:  # no process group: shards are predicted independently, with no collective communication needed
+        torch.set_num_threads(args.threads)
+        device = torch.device("cpu")
+
+    if args.onnx:
+        session, chkpt = onnx_session(args.checkpoint, args.threads, args.onnx_optimization)
+        name = session.get_inputs()[0].name
+        nn = lambda images: torch.from_numpy(session.run(None, {name: images.numpy()})[0])  # noqa: E731
+    else:
+        chkpt = torch.load(os.path.expanduser(args.checkpoint), map_location=device)
+        nn_module = load_module("abd_model.nn.{}".format(chkpt["nn"].lower()))
+        nn = getattr(nn_module, chkpt["nn"])(chkpt["shape_in"], chkpt["shape_out"], chkpt["encoder"].lower()).to(device)
+        assert nn.version == chkpt["model_version"], "Model Version mismatch"
+        if args.device == "cuda":
+            nn = DistributedDataParallel(nn, device_ids=[rank], find_unused_parameters=True)
+        load_state_dict(nn, chkpt["state_dict"])
+        nn.eval()
+
+    if args.metatiles:
+        dataset.cache_stats = torch.zeros((args.workers + 1, 2), dtype=torch.long).share_memory_()
+
+    sampler = ShardSampler(dataset, num_replicas=world_size, rank=rank)  # contiguous, to keep metatiles spatial order
+    blocks = args.rasters or args.skip_empty  # blocks (or chunks) of tiles, repacked in batches
+    bs = None if args.mosaic or blocks else args.bs  # blocks are already batches of tiles
+    loader = DataLoader(dataset, batch_size=bs, shuffle=False, num_workers=args.workers, sampler=sampler)
     assert len(loader), "Empty predict dataset directory. Check your path."
 
     C, W, H = chkpt["shape_out"]
+    device_name = "GPU" if args.device == "cuda" else "CPU process"
+    log = Logs(os.path.join(tiles_out_dir(args.out), "log"))
+
+    root = None if args.geotiff else args.out  # masks tiles, or masks in this GPU or process GeoTIFF part
+    geotiff = MasksGeoTiff(geotiff_part(args.out, rank), args.geotiff, (H, W), palette) if args.geotiff else None
+    with torch.no_grad(), MasksWriter(root, palette, transparency, args.codec, args.writers, args.probs, geotiff) as writer:
 
-    nn.eval()
-    with torch.no_grad():
+        unit = ("Block" if args.mosaic or blocks else "Batch") + ("/GPU" if args.device == "cuda" else "/process")
+        dataloader = tqdm(loader, desc="Predict", unit=unit, ascii=True) if rank == 0 else loader
+        batches = blocks_batches(dataloader, args.bs, writer, (H, W)) if blocks else dataloader
+        start, predicted = time.perf_counter(), 0
 
-        dataloader = tqdm(loader, desc="Predict", unit="Batch/GPU", ascii=True) if rank == 0 else loader
+        for images, tiles in batches:
 
-        for images, tiles in dataloader:
+            if args.mosaic:
+                ts, m, window = (H, W), args.mosaic_overlap, args.mosaic_window
+                probs = mosaic_probs(nn, images, tiles, ts, m, window, args.bs, device)
 
-            if args.metatiles:
+            elif args.metatiles:
                 N = images.shape[0]
                 qs = int(W / 4)
                 hs = int(W / 2)
                 ts = int(W)
 
                 # fmt:off
-                probs = np.zeros((N, C, W, H), dtype=np.float)
-                probs[:, :, 0:hs, 0:hs] = nn(images[:, :, 0:ts, 0:ts].to(rank)).data.cpu().numpy()[:, :, qs:-qs, qs:-qs]
-                probs[:, :, 0:hs,  hs:] = nn(images[:, :, 0:ts,  hs:].to(rank)).data.cpu().numpy()[:, :, qs:-qs, qs:-qs]
-                probs[:, :, hs:,  0:hs] = nn(images[:, :, hs:,  0:ts].to(rank)).data.cpu().numpy()[:, :, qs:-qs, qs:-qs]
-                probs[:, :, hs:,   hs:] = nn(images[:, :, hs:,   hs:].to(rank)).data.cpu().numpy()[:, :, qs:-qs, qs:-qs]
+                probs = torch.empty((N, C, W, H), device=device)
+                probs[:, :, 0:hs, 0:hs] = nn(images[:, :, 0:ts, 0:ts].to(device)).data[:, :, qs:-qs, qs:-qs]
+                probs[:, :, 0:hs,  hs:] = nn(images[:, :, 0:ts,  hs:].to(device)).data[:, :, qs:-qs, qs:-qs]
+                probs[:, :, hs:,  0:hs] = nn(images[:, :, hs:,  0:ts].to(device)).data[:, :, qs:-qs, qs:-qs]
+                probs[:, :, hs:,   hs:] = nn(images[:, :, hs:,   hs:].to(device)).data[:, :, qs:-qs, qs:-qs]
                 # fmt:on
             else:
-                probs = nn(images.to(rank)).data.cpu().numpy()
+                probs = nn(images.to(device)).data
+
+            masks = probs_masks(probs).cpu().numpy()  # only uint8 masks, and probabilities, are copied back to host
+            writer.write(tiles, masks, probs_quantize(probs).cpu().numpy() if args.probs else None)
+            predicted += len(tiles)
+
+    if not args.geotiff:
+        tiles_store(args.out).flush()
+    if args.probs:
+        tiles_store(args.probs[0]).flush()
+
+    elapsed = time.perf_counter() - start
+    log.log(
+        "{} {} - {} tiles in {:.1f}s: {:.2f} tiles/s".format(
+            device_name, rank, predicted, elapsed, predicted / max(elapsed, 1e-9)
+        )
+    )
+
+    if writer.empty:
+        log.log("{} {} - {} empty tiles, masks written with no inference".format(device_name, rank, writer.empty))
+
+    if args.metatiles:
+        hits, misses = dataset.cache_stats.sum(dim=0).tolist()
+        log.log(
+            "{} {} - Metatiles cache: {:.1f}% hit rate ({} hits, {} reads) with {} tiles/worker".format(
+                device_name, rank, 100 * hits / max(hits + misses, 1), hits, misses, args.metatiles_cache
+            )
+        )
+
+
+def predict_signatures(manifest, config, root, dataset):
+    """Return each dataset tile signature: from its channels tiles fingerprints, and its context ones (i.e metatiles
+    neighbours, or mosaic block), if any."""
+
+    fingerprints = collections.defaultdict(list)
+    for channel in config["channels"]:
+        name = channel["name"]
+        store = tiles_store(tiles_root(root, name))
+        cache = {None: None}  # each tile fingerprinted once, even if in several tiles contexts
+        for tile, path in dataset.tiles[name]:
+            if isinstance(dataset, MosaicBlocks):
+                paths = dataset.context(name, tile)
+            else:
+                paths = dataset.neighbours[name][tile] if dataset.metatiles else (path,)
+            for path in paths:
+                if path not in cache:
+                    cache[path] = store.fingerprint(path)
+                fingerprints[tile].append(cache[path])
+
+    return {tile: manifest.signature(fingerprint=json.dumps(fingerprint)) for tile, fingerprint in fingerprints.items()}
+
+
+def rasters_dataset(args, config, manifest, ts, log):
+    """Return a dataset tiling rasters on the fly, and each tile signature, from its rasters fingerprints."""
 
-            for tile, prob in zip(tiles, probs):
-                x, y, z = list(map(int, tile))
-                mask = np.zeros((W, H), dtype=np.uint8)
+    rasters, rasters_tiles = rasters_coverage(args.rasters, args.zoom, args.bands, args.cover, log)
+    candidates = set(tile for tiles in rasters_tiles.values() for tile in tiles)
+    with futures.ProcessPoolExecutor() as executor:  # skip, before any warp, tiles outside rasters valid footprints
+        footprints = executor.map(partial(worker_footprint, args.nodata), rasters_tiles.items())
+        rasters_tiles = dict(zip(rasters_tiles.keys(), footprints))
 
-                for c in range(C):
-                    mask += np.around(prob[c, :, :]).astype(np.uint8) * c
+    tiles_map = rasters_tiles_map(rasters_tiles)
+    assert tiles_map, "Nothing to predict, from rasters {}".format(args.rasters)
+    if len(candidates) > len(tiles_map):
+        log.log("abd predict - {} tiles skipped, as nodata on rasters footprints".format(len(candidates) - len(tiles_map)))
 
-                tile_label_to_file(args.out, mercantile.Tile(x, y, z), palette, transparency, mask)
+    paths = rasters_priority(rasters, args.priority)
+    rank = {path: i for i, path in enumerate(paths)}
+    fingerprints = {path: source_fingerprint(path) for path in paths}
+    signatures = {}  # provenance of each tile: its rasters, in priority order
+    for tile_key, tile_paths in tiles_map.items():
+        sources = [fingerprints[path] for path in sorted(tile_paths, key=rank.get)]
+        signatures[mercantile.Tile(*map(int, tile_key))] = manifest.signature(sources)
+
+    tasks = rasters_tasks(tiles_map, [(path, rasters[path][0]) for path in paths], rank, args.block)
+    return RastersBlocks(args, config, tasks, ts), signatures
 
 
 def main(args):
@@ -101,43 +744,192 @@ def main(args):
     check_channels(config)
     check_classes(config)
 
-    assert torch.cuda.is_available(), "No GPU support found. Check CUDA and NVidia Driver install."
-    assert torch.distributed.is_nccl_available(), "No NCCL support found. Check your PyTorch install."
-
-    world_size = torch.cuda.device_count()
-    args.bs = args.bs if args.bs is not None else math.floor(os.cpu_count() / world_size)
-    args.workers = args.workers if args.workers is not None else args.bs
+    assert bool(args.dataset) != bool(args.rasters), "Either --dataset or --rasters, is expected"
+    if args.rasters:
+        assert args.zoom is not None, "--zoom is required, with --rasters"
+        assert len(config["channels"]) == 1, "--rasters expect a config with a single channel"
+        assert not args.metatiles and not args.mosaic, "--rasters could be used neither with --metatiles, nor --mosaic"
+        try:
+            args.bands = list(map(int, args.bands.split(","))) if args.bands else None
+        except:
+            raise ValueError("invalid --args.bands value")
+
+        with rasterio_open(os.path.expanduser(args.rasters[0])) as raster:
+            args.bands = args.bands if args.bands else list(raster.indexes)
+        assert max(config["channels"][0]["bands"]) <= len(args.bands), "Config channel bands, not in rasters --bands"
+        args.label = False  # imagery only
+
+    args.onnx = os.path.splitext(args.checkpoint)[1].lower() == ".onnx"
+    assert not (args.onnx and args.device == "cuda"), "ONNX models are run on CPU only, with ONNX Runtime"
+    args.device = args.device if args.device else "cuda" if torch.cuda.is_available() and not args.onnx else "cpu"
+    if args.device == "cuda":
+        assert torch.cuda.is_available(), "No GPU support found. Check CUDA and NVidia Driver install."
+        assert torch.distributed.is_nccl_available(), "No NCCL support found. Check your PyTorch install."
+
+        world_size = torch.cuda.device_count()
+        args.bs = args.bs if args.bs is not None else math.floor(os.cpu_count() / world_size)
+        args.workers = args.workers if args.workers is not None else args.bs
+    else:
+        assert args.processes >= 1, "--processes, expect a positive value"
+        world_size = args.processes
+        args.threads = args.threads if args.threads else max(1, os.cpu_count() // args.processes)
+        args.bs = args.bs if args.bs is not None else 4
+        args.workers = args.workers if args.workers is not None else 1
 
     palette, transparency = make_palette([classe["color"] for classe in config["classes"]])
-    args.cover = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))] if args.cover else None
+    if args.probs:  # every class but background, as bands
+        C = len(config["classes"]) - 1
+        args.probs_codec = args.probs_codec if args.probs_codec else "png" if C <= 4 else "tiff"
+        _, fmt, option = tile_codec(args.probs_codec, C)
+        assert fmt in ["png", "tiff"] or option == "lossless", "--probs_codec, expect a lossless codec"
+        args.probs = (os.path.expanduser(args.probs), args.probs_codec, C)
+    args.cover = tiles_from_csv(os.path.expanduser(args.cover)) if args.cover else None
 
     args.out = os.path.expanduser(args.out)
-    log = Logs(os.path.join(args.out, "log"))
-
-    chkpt = torch.load(args.checkpoint, map_location=torch.device("cpu"))
-    log.log("abd predict on {} GPUs, with {} workers/GPU and {} tiles/batch".format(world_size, args.workers, args.bs))
+    out_dir = tiles_out_dir(args.out)
+    log = Logs(os.path.join(out_dir, "log"))
+
+    if args.onnx:
+        chkpt = onnx_session(args.checkpoint, 1, "disable")[1]
+    else:
+        chkpt = torch.load(args.checkpoint, map_location=torch.device("cpu"))
+    if args.device == "cuda":
+        log.log("abd predict on {} GPUs, with {} workers/GPU and {} tiles/batch".format(world_size, args.workers, args.bs))
+    else:
+        log.log(
+            "abd predict on CPU{}, with {} processes of {} threads, {} workers/process and {} tiles/batch".format(
+                " with ONNX Runtime" if args.onnx else "", world_size, args.threads, args.workers, args.bs
+            )
+        )
     log.log("Model {} - UUID: {}".format(chkpt["nn"], chkpt["uuid"]))
+
+    if args.mosaic:
+        assert not args.metatiles, "--mosaic and --metatiles are mutually exclusive"
+        assert args.mosaic >= 1, "--mosaic, expect a positive value"
+        ts = min(chkpt["shape_in"][1:3])
+        args.mosaic_overlap = args.mosaic_overlap if args.mosaic_overlap is not None else ts // 4
+        args.mosaic_window = (
+            args.mosaic_window if args.mosaic_window else ts if args.onnx else 2 * (ts + args.mosaic_overlap)
+        )
+        assert 0 <= args.mosaic_overlap <= ts, "--mosaic_overlap, expect a value between 0 and tile size"
+        assert args.mosaic_overlap < args.mosaic_window, "--mosaic_overlap, expect a value lower than --mosaic_window"
+        assert not args.onnx or args.mosaic_window == ts, "ONNX models input size is fixed: --mosaic_window {}".format(ts)
+        stride = 32  # encoder downsampling: windows sides, either --mosaic_window or small blocks ones, multiple of it
+        assert args.onnx or 2 * args.mosaic_overlap % stride == 0, "--mosaic_overlap, expect a multiple of 16"
+        assert args.mosaic_window % stride == 0, "--mosaic_window, expect a multiple of 32, the model encoder stride"
+        log.log(
+            "Mosaic blocks of {0}x{0} tiles, by {1}px windows, with {2}px overlap".format(
+                args.mosaic, args.mosaic_window, args.mosaic_overlap
+            )
+        )
+    assert not (args.skip_empty and args.mosaic), "--skip_empty could not be used with --mosaic, use --skip_cover instead"
+    if args.probs:
+        log.log(
+            "Probabilities of every class but background, as uint8 {} tiles, in {}".format(args.probs_codec, args.probs[0])
+        )
+    if args.rasters:
+        log.log("Rasters: {} tiled on the fly at zoom {}, on bands {}".format(len(args.rasters), args.zoom, args.bands))
     log.log("---")
-    loader = load_module("abd_model.loaders.{}".format(chkpt["loader"].lower()))
-
-    lock_file = os.path.abspath(os.path.join(args.out, str(uuid.uuid1())))
-
-    dataset = getattr(loader, chkpt["loader"])(
-        config,
-        chkpt["shape_in"][1:3],
-        args.dataset,
-        args.cover,
-        mode="predict",
-        metatiles=args.metatiles,
-        keep_borders=args.keep_borders,
-    )
 
-    mp.spawn(gpu_worker, nprocs=world_size, args=(world_size, lock_file, args, config, dataset, palette, transparency))
+    lock_file = os.path.abspath(os.path.join(out_dir, str(uuid.uuid1())))
+
+    params = {"checkpoint": source_fingerprint(args.checkpoint), "uuid": str(chkpt["uuid"]), "codec": args.codec}
+    params.update({"channels": config["channels"], "classes": config["classes"], "metatiles": args.metatiles})
+    params["keep_borders"] = args.keep_borders
+    if args.mosaic:
+        params["mosaic"] = [args.mosaic, args.mosaic_overlap, args.mosaic_window]
+    if args.rasters:
+        params.update({key: vars(args)[key] for key in ["zoom", "bands", "priority", "nodata", "nodata_threshold"]})
+    if args.skip_empty:
+        params["skip_empty"] = [args.nodata, args.skip_std]
+    if args.skip_cover:
+        params["skip_cover"] = source_fingerprint(args.skip_cover)
+    if args.probs:
+        params["probs"] = [os.path.abspath(args.probs[0]), args.probs_codec]
+    manifest = TilesManifest(args.out, "predict", params)
+
+    if args.rasters:
+        dataset, signatures = rasters_dataset(args, config, manifest, chkpt["shape_in"][1:3], log)
+    else:
+        loader = load_module("abd_model.loaders.{}".format(chkpt["loader"].lower()))
+        dataset = getattr(loader, chkpt["loader"])(
+            config,
+            chkpt["shape_in"][1:3],
+            args.dataset,
+            args.cover,
+            mode="predict",
+            metatiles=args.metatiles,
+            keep_borders=args.keep_borders,
+            metatiles_cache=args.metatiles_cache,
+        )
+        if args.mosaic:
+            dataset = MosaicBlocks(dataset, args.mosaic, args.mosaic_overlap, args.metatiles_cache)
+        signatures = predict_signatures(manifest, config, args.dataset, dataset)
+
+    cover = dataset.cover  # whole dataset coverage, fresh tiles included
+    geotiff = tiles_geotiff(args.out)
+    args.geotiff = geotiff_extent(cover) if geotiff else None  # GeoTIFF output, on the whole coverage extent
+    ext = tile_codec(args.codec, label=True)[0] if not geotiff else None  # in a GeoTIFF, masks are checked as a whole
+    force = args.force or (geotiff and not os.path.isfile(args.out))
+    fresh = [] if force else [tile for tile, signature in signatures.items() if manifest.fresh(tile, signature, ext)]
+    if fresh:
+        log.log("abd predict - {} tiles already up to date, skipped".format(len(fresh)))
+        dataset.select(Cover(tiles=signatures.keys()).difference(Cover(fresh)))
+
+    skipped = dataset.cover.intersection(tiles_from_csv(os.path.expanduser(args.skip_cover))) if args.skip_cover else None
+    if skipped:  # no read at all, nor inference
+        root = None if geotiff else args.out  # GeoTIFF empty masks are left sparse
+        with MasksWriter(root, palette, transparency, args.codec, args.writers, args.probs) as writer:
+            for i in range(0, len(skipped), args.bs):
+                writer.write_empty(Cover.decode(skipped.codes[i : i + args.bs]), chkpt["shape_out"][1:3])
+        for tile in skipped:
+            manifest.update(tile, signatures[tile])
+        log.log("abd predict - {} tiles in skip cover, masks written with no inference".format(len(skipped)))
+        dataset.select(dataset.cover.difference(skipped))
+
+    if args.skip_empty and not args.rasters:  # rasters blocks check empty tiles by themselves
+        dataset = EmptyTiles(dataset, args.bs, chkpt["shape_in"][1:3], args.nodata, args.skip_std)
+
+    if 0 < len(dataset) < world_size:  # shards are not padded: no GPU or process is left with an empty one
+        log.log(
+            "abd predict - {} samples to predict only, on as many {}".format(
+                len(dataset), "GPUs" if args.device == "cuda" else "processes"
+            )
+        )
+        world_size = len(dataset)
+
+    if len(dataset):
+        mp.spawn(worker, nprocs=world_size, args=(world_size, lock_file, args, config, dataset, palette, transparency))
+        store = tiles_store(args.out)
+        for tile in dataset.cover:  # only once all workers succeeded. With rasters, nodata tiles have no mask
+            written = geotiff or not args.rasters or store.exists(store.path(tile, ext))
+            manifest.update(tile, signatures[tile], written=written)
 
     if os.path.exists(lock_file):
         os.remove(lock_file)
 
-    if not args.no_web_ui and dataset.cover:
+    stale = manifest.stale(cover)
+    if geotiff and (len(dataset) or skipped or stale or force):  # rebuilt, from parts and previous GeoTIFF fresh tiles
+        parts = [geotiff_part(args.out, rank) for rank in range(world_size)] if len(dataset) else []
+        geotiff_merge(args.out, parts, fresh, args.geotiff, chkpt["shape_out"][1:3], palette, log)
+
+    if stale and (args.remove_stale or geotiff):  # a GeoTIFF only covers the current coverage extent
+        manifest.remove(stale)
+        if args.probs:
+            store = tiles_store(args.probs[0])
+            for tile in stale:
+                store.remove(tile)
+        log.log("abd predict - {} stale tiles, no longer in dataset, removed".format(len(stale)))
+    elif stale:
+        log.log("abd predict - {} stale tiles, no longer in dataset, kept (cf --remove_stale)".format(len(stale)))
+
+    if not geotiff:
+        tiles_store(args.out).flush()
+    if args.probs:
+        tiles_store(args.probs[0]).flush()
+    manifest.save()
+
+    if not args.no_web_ui and cover and not tiles_pack(args.out) and not geotiff:
         template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
         base_url = args.web_ui_base_url if args.web_ui_base_url else "."
-        web_ui(args.out, base_url, dataset.cover, dataset.cover, "png", template)
+        web_ui(args.out, base_url, cover, cover, ext, template)
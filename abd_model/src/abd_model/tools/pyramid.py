@@ -0,0 +1,188 @@
+import os
+import sys
+from tqdm import tqdm
+import concurrent.futures as futures
+from functools import partial
+
+import numpy as np
+import mercantile
+
+from abd_model.core import load_config, check_classes, make_palette, web_ui, Logs
+from abd_model.tiles import (
+    tiles_store,
+    tiles_pack,
+    tiles_out_dir,
+    tile_codec,
+    tile_image_from_file,
+    tile_image_to_file,
+    tile_label_from_file,
+    tile_label_to_file,
+)
+from abd_model.tools.tile import tiles_blocks
+
+
+def add_parser(subparser, formatter_class):
+    parser = subparser.add_parser(
+        "pyramid", help="Build lower zooms tiles, by 2x2 downsampling of base zoom ones", formatter_class=formatter_class
+    )
+
+    inp = parser.add_argument_group("Inputs")
+    inp.add_argument("--dir", type=str, required=True, help="XYZ tiles dir, or .mbtiles pack, path [required]")
+    inp.add_argument("--zoom", type=int, help="base zoom level, to downsample from [default: dir highest one]")
+
+    out = parser.add_argument_group("Output")
+    out.add_argument("--levels", type=int, default=1, help="number of zoom levels to build, below base one [default: 1]")
+    out.add_argument("--out", type=str, help="output directory, or .mbtiles pack, path [default: --dir one]")
+    help = "nodata pixel value, ignored by imagery downsampling, and tiles fully nodata skipped [default: 0]"
+    out.add_argument("--nodata", type=int, default=0, choices=range(0, 256), metavar="[0-255]", help=help)
+    help = "tiles codec, either a preset: default, fast, small, raw or a format:option (e.g png:1, webp:90, tiff:none)"
+    out.add_argument("--codec", type=str, help=help)
+
+    lab = parser.add_argument_group("Labels")
+    lab.add_argument("--label", action="store_true", help="if set, tiles are labels or masks, rather than imagery")
+    help = "labels downsampling rule: majority class (on ties, the highest one), or highest class [default: majority]"
+    lab.add_argument("--rule", type=str, default="majority", choices=["majority", "max"], help=help)
+    lab.add_argument("--config", type=str, help="path to config file [required with --label, if no global config setting]")
+
+    perf = parser.add_argument_group("Performances")
+    perf.add_argument("--workers", type=int, help="number of processes, downsampling blocks of tiles [default: CPU]")
+    help = "side, in output tiles, of blocks of adjacent tiles downsampled by a worker task [default: 4]"
+    perf.add_argument("--block", type=int, default=4, help=help)
+
+    ui = parser.add_argument_group("Web UI")
+    ui.add_argument("--web_ui_base_url", type=str, help="alternate Web UI base URL")
+    ui.add_argument("--web_ui_template", type=str, help="alternate Web UI template path")
+    ui.add_argument("--no_web_ui", action="store_true", help="desactivate Web UI output")
+
+    parser.set_defaults(func=main)
+
+
+def downsample_image(image, nodata):
+    """Return a 2x2 area mean downsampled H,W,C image, ignoring nodata pixels (i.e nodata on every band)."""
+
+    H, W, C = image.shape
+    blocks = image.reshape(H // 2, 2, W // 2, 2, C).astype(np.float32)
+    valid = np.any(image != nodata, axis=2).reshape(H // 2, 2, W // 2, 2, 1)
+
+    count = valid.sum(axis=(1, 3))
+    mean = (blocks * valid).sum(axis=(1, 3)) / np.maximum(count, 1)
+    return np.where(count > 0, np.rint(mean), nodata).astype(image.dtype)
+
+
+def downsample_label(label, classes, rule):
+    """Return a 2x2 downsampled H,W label: either majority class, ties to the highest one, or highest class."""
+
+    H, W = label.shape
+    blocks = label.reshape(H // 2, 2, W // 2, 2)
+    if rule == "max":
+        return blocks.max(axis=(1, 3)).astype(np.uint8)
+
+    counts = np.stack([(blocks == c).sum(axis=(1, 3)) for c in reversed(range(classes))])  # highest class first
+    return (classes - 1 - np.argmax(counts, axis=0)).astype(np.uint8)
+
+
+def worker_block(args, ext, label, block):
+    """Downsample a block of output tiles, each from its (up to) 4 children tiles. Return tiles processed, and written."""
+
+    tiled = []
+    for tile, children in block:
+
+        parts = {}
+        for child, path in children:
+            part = tile_label_from_file(path) if label else tile_image_from_file(path)
+            assert part is not None, "Unable to read tile: {}".format(path)
+            parts[(child.x - 2 * tile.x, child.y - 2 * tile.y)] = part.reshape(*part.shape[0:2], -1)
+
+        H, W, C = next(iter(parts.values())).shape
+        assert not H % 2 and not W % 2, "Odd tile size, unable to downsample: {}".format(children[0][1])
+        fill = 0 if label else args.nodata  # missing children as background, or nodata
+        mosaic = np.full((2 * H, 2 * W, C), fill, dtype=next(iter(parts.values())).dtype)
+        for (dx, dy), part in parts.items():
+            mosaic[dy * H : (dy + 1) * H, dx * W : (dx + 1) * W] = part
+
+        if label:
+            tile_label_to_file(
+                args.out, tile, *label[1:], downsample_label(mosaic[:, :, 0], label[0], args.rule), codec=args.codec
+            )
+        else:
+            image = downsample_image(mosaic, args.nodata)
+            if np.all(image == args.nodata):
+                continue
+            tile_image_to_file(args.out, tile, image, ext=ext, codec=args.codec)
+
+        tiled.append(tile)
+
+    tiles_store(args.out).flush()
+    return len(block), tiled
+
+
+def main(args):
+
+    args.dir = os.path.expanduser(args.dir)
+    args.out = os.path.expanduser(args.out) if args.out else args.dir
+    if not args.workers:
+        args.workers = os.cpu_count()
+
+    label = None
+    if args.label:
+        config = load_config(args.config)
+        check_classes(config)
+        palette, transparency = make_palette([classe["color"] for classe in config["classes"]])
+        label = (len(config["classes"]), palette, transparency)
+
+    out_dir = tiles_out_dir(args.out)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    log = Logs(os.path.join(out_dir, "log"), out=sys.stderr)
+
+    tiles = {}  # base zoom level: tile -> path
+    zoom = args.zoom
+    for tile, path in tiles_store(args.dir).tiles():
+        if zoom is None or tile.z == zoom:
+            tiles[tile] = path
+    zoom = max(tile.z for tile in tiles.keys()) if tiles and zoom is None else zoom
+    tiles = {tile: path for tile, path in tiles.items() if tile.z == zoom}
+    assert tiles, "No tiles at zoom {} in {}".format(zoom, args.dir)
+    assert args.levels >= 1 and zoom - args.levels >= 0, "Invalid --levels, from zoom {}".format(zoom)
+
+    if args.label:
+        ext = tile_codec(args.codec, label=True)[0]
+    else:  # as tile_image_to_file: with no codec, RGB tiles keep base tiles format
+        base = os.path.splitext(next(iter(tiles.values())))[1][1:]
+        image = tile_image_from_file(next(iter(tiles.values())))
+        C = image.shape[2] if len(image.shape) == 3 else 1
+        ext = tile_codec(args.codec if args.codec else base if C == 3 else None, C)[0]
+    mode = "labels, {} rule".format(args.rule) if args.label else "imagery, area mean"
+    log.log(
+        "abd pyramid {} from zoom {} to {} ({}), on CPU with {} workers".format(
+            args.dir, zoom, zoom - args.levels, mode, args.workers
+        )
+    )
+
+    pyramid = []
+    for z in reversed(range(zoom - args.levels, zoom)):  # level by level, each one only from the previous one
+        parents = {}
+        for tile, path in tiles.items():
+            parents.setdefault(mercantile.parent(tile), []).append((tile, path))
+
+        tasks = [[(tile, parents[tile]) for tile in block] for block in tiles_blocks(list(parents.keys()), args.block)]
+        progress = tqdm(desc="Zoom {}".format(z), total=len(parents), ascii=True, unit="tile")
+        tiled = []
+        with futures.ProcessPoolExecutor(args.workers) as executor:  # workers exit, so level tiles are all written
+            for done, block_tiled in executor.map(partial(worker_block, args, ext, label), tasks):
+                tiled.extend(block_tiled)
+                progress.update(done)
+        progress.close()
+
+        store = tiles_store(args.out)
+        tiles = {tile: store.path(tile, ext) for tile in tiled}
+        log.log("abd pyramid - zoom {}: {} tiles".format(z, len(tiles)))
+        pyramid.extend(tiled)
+
+        if not tiles:
+            break
+
+    if pyramid and not args.no_web_ui and not tiles_pack(args.out):
+        template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
+        base_url = args.web_ui_base_url if args.web_ui_base_url else "."
+        web_ui(args.out, base_url, pyramid, pyramid, ext, template)
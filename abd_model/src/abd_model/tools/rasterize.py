@@ -12,7 +12,8 @@ import concurrent.futures as futures
 import psycopg2
 
 from abd_model.core import load_config, check_classes, make_palette, web_ui, Logs
-from abd_model.tiles import tiles_from_csv, tile_label_to_file, tile_bbox
+from abd_model.tiles import tiles_from_csv, tiles_pack, tiles_store, tiles_out_dir, tile_label_to_file, tile_bbox, tile_codec
+from abd_model.tiles import source_fingerprint, TilesManifest
 from abd_model.geojson import geojson_srid, geojson_tile_burn, geojson_parse_feature
 
 
@@ -32,9 +33,13 @@ def add_parser(subparser, formatter_class):
     inp.add_argument("--buffer", type=float, help="Add a Geometrical Buffer around each Features (distance in meter)")
 
     out = parser.add_argument_group("Outputs")
-    out.add_argument("--out", type=str, required=True, help="output directory path [required]")
+    out.add_argument("--out", type=str, required=True, help="output directory, or .mbtiles pack, path [required]")
     out.add_argument("--append", action="store_true", help="Append to existing tile if any, useful to multiclasses labels")
     out.add_argument("--ts", type=str, default="512,512", help="output tile size [default: 512,512]")
+    help = "tiles codec, either a preset: default, fast, small, raw or a format:option (e.g png:1, webp:90, tiff:none)"
+    out.add_argument("--codec", type=str, help=help)
+    out.add_argument("--force", action="store_true", help="if set, rasterize again all tiles, even already up to date ones")
+    out.add_argument("--remove_stale", action="store_true", help="if set, remove tiles of this type no longer in cover")
 
     perf = parser.add_argument_group("Performances")
     perf.add_argument("--workers", type=int, help="number of workers [default: CPU]")
@@ -76,6 +81,7 @@ def main(args):
 
     args.pg = config["auth"]["pg"] if not args.pg and "pg" in config["auth"].keys() else args.pg
     assert not (args.sql and not args.pg), "With --sql option, --pg dsn setting must also be provided"
+    assert not (args.append and args.remove_stale), "--remove_stale, would also remove others types appended labels"
 
     palette, transparency = make_palette([classe["color"] for classe in config["classes"]], complementary=True)
     index = [config["classes"].index(classe) for classe in config["classes"] if classe["title"] == args.type]
@@ -89,14 +95,32 @@ def main(args):
         sql = re.sub(r"ST_Intersects( )*\((.*)?TILE_GEOM(.*)?\)", "1=1", args.sql, re.I)
         assert sql and sql != args.sql, "Incorrect TILE_GEOM filter in your SQL"
 
-    if os.path.dirname(os.path.expanduser(args.out)):
-        os.makedirs(os.path.expanduser(args.out), exist_ok=True)
     args.out = os.path.expanduser(args.out)
-    log = Logs(os.path.join(args.out, "log"), out=sys.stderr)
+    out_dir = tiles_out_dir(args.out)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    log = Logs(os.path.join(out_dir, "log"), out=sys.stderr)
 
     tiles = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))]
     assert len(tiles), "Empty Cover: {}".format(args.cover)
 
+    params = {"type": args.type, "classes": config["classes"], "ts": args.ts, "buffer": args.buffer, "append": args.append}
+    params["codec"] = args.codec
+    manifest = TilesManifest(args.out, "rasterize:{}".format(args.type), params)
+    sources = [source_fingerprint(path) for path in args.geojson] if args.geojson else [{"sql": args.sql}]
+    signature = manifest.signature(sources)  # features are not tracked by tile, any source change rasterize them all
+
+    ext = tile_codec(args.codec, label=True)[0]
+    fresh = set() if args.force else set(tile for tile in tiles if manifest.fresh(tile, signature, ext))
+    counts = {}  # features count by tile, from previous run, to keep the cover file complete
+    cover_path = os.path.join(out_dir, args.type.lower() + "_cover.csv")
+    if fresh and os.path.isfile(cover_path):
+        with open(cover_path) as fp:
+            counts = dict(line.rstrip().split("  ") for line in fp if "  " in line)
+    fresh = set(tile for tile in fresh if "{},{},{}".format(*tile) in counts)
+    if fresh:
+        log.log("abd rasterize - {} tiles already up to date, skipped".format(len(fresh)))
+
     if args.geojson:
         zoom = tiles[0].z
         assert not [tile for tile in tiles if tile.z != zoom], "Unsupported zoom mixed cover. Use PostGIS instead"
@@ -141,10 +165,14 @@ def main(args):
         log.log("-----------------------------------------------")
 
     log.log("abd rasterize - rasterizing {} from {} on cover {}".format(args.type, log_from, args.cover))
-    with open(os.path.join(os.path.expanduser(args.out), args.type.lower() + "_cover.csv"), mode="w") as cover:
+    with open(cover_path, mode="w") as cover:
 
         for tile in tqdm(tiles, ascii=True, unit="tile"):
 
+            if tile in fresh:
+                cover.write("{},{},{}  {}{}".format(tile.x, tile.y, tile.z, counts["{},{},{}".format(*tile)], os.linesep))
+                continue
+
             geojson = None
 
             if args.sql:
@@ -185,11 +213,22 @@ def main(args):
                 num = 0
                 out = np.zeros(shape=list(map(int, args.ts.split(","))), dtype=np.uint8)
 
-            tile_label_to_file(args.out, tile, palette, transparency, out, append=args.append)
+            tile_label_to_file(args.out, tile, palette, transparency, out, append=args.append, codec=args.codec)
             cover.write("{},{},{}  {}{}".format(tile.x, tile.y, tile.z, num, os.linesep))
+            manifest.update(tile, signature)
+
+    stale = manifest.stale(tiles)
+    if stale and args.remove_stale:
+        manifest.remove(stale)
+        log.log("abd rasterize - {} stale tiles, no longer in cover, removed".format(len(stale)))
+    elif stale:
+        log.log("abd rasterize - {} stale tiles, no longer in cover, kept (cf --remove_stale)".format(len(stale)))
+
+    tiles_store(args.out).flush()
+    manifest.save()
 
-    if not args.no_web_ui:
+    if not args.no_web_ui and not tiles_pack(args.out):
         template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
         base_url = args.web_ui_base_url if args.web_ui_base_url else "."
         tiles = [tile for tile in tiles_from_csv(args.cover)]
-        web_ui(args.out, base_url, tiles, tiles, "png", template)
+        web_ui(args.out, base_url, tiles, tiles, tile_codec(args.codec, label=True)[0], template)
@@ -5,7 +5,7 @@ import shutil
 import mercantile
 from tqdm import tqdm
 
-from abd_model.tiles import tiles_from_csv, tile_from_xyz
+from abd_model.tiles import tiles_from_csv, TilesResolver
 from abd_model.core import web_ui
 
 
@@ -42,11 +42,12 @@ def main(args):
     ext = set()
     tiles = set(tiles_from_csv(os.path.expanduser(args.cover)))
     assert len(tiles), "Empty Cover: {}".format(args.cover)
+    resolver = TilesResolver(args.dir)
 
     for tile in tqdm(tiles, ascii=True, unit="tiles"):
 
         if isinstance(tile, mercantile.Tile):
-            src_tile = tile_from_xyz(args.dir, tile.x, tile.y, tile.z)
+            src_tile = resolver(tile.x, tile.y, tile.z)
             if not src_tile:
                 if not args.quiet:
                     print("WARNING: skipping tile {}".format(tile), file=sys.stderr, flush=True)
@@ -0,0 +1,114 @@
+import os
+import sys
+from tqdm import tqdm
+import concurrent.futures as futures
+from functools import partial
+
+import numpy as np
+
+from abd_model.core import load_config, check_classes, make_palette, web_ui, Logs
+from abd_model.tiles import tiles_store, tiles_pack, tiles_out_dir, tile_codec, tile_image_from_file, tile_label_to_file
+from abd_model.tools.tile import tiles_blocks
+
+
+def add_parser(subparser, formatter_class):
+    parser = subparser.add_parser(
+        "threshold", help="Generate masks, from probabilities stored by abd predict", formatter_class=formatter_class
+    )
+
+    inp = parser.add_argument_group("Inputs")
+    inp.add_argument("--probs", type=str, required=True, help="probabilities tiles dir, or .mbtiles pack, path [required]")
+    inp.add_argument("--config", type=str, help="path to config file [required, if no global config setting]")
+    help = "classes probability thresholds, either a single one, or one by class, but background [default: 0.5]"
+    inp.add_argument("--threshold", type=float, nargs="+", default=[0.5], help=help)
+
+    out = parser.add_argument_group("Outputs")
+    out.add_argument("--out", type=str, required=True, help="output directory, or .mbtiles pack, path [required]")
+    help = "tiles codec, either a preset: default, fast, small, raw or a format:option (e.g png:1, tiff:none)"
+    out.add_argument("--codec", type=str, help=help)
+
+    perf = parser.add_argument_group("Performances")
+    perf.add_argument("--workers", type=int, help="number of processes, thresholding blocks of tiles [default: CPU]")
+    help = "side, in tiles, of blocks of adjacent tiles thresholded by a worker task [default: 4]"
+    perf.add_argument("--block", type=int, default=4, help=help)
+
+    ui = parser.add_argument_group("Web UI")
+    ui.add_argument("--web_ui_base_url", type=str, help="alternate Web UI base URL")
+    ui.add_argument("--web_ui_template", type=str, help="alternate Web UI template path")
+    ui.add_argument("--no_web_ui", action="store_true", help="desactivate Web UI output")
+
+    parser.set_defaults(func=main)
+
+
+def probs_threshold(probs, thresholds):
+    """Return a H,W uint8 mask, from H,W,C-1 uint8 probabilities: sum of thresholded classes by class index, modulo 256,
+    as abd predict masks."""
+
+    mask = np.zeros(probs.shape[0:2], dtype=np.uint8)
+    for c, threshold in enumerate(thresholds, start=1):
+        mask += (probs[:, :, c - 1] > threshold * 255).astype(np.uint8) * c
+
+    return mask
+
+
+def worker_block(args, palette, transparency, block):
+    """Threshold a block of probabilities tiles, into masks ones. Return the number of tiles processed."""
+
+    for tile, path in block:
+        probs = tile_image_from_file(path)
+        assert probs is not None, "Unable to read tile: {}".format(path)
+
+        mask = probs_threshold(probs.reshape(*probs.shape[0:2], -1), args.threshold)
+        tile_label_to_file(args.out, tile, palette, transparency, mask, codec=args.codec)
+
+    tiles_store(args.out).flush()
+    return len(block)
+
+
+def main(args):
+    config = load_config(args.config)
+    check_classes(config)
+    palette, transparency = make_palette([classe["color"] for classe in config["classes"]])
+
+    C = len(config["classes"]) - 1
+    args.threshold = args.threshold * C if len(args.threshold) == 1 else args.threshold
+    assert len(args.threshold) == C, "--threshold, expect either a single value, or {} ones".format(C)
+    assert all(0 <= threshold <= 1 for threshold in args.threshold), "--threshold, expect values between 0 and 1"
+
+    args.probs = os.path.expanduser(args.probs)
+    args.out = os.path.expanduser(args.out)
+    if not args.workers:
+        args.workers = os.cpu_count()
+
+    out_dir = tiles_out_dir(args.out)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    log = Logs(os.path.join(out_dir, "log"), out=sys.stderr)
+
+    paths = dict(tiles_store(args.probs).tiles())
+    assert paths, "No probabilities tiles in {}".format(args.probs)
+    probs = tile_image_from_file(next(iter(paths.values())))
+    assert probs is not None, "Unable to read tile: {}".format(next(iter(paths.values())))
+    bands = probs.shape[2] if len(probs.shape) == 3 else 1
+    assert bands == C, "{} classes probabilities expected, not {}, in {}".format(C, bands, args.probs)
+    log.log(
+        "abd threshold {} at {}, on CPU with {} workers".format(
+            args.probs, ", ".join(str(threshold) for threshold in args.threshold), args.workers
+        )
+    )
+
+    tasks = [[(tile, paths[tile]) for tile in block] for block in tiles_blocks(list(paths.keys()), args.block)]
+    progress = tqdm(desc="Threshold", total=len(paths), ascii=True, unit="tile")
+    with futures.ProcessPoolExecutor(args.workers) as executor:
+        for done in executor.map(partial(worker_block, args, palette, transparency), tasks):
+            progress.update(done)
+    progress.close()
+
+    tiles_store(args.out).flush()
+    log.log("abd threshold - {} masks".format(len(paths)))
+
+    if not args.no_web_ui and not tiles_pack(args.out):
+        template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
+        base_url = args.web_ui_base_url if args.web_ui_base_url else "."
+        ext = tile_codec(args.codec, label=True)[0]
+        web_ui(args.out, base_url, list(paths.keys()), list(paths.keys()), ext, template)
@@ -1,15 +1,17 @@
 import os
 import sys
+import collections
 from tqdm import tqdm
 import concurrent.futures as futures
+from functools import partial
 
 import numpy as np
 
-import shutil
 import mercantile
 
 from rasterio import open as rasterio_open
 from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
 from rasterio.enums import Resampling
 from rasterio.warp import transform_bounds
 from rasterio.transform import from_bounds
@@ -17,11 +19,15 @@ from rasterio.transform import from_bounds
 from abd_model.core import load_config, check_classes, make_palette, web_ui, Logs
 from abd_model.tiles import (
     tiles_from_csv,
-    tile_from_xyz,
     tile_image_to_file,
     tile_label_to_file,
-    tile_image_from_file,
-    tile_label_from_file,
+    tile_codec,
+    tiles_pack,
+    tiles_store,
+    tiles_out_dir,
+    tiles_in_footprint,
+    source_fingerprint,
+    TilesManifest,
 )
 
 
@@ -32,6 +38,10 @@ def add_parser(subparser, formatter_class):
     inp.add_argument("--rasters", type=str, required=True, nargs="+", help="path to raster files to tile [required]")
     inp.add_argument("--cover", type=str, help="path to csv tiles cover file, to filter tiles to tile [optional]")
     inp.add_argument("--bands", type=str, help="list of 1-n index bands to select (e.g 1,2,3) [optional]")
+    help = "on overlapping rasters, first valid pixel from: first or last listed raster, or finest resolution one"
+    inp.add_argument(
+        "--priority", type=str, default="first", choices=["first", "last", "finest"], help=help + " [default: first]"
+    )
 
     out = parser.add_argument_group("Output")
     out.add_argument("--zoom", type=int, required=True, help="zoom level of tiles [required]")
@@ -42,14 +52,22 @@ def add_parser(subparser, formatter_class):
     out.add_argument("--nodata_threshold", type=int, default=100, choices=range(0, 101), metavar="[0-100]", help=help)
     out.add_argument("--keep_borders", action="store_true", help="keep tiles even if borders are empty (nodata)")
     out.add_argument("--format", type=str, help="file format to save images in (e.g jpeg)")
-    out.add_argument("--out", type=str, required=True, help="output directory path [required]")
+    help = "tiles codec, either a preset: default, fast, small, raw or a format:option (e.g png:1, webp:90, tiff:none)"
+    out.add_argument("--codec", type=str, help=help)
+    out.add_argument("--out", type=str, required=True, help="output directory, or .mbtiles pack, path [required]")
+    out.add_argument("--force", action="store_true", help="if set, tile again all tiles, even already up to date ones")
+    out.add_argument("--remove_stale", action="store_true", help="if set, remove tiles no longer in rasters coverage")
 
     lab = parser.add_argument_group("Labels")
     lab.add_argument("--label", action="store_true", help="if set, generate label tiles")
     lab.add_argument("--config", type=str, help="path to config file [required with --label, if no global config setting]")
 
     perf = parser.add_argument_group("Performances")
-    perf.add_argument("--workers", type=int, help="number of workers [default: raster files]")
+    perf.add_argument("--workers", type=int, help="number of processes, tiling blocks of tiles [default: CPU]")
+    help = "side, in tiles, of blocks of adjacent tiles warped and read at once [default: 4]"
+    perf.add_argument("--block", type=int, default=4, help=help)
+    perf.add_argument("--gdal_cache", type=int, help="GDAL raster block cache size, in MB [default: GDAL one]")
+    perf.add_argument("--warp_threads", type=int, default=1, help="number of threads, for each warp [default: 1]")
 
     ui = parser.add_argument_group("Web UI")
     ui.add_argument("--web_ui_base_url", type=str, help="alternate Web UI base URL")
@@ -73,202 +91,378 @@ def is_nodata(image, nodata, threshold, keep_borders=False):
     return np.sum(image[:, :, :] == nodata) >= C * W * H * (threshold / 100)
 
 
-def main(args):
+def nodata_pixels(image, nodata):
+    """Return a H,W bool mask, of pixels being nodata on every band."""
+    return np.all(image == nodata, axis=2)
 
-    assert not (args.label and args.format), "Format option not supported for label, output must be kept as png"
-    try:
-        args.bands = list(map(int, args.bands.split(","))) if args.bands else None
-    except:
-        raise ValueError("invalid --args.bands value")
 
-    if not args.workers:
-        args.workers = min(os.cpu_count(), len(args.rasters))
+def tiles_blocks(tiles, size):
+    """Group tiles in blocks of size x size adjacent tiles, rows ordered, so each block could be read at once."""
 
-    if args.label:
-        config = load_config(args.config)
-        check_classes(config)
-        colors = [classe["color"] for classe in config["classes"]]
-        palette = make_palette(colors)
+    blocks = {}
+    for tile in tiles:
+        blocks.setdefault((tile.y // size, tile.x // size), []).append(tile)
 
-    assert len(args.ts.split(",")) == 2, "--ts expect width,height value (e.g 512,512)"
-    width, height = list(map(int, args.ts.split(",")))
+    return [blocks[key] for key in sorted(blocks.keys())]
 
-    cover = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))] if args.cover else None
 
-    splits_path = os.path.join(os.path.expanduser(args.out), ".splits")
+def raster_warp(raster, tiles, width, height, threads=1):
+    """Return a single WarpedVRT for a raster, in EPSG:3857 aligned on its tiles grid, and the grid upper left tile."""
 
-    args.out = os.path.expanduser(args.out)
-    if os.path.dirname(os.path.expanduser(args.out)):
-        os.makedirs(args.out, exist_ok=True)
-    log = Logs(os.path.join(args.out, "log"), out=sys.stderr)
+    z = tiles[0].z
+    x0, y0 = min(tile.x for tile in tiles), min(tile.y for tile in tiles)
+    x1, y1 = max(tile.x for tile in tiles), max(tile.y for tile in tiles)
+    w, _, _, n = mercantile.xy_bounds(mercantile.Tile(x0, y0, z))
+    _, s, e, _ = mercantile.xy_bounds(mercantile.Tile(x1, y1, z))
+    W, H = (x1 - x0 + 1) * width, (y1 - y0 + 1) * height
 
-    raster = rasterio_open(os.path.expanduser(args.rasters[0]))
-    args.bands = args.bands if args.bands else raster.indexes
-    raster.close()
-    print(
-        "abd tile {} rasters on bands {}, on CPU with {} workers".format(len(args.rasters), args.bands, args.workers),
-        file=sys.stderr,
-        flush=True,
+    warp_vrt = WarpedVRT(
+        raster,
+        crs="epsg:3857",
+        resampling=Resampling.bilinear,
+        add_alpha=False,
+        transform=from_bounds(w, s, e, n, W, H),
+        width=W,
+        height=H,
+        NUM_THREADS=threads,  # GDAL warp option
     )
 
-    skip = []
-    tiles_map = {}
-    total = 0
-    for path in args.rasters:
+    return warp_vrt, mercantile.Tile(x0, y0, z)
+
+
+def raster_aligned(raster, zoom, width, height):
+    """Return the decimation factor, if a raster is in EPSG:3857 with pixels aligned on the zoom tiles grid, or None."""
+
+    transform = raster.transform
+    if raster.crs is None or raster.crs.to_epsg() != 3857 or transform.b or transform.d:
+        return None
+
+    w, _, e, n = mercantile.xy_bounds(mercantile.Tile(0, 0, 0))
+    size = (e - w) / (1 << zoom)
+    factor = round(size / width / transform.a)
+    if factor < 1 or abs(size / width / transform.a - factor) > 1e-6 or abs(size / height / -transform.e - factor) > 1e-6:
+        return None
+
+    col, row = (transform.c - w) / transform.a, (n - transform.f) / -transform.e
+    if abs(col - round(col)) > 1e-3 or abs(row - round(row)) > 1e-3:
+        return None
+
+    return factor
+
+
+def raster_window(raster, bands, block, width, height, factor, resampling):
+    """Read, with no warp, a block of adjacent tiles from a tiles grid aligned raster, decimated by factor, so from
+    overviews if any. Return data, as C,H,W, filled with raster nodata (or 0) outside of it."""
+
+    x0, y0 = min(tile.x for tile in block), min(tile.y for tile in block)
+    x1, y1 = max(tile.x for tile in block), max(tile.y for tile in block)
+    W, H = (x1 - x0 + 1) * width, (y1 - y0 + 1) * height
+    fill = raster.nodata if raster.nodata is not None else 0
+    data = np.full((len(bands), H, W), fill, dtype=raster.dtypes[bands[0] - 1])
+
+    w, _, _, n = mercantile.xy_bounds(mercantile.Tile(0, 0, 0))
+    col0 = round((raster.transform.c - w) / raster.transform.a) - x0 * width * factor  # raster origin, in block pixels
+    row0 = round((n - raster.transform.f) / -raster.transform.e) - y0 * height * factor
+    u0, v0 = max(0, -(-col0 // factor)), max(0, -(-row0 // factor))
+    u1, v1 = min(W, (col0 + raster.width) // factor), min(H, (row0 + raster.height) // factor)
+    if u1 <= u0 or v1 <= v0:
+        return data
+
+    window = Window(u0 * factor - col0, v0 * factor - row0, (u1 - u0) * factor, (v1 - v0) * factor)
+    out_shape = (len(bands), v1 - v0, u1 - u0)
+    data[:, v0:v1, u0:u1] = raster.read(indexes=bands, window=window, out_shape=out_shape, resampling=resampling)
+
+    return data
+
+
+_warps = collections.OrderedDict()  # worker process rasters and warps, kept from a block to the next ones
+
+
+def raster_block(args, path, corners, block, width, height):
+    """Warp and read, at once, a block of adjacent tiles from a raster. Return data, as C,H,W, and its upper left tile.
+    Rasters already aligned on the tiles grid (cf abd warp) are read as they are, with no warp."""
+
+    if path not in _warps:
+        if len(_warps) >= 8:  # LRU: blocks are ordered, so only a few rasters are read at the same time
+            _, (raster, warp_vrt, _, _) = _warps.popitem(last=False)
+            if warp_vrt is not None:
+                warp_vrt.close()
+            raster.close()
+        raster = rasterio_open(path)
+        factor = raster_aligned(raster, corners[0].z, width, height)
+        if factor is None:
+            _warps[path] = (raster, *raster_warp(raster, corners, width, height, args.warp_threads), None)  # by raster
+        else:
+            _warps[path] = (raster, None, None, factor)
+    _warps.move_to_end(path)
+    raster, warp_vrt, ul, factor = _warps[path]
+
+    x0, y0 = min(tile.x for tile in block), min(tile.y for tile in block)
+    x1, y1 = max(tile.x for tile in block), max(tile.y for tile in block)
+    if warp_vrt is not None:
+        window = Window((x0 - ul.x) * width, (y0 - ul.y) * height, (x1 - x0 + 1) * width, (y1 - y0 + 1) * height)
+        data = warp_vrt.read(indexes=args.bands, window=window)  # source blocks decoded once, for the whole block
+    else:
+        resampling = Resampling.nearest if args.label else Resampling.average
+        data = raster_window(raster, args.bands, block, width, height, factor, resampling)
+
+    if data.dtype == "uint16":  # GeoTiff could be 16 bits
+        data = np.uint8(data / 256)
+    elif data.dtype == "uint32":  # or 32 bits
+        data = np.uint8(data / (256 * 256))
+
+    return data, mercantile.Tile(x0, y0, block[0].z)
+
+
+def composite_block(args, rasters, block, width, height):
+    """Return a block of adjacent tiles images, as tile -> H,W,C, compositing in memory rasters contributions,
+    in priority order."""
+
+    images = {}
+    for i, (path, corners) in enumerate(rasters):
+        tiles = [
+            tile
+            for tile, covers in block
+            if i in covers and (tile not in images or nodata_pixels(images[tile], args.nodata).any())
+        ]
+        if not tiles:
+            continue  # either raster not involved in this block, or its tiles already fully filled
+
+        data, ul = raster_block(args, path, corners, tiles, width, height)
+        for tile in tiles:
+            row, col = (tile.y - ul.y) * height, (tile.x - ul.x) * width
+            image = np.moveaxis(data[:, row : row + height, col : col + width], 0, 2)  # C,H,W -> H,W,C
+
+            if tile not in images:
+                images[tile] = np.ascontiguousarray(image)
+                continue
+
+            fill = nodata_pixels(images[tile], args.nodata)  # first valid pixel wins
+            images[tile][fill] = image[fill]
+
+    return images
+
+
+def worker_block(args, width, height, ext, label, task):
+    """Tile a block of adjacent tiles, from its rasters. Return tiles processed, and tiles written."""
+
+    rasters, block = task
+    images = composite_block(args, rasters, block, width, height)
+
+    tiled = []
+    for tile, image in images.items():
+
+        if not args.label and is_nodata(image, args.nodata, args.nodata_threshold, args.keep_borders):
+            continue
+
+        if not args.label:
+            tile_image_to_file(args.out, tile, image, ext=ext, codec=args.codec)
+        if args.label:
+            tile_label_to_file(args.out, tile, *label, image, codec=args.codec)
+
+        tiled.append(tile)
+
+    return len(block), tiled
+
+
+def worker_footprint(nodata, task):
+    """Return raster tiles, but the ones surely nodata, from a cheap raster footprint."""
+
+    path, tiles = task
+    with rasterio_open(path) as raster:
+        valid = tiles_in_footprint(raster, tiles, nodata)
+
+    return [tile for tile, inside in zip(tiles, valid) if inside]
+
+
+def rasters_coverage(paths, zoom, bands, cover, log):
+    """Return rasters tiles grid corners and resolution, as path -> (corners, resolution), and their tiles at zoom."""
+
+    rasters = {}
+    rasters_tiles = {}
+    for path in paths:
         raster = rasterio_open(os.path.expanduser(path))
-        assert set(args.bands).issubset(set(raster.indexes)), "Missing bands in raster {}".format(path)
+        assert set(bands).issubset(set(raster.indexes)), "Missing bands in raster {}".format(path)
 
         try:
             w, s, e, n = transform_bounds(raster.crs, "EPSG:4326", *raster.bounds)
         except:
             log.log("WARNING: missing or invalid raster projection, SKIPPING: {}".format(path))
-            skip.append(path)
             continue
 
-        tiles = [mercantile.Tile(x=x, y=y, z=z) for x, y, z in mercantile.tiles(w, s, e, n, args.zoom)]
-        tiles = list(set(tiles) & set(cover)) if cover else tiles
-        total += len(tiles)
+        tiles = [mercantile.Tile(x=x, y=y, z=z) for x, y, z in mercantile.tiles(w, s, e, n, zoom)]
+        tiles = [tile for tile, inside in zip(tiles, cover.contains(tiles)) if inside] if cover else tiles
+        if tiles:
+            corners = [mercantile.Tile(min(t.x for t in tiles), min(t.y for t in tiles), zoom)]
+            corners.append(mercantile.Tile(max(t.x for t in tiles), max(t.y for t in tiles), zoom))
+            w, _, e, _ = transform_bounds(raster.crs, "EPSG:3857", *raster.bounds)
+            rasters[os.path.expanduser(path)] = (corners, (e - w) / raster.width)
+            rasters_tiles[os.path.expanduser(path)] = tiles
+
+        raster.close()
+
+    return rasters, rasters_tiles
+
+
+def rasters_tiles_map(rasters_tiles):
+    """Return, for each tile key, the rasters covering it."""
 
+    tiles_map = {}
+    for path, tiles in rasters_tiles.items():
         for tile in tiles:
             tile_key = (str(tile.x), str(tile.y), str(tile.z))
             if tile_key not in tiles_map.keys():
                 tiles_map[tile_key] = []
             tiles_map[tile_key].append(path)
 
-        raster.close()
-    assert total, "Nothing left to tile"
+    return tiles_map
 
-    if len(args.bands) == 1 or args.label:
-        ext = "png" if args.format is None else args.format
-    if len(args.bands) == 3:
-        ext = "webp" if args.format is None else args.format
-    if len(args.bands) > 3:
-        ext = "tiff" if args.format is None else args.format
 
-    tiles = []
-    progress = tqdm(desc="Coverage tiling", total=total, ascii=True, unit="tile")
-    with futures.ThreadPoolExecutor(args.workers) as executor:
+def rasters_priority(rasters, priority):
+    """Return rasters paths, in priority order: first or last listed, or finest resolution first."""
 
-        def worker(path):
+    paths = list(rasters.keys())
+    if priority == "last":
+        paths.reverse()
+    if priority == "finest":
+        paths.sort(key=lambda path: rasters[path][1])
 
-            if path in skip:
-                return None
+    return paths
 
-            raster = rasterio_open(path)
-            w, s, e, n = transform_bounds(raster.crs, "EPSG:4326", *raster.bounds)
-            tiles = [mercantile.Tile(x=x, y=y, z=z) for x, y, z in mercantile.tiles(w, s, e, n, args.zoom)]
-            tiled = []
-
-            for tile in tiles:
-
-                if cover and tile not in cover:
-                    continue
-
-                w, s, e, n = mercantile.xy_bounds(tile)
-
-                warp_vrt = WarpedVRT(
-                    raster,
-                    crs="epsg:3857",
-                    resampling=Resampling.bilinear,
-                    add_alpha=False,
-                    transform=from_bounds(w, s, e, n, width, height),
-                    width=width,
-                    height=height,
-                )
-
-                data = warp_vrt.read(
-                    out_shape=(len(args.bands), width, height), indexes=args.bands, window=warp_vrt.window(w, s, e, n)
-                )
-                if data.dtype == "uint16":  # GeoTiff could be 16 bits
-                    data = np.uint8(data / 256)
-                elif data.dtype == "uint32":  # or 32 bits
-                    data = np.uint8(data / (256 * 256))
-
-                image = np.moveaxis(data, 0, 2)  # C,H,W -> H,W,C
-
-                tile_key = (str(tile.x), str(tile.y), str(tile.z))
-                if (
-                    not args.label
-                    and len(tiles_map[tile_key]) == 1
-                    and is_nodata(image, args.nodata, args.nodata_threshold, args.keep_borders)
-                ):
-                    progress.update()
-                    continue
-
-                if len(tiles_map[tile_key]) > 1:
-                    out = os.path.join(splits_path, str(tiles_map[tile_key].index(path)))
-                else:
-                    out = args.out
-
-                x, y, z = map(int, tile)
-
-                if not args.label:
-                    tile_image_to_file(out, mercantile.Tile(x=x, y=y, z=z), image, ext=ext)
-                if args.label:
-                    tile_label_to_file(out, mercantile.Tile(x=x, y=y, z=z), palette, args.nodata, image)
-
-                if len(tiles_map[tile_key]) == 1:
-                    tiled.append(mercantile.Tile(x=x, y=y, z=z))
-
-                progress.update()
 
-            raster.close()
-            return tiled
+def rasters_tasks(tiles_map, rasters, rank, size):
+    """Return blocks of adjacent tiles, small enough to balance load between workers, each with its rasters."""
 
-        for tiled in executor.map(worker, args.rasters):
-            if tiled is not None:
-                tiles.extend(tiled)
+    tasks = []
+    tiles = [mercantile.Tile(*map(int, tile_key)) for tile_key in tiles_map.keys()]
+    for block in tiles_blocks(tiles, size):
+        block = [(tile, sorted(rank[path] for path in tiles_map[tuple(map(str, tile))])) for tile in block]
+        involved = sorted(set(i for _, covers in block for i in covers))
+        block = [(tile, [involved.index(i) for i in covers]) for tile, covers in block]
+        tasks.append(([rasters[i] for i in involved], block))
 
-    total = sum([1 for tile_key in tiles_map.keys() if len(tiles_map[tile_key]) > 1])
-    progress = tqdm(desc="Aggregate splits", total=total, ascii=True, unit="tile")
-    with futures.ThreadPoolExecutor(args.workers) as executor:
+    return tasks
 
-        def worker(tile_key):
 
-            if len(tiles_map[tile_key]) == 1:
-                return
+def main(args):
 
-            image = np.zeros((width, height, len(args.bands)), np.uint8)
+    assert not (args.label and args.format), "Format option not supported for label, use --codec instead"
+    assert not (args.format and args.codec), "--format and --codec are mutually exclusive options"
+    try:
+        args.bands = list(map(int, args.bands.split(","))) if args.bands else None
+    except:
+        raise ValueError("invalid --args.bands value")
 
-            x, y, z = map(int, tile_key)
-            for i in range(len(tiles_map[tile_key])):
-                root = os.path.join(splits_path, str(i))
-                _, path = tile_from_xyz(root, x, y, z)
+    if not args.workers:
+        args.workers = os.cpu_count()
 
-                if not args.label:
-                    split = tile_image_from_file(path)
-                if args.label:
-                    split = tile_label_from_file(path)
+    if args.gdal_cache:
+        os.environ["GDAL_CACHEMAX"] = str(args.gdal_cache)  # read by GDAL, on its first cache use
 
-                if len(split.shape) == 2:
-                    split = split.reshape((width, height, 1))  # H,W -> H,W,C
+    if args.label:
+        config = load_config(args.config)
+        check_classes(config)
+        colors = [classe["color"] for classe in config["classes"]]
+        palette, transparency = make_palette(colors)
 
-                assert image.shape == split.shape, "{}, {}".format(image.shape, split.shape)
-                image[np.where(image == 0)] += split[np.where(image == 0)]
+    assert len(args.ts.split(",")) == 2, "--ts expect width,height value (e.g 512,512)"
+    width, height = list(map(int, args.ts.split(",")))
 
-            if not args.label and is_nodata(image, args.nodata, args.nodata_threshold, args.keep_borders):
-                progress.update()
-                return
+    cover = tiles_from_csv(os.path.expanduser(args.cover)) if args.cover else None
 
-            tile = mercantile.Tile(x=x, y=y, z=z)
+    args.out = os.path.expanduser(args.out)
+    out_dir = tiles_out_dir(args.out)
 
-            if not args.label:
-                tile_image_to_file(args.out, tile, image)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    log = Logs(os.path.join(out_dir, "log"), out=sys.stderr)
 
-            if args.label:
-                tile_label_to_file(args.out, tile, palette, image)
+    raster = rasterio_open(os.path.expanduser(args.rasters[0]))
+    args.bands = args.bands if args.bands else raster.indexes
+    raster.close()
+    print(
+        "abd tile {} rasters on bands {}, on CPU with {} workers".format(len(args.rasters), args.bands, args.workers),
+        file=sys.stderr,
+        flush=True,
+    )
+
+    rasters, rasters_tiles = rasters_coverage(args.rasters, args.zoom, args.bands, cover, log)
 
-            progress.update()
-            return tile
+    candidates = set(tile for tiles in rasters_tiles.values() for tile in tiles)
+    if not args.label:  # skip, before any warp, tiles outside rasters valid footprints
+        with futures.ProcessPoolExecutor(args.workers) as executor:
+            footprints = executor.map(partial(worker_footprint, args.nodata), rasters_tiles.items())
+            rasters_tiles = dict(zip(rasters_tiles.keys(), footprints))
 
-        for tiled in executor.map(worker, tiles_map.keys()):
-            if tiled is not None:
-                tiles.append(tiled)
+    tiles_map = rasters_tiles_map(rasters_tiles)
 
-        if splits_path and os.path.isdir(splits_path):
-            shutil.rmtree(splits_path)  # Delete suffixes dir if any
+    if len(candidates) > len(tiles_map):
+        log.log("abd tile: {} tiles skipped, as nodata on rasters footprints".format(len(candidates) - len(tiles_map)))
+    assert candidates, "Nothing left to tile"
 
-    if tiles and not args.no_web_ui:
+    if len(args.bands) == 1 or args.label:
+        ext = "png" if args.format is None else args.format
+    if len(args.bands) == 3:
+        ext = "webp" if args.format is None else args.format
+    if len(args.bands) > 3:
+        ext = "tiff" if args.format is None else args.format
+    if args.codec:
+        ext = tile_codec(args.codec, len(args.bands), args.label)[0]
+
+    paths = rasters_priority(rasters, args.priority)
+    rasters = [(path, rasters[path][0]) for path in paths]
+    rank = {path: i for i, path in enumerate(paths)}
+
+    params = {key: vars(args)[key] for key in ["bands", "ts", "nodata", "nodata_threshold", "keep_borders", "label"]}
+    params.update({"format": ext, "codec": args.codec, "classes": config["classes"] if args.label else None})
+    manifest = TilesManifest(args.out, "tile", params)
+    fingerprints = {path: source_fingerprint(path) for path in paths}
+    signatures = {}  # provenance of each tile: its rasters, in priority order
+    for tile_key, tile_paths in tiles_map.items():
+        signatures[tile_key] = manifest.signature([fingerprints[path] for path in sorted(tile_paths, key=rank.get)])
+
+    store = tiles_store(args.out)
+    for tile in candidates:  # surely nodata tiles: outputs from previous runs, if any, are obsolete
+        if tuple(map(str, tile)) not in tiles_map:
+            if manifest.written(tile):
+                store.remove(tile)
+            manifest.update(tile, manifest.signature(), written=False)
+
+    fresh = [key for key, signature in signatures.items() if manifest.fresh(mercantile.Tile(*map(int, key)), signature, ext)]
+    fresh = {tile_key: tiles_map.pop(tile_key) for tile_key in fresh} if not args.force else {}
+    if fresh:
+        log.log("abd tile: {} tiles already up to date, skipped".format(len(fresh)))
+
+    tasks = rasters_tasks(tiles_map, rasters, rank, args.block)
+
+    tiles = [mercantile.Tile(*map(int, tile_key)) for tile_key in fresh.keys()]
+    tiles = [tile for tile in tiles if manifest.written(tile)]
+    progress = tqdm(desc="Coverage tiling", total=len(tiles_map), ascii=True, unit="tile")
+    label = (palette, transparency) if args.label else None
+    with futures.ProcessPoolExecutor(args.workers) as executor:
+        worker = partial(worker_block, args, width, height, ext, label)
+        for (_, block), (done, tiled) in zip(tasks, executor.map(worker, tasks)):
+            tiles.extend(tiled)
+            progress.update(done)
+
+            tiled = set(tiled)
+            for tile, _ in block:
+                if tile not in tiled and manifest.written(tile):
+                    store.remove(tile)  # nodata from now on, previous output is obsolete
+                manifest.update(tile, signatures[tuple(map(str, tile))], written=tile in tiled)
+    progress.close()
+
+    stale = manifest.stale(candidates)
+    if stale and args.remove_stale:
+        manifest.remove(stale)
+        log.log("abd tile: {} stale tiles, no longer in rasters coverage, removed".format(len(stale)))
+    elif stale:
+        log.log("abd tile: {} stale tiles, no longer in rasters coverage, kept (cf --remove_stale)".format(len(stale)))
+
+    store.flush()
+    manifest.save()
+
+    if tiles and not args.no_web_ui and not tiles_pack(args.out):
         template = "leaflet.html" if not args.web_ui_template else args.web_ui_template
         base_url = args.web_ui_base_url if args.web_ui_base_url else "."
         web_ui(args.out, base_url, tiles, tiles, ext, template)
@@ -54,7 +54,7 @@ def add_parser(subparser, formatter_class):
 def main(args):
     config = load_config(args.config)
     args.out = os.path.expanduser(args.out)
-    args.cover = [tile for tile in tiles_from_csv(os.path.expanduser(args.cover))] if args.cover else None
+    args.cover = tiles_from_csv(os.path.expanduser(args.cover)) if args.cover else None
     if args.classes_weights:
         try:
             args.classes_weights = list(map(float, args.classes_weights.split(",")))
@@ -101,6 +101,8 @@ def main(args):
     shape_in = dataset.shape_in
     shape_out = dataset.shape_out
     log.log("\nDataSet:        {}".format(args.dataset))
+    if getattr(dataset, "pack", None):
+        log.log("Samples pack:   {}".format(dataset.pack))
 
     if args.classes_weights == "auto":
         args.classes_weights = compute_classes_weights(args.dataset, config["classes"], args.cover, os.cpu_count())
@@ -3,22 +3,24 @@ import sys
 from tqdm import tqdm
 
 import numpy as np
-from PIL import Image
 
 import json
 import mercantile
+import rasterio
 import rasterio.features
 import rasterio.transform
+from rasterio.warp import transform_bounds
 
 from abd_model.core import load_config, check_classes
-from abd_model.tiles import tiles_from_dir
+from abd_model.tiles import tiles_from_dir, tile_label_from_file, tiles_geotiff
 
 
 def add_parser(subparser, formatter_class):
     parser = subparser.add_parser("vectorize", help="Extract GeoJSON from tiles masks", formatter_class=formatter_class)
 
     inp = parser.add_argument_group("Inputs")
-    inp.add_argument("--masks", type=str, required=True, help="input masks directory path [required]")
+    help = "input masks directory, or .mbtiles pack, or .tif GeoTIFF (as abd predict output) path [required]"
+    inp.add_argument("--masks", type=str, required=True, help=help)
     inp.add_argument("--type", type=str, required=True, help="type of features to extract (i.e class title) [required]")
     inp.add_argument("--config", type=str, help="path to config file [required, if no global config setting]")
 
@@ -28,14 +30,42 @@ def add_parser(subparser, formatter_class):
     parser.set_defaults(func=main)
 
 
+def masks_from_tiles(masks):
+    """Yield each mask tile, as a H,W array, with its lon/lat affine transform."""
+
+    for tile, path in tqdm(masks, ascii=True, unit="mask"):
+        mask = tile_label_from_file(path)
+        try:
+            C, W, H = mask.shape
+        except:
+            W, H = mask.shape
+        yield mask, rasterio.transform.from_bounds(*mercantile.bounds(tile.x, tile.y, tile.z), W, H)
+
+
+def masks_from_geotiff(path):
+    """Yield each GeoTIFF internal block, by windowed reads, as a H,W array, with its lon/lat affine transform (as tiles
+    ones, blocks being tiles aligned)."""
+
+    with rasterio.open(path) as raster:
+        windows = [window for _, window in raster.block_windows(1)]
+        for window in tqdm(windows, ascii=True, unit="block"):
+            bounds = transform_bounds(raster.crs, "EPSG:4326", *raster.window_bounds(window))
+            yield raster.read(1, window=window), rasterio.transform.from_bounds(*bounds, window.width, window.height)
+
+
 def main(args):
     config = load_config(args.config)
     check_classes(config)
     index = [i for i in (list(range(len(config["classes"])))) if config["classes"][i]["title"] == args.type]
     assert index, "Requested type {} not found among classes title in the config file.".format(args.type)
 
-    masks = list(tiles_from_dir(args.masks, xyz_path=True))
-    assert len(masks), "empty masks directory: {}".format(args.masks)
+    if tiles_geotiff(args.masks):
+        assert os.path.isfile(os.path.expanduser(args.masks)), "masks GeoTIFF not found: {}".format(args.masks)
+        masks = masks_from_geotiff(os.path.expanduser(args.masks))
+    else:
+        masks = list(tiles_from_dir(args.masks, xyz_path=True))
+        assert len(masks), "empty masks directory: {}".format(args.masks)
+        masks = masks_from_tiles(masks)
 
     print("abd vectorize {} from {}".format(args.type, args.masks), file=sys.stderr, flush=True)
 
@@ -47,13 +77,10 @@ def main(args):
     out.write('{"type":"FeatureCollection","features":[')
 
     first = True
-    for tile, path in tqdm(masks, ascii=True, unit="mask"):
-        mask = (np.array(Image.open(path).convert("P"), dtype=np.uint8) == index).astype(np.uint8)
-        try:
-            C, W, H = mask.shape
-        except:
-            W, H = mask.shape
-        transform = rasterio.transform.from_bounds((*mercantile.bounds(tile.x, tile.y, tile.z)), W, H)
+    for mask, transform in masks:
+        mask = (mask == index).astype(np.uint8)
+        if not mask.any():
+            continue
 
         for shape, value in rasterio.features.shapes(mask, transform=transform, mask=mask):
             geom = '"geometry":{{"type": "Polygon", "coordinates":{}}}'.format(json.dumps(shape["coordinates"]))
@@ -0,0 +1,163 @@
+import os
+import sys
+import itertools
+from tqdm import tqdm
+import concurrent.futures as futures
+
+import mercantile
+import numpy as np
+
+import rasterio
+from rasterio import open as rasterio_open
+from rasterio.shutil import copy as rasterio_copy
+from rasterio.windows import Window
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+
+from abd_model.core import Logs
+from abd_model.tiles import tiles_from_csv
+from abd_model.tools.tile import composite_block, rasters_coverage, rasters_tiles_map, rasters_priority, rasters_tasks
+
+
+def add_parser(subparser, formatter_class):
+    help = "Warp rasters, once, to a Cloud Optimized GeoTIFF in EPSG:3857, aligned on a zoom tiles grid"
+    parser = subparser.add_parser("warp", help=help, formatter_class=formatter_class)
+
+    inp = parser.add_argument_group("Inputs")
+    inp.add_argument("--rasters", type=str, required=True, nargs="+", help="path to raster files to warp [required]")
+    inp.add_argument("--cover", type=str, help="path to csv tiles cover file, to filter tiles to warp [optional]")
+    inp.add_argument("--bands", type=str, help="list of 1-n index bands to select (e.g 1,2,3) [optional]")
+    help = "on overlapping rasters, first valid pixel from: first or last listed raster, or finest resolution one"
+    inp.add_argument(
+        "--priority", type=str, default="first", choices=["first", "last", "finest"], help=help + " [default: first]"
+    )
+
+    out = parser.add_argument_group("Output")
+    out.add_argument("--zoom", type=int, required=True, help="zoom level of the tiles grid to align on [required]")
+    out.add_argument("--ts", type=str, default="512,512", help="tile size in pixels [default: 512,512]")
+    help = "nodata pixel value, used to composite overlapping rasters [default: 0]"
+    out.add_argument("--nodata", type=int, default=0, choices=range(0, 256), metavar="[0-255]", help=help)
+    help = "GeoTIFF compression: none, lzw, deflate, zstd, jpeg or webp [default: deflate]"
+    out.add_argument("--compress", type=str, default="deflate", help=help)
+    help = "output path: a single .tif mosaic of all rasters, or a dir, to warp each raster apart [required]"
+    out.add_argument("--out", type=str, required=True, help=help)
+
+    perf = parser.add_argument_group("Performances")
+    perf.add_argument("--workers", type=int, help="number of processes, warping blocks of tiles [default: CPU]")
+    help = "side, in tiles, of blocks of adjacent tiles warped and read at once [default: 4]"
+    perf.add_argument("--block", type=int, default=4, help=help)
+    perf.add_argument("--gdal_cache", type=int, help="GDAL raster block cache size, in MB [default: GDAL one]")
+    perf.add_argument("--warp_threads", type=int, default=1, help="number of threads, for each warp [default: 1]")
+
+    parser.set_defaults(func=main)
+
+
+def worker_block(args, width, height, task):
+    """Warp and composite a block of adjacent tiles. Return tiles processed, and tiles images, as tile -> C,H,W."""
+
+    rasters, block = task
+    images = composite_block(args, rasters, block, width, height)
+
+    return len(block), {tile: np.moveaxis(image, 2, 0) for tile, image in images.items()}
+
+
+def warp(args, paths, out, cover, width, height, log):
+    """Warp rasters to a single tiled and overviewed GeoTIFF, aligned on the tiles grid, with a COG layout."""
+
+    rasters, rasters_tiles = rasters_coverage(paths, args.zoom, args.bands, cover, log)
+    tiles_map = rasters_tiles_map(rasters_tiles)
+    assert tiles_map, "Nothing to warp, from {}".format(paths)
+
+    paths = rasters_priority(rasters, args.priority)
+    rasters = [(path, rasters[path][0]) for path in paths]
+    rank = {path: i for i, path in enumerate(paths)}
+    tasks = rasters_tasks(tiles_map, rasters, rank, args.block)
+
+    tiles = [mercantile.Tile(*map(int, tile_key)) for tile_key in tiles_map.keys()]
+    x0, y0 = min(tile.x for tile in tiles), min(tile.y for tile in tiles)
+    x1, y1 = max(tile.x for tile in tiles), max(tile.y for tile in tiles)
+    w, _, _, n = mercantile.xy_bounds(mercantile.Tile(x0, y0, args.zoom))
+    _, s, e, _ = mercantile.xy_bounds(mercantile.Tile(x1, y1, args.zoom))
+    W, H = (x1 - x0 + 1) * width, (y1 - y0 + 1) * height
+
+    profile = {"driver": "GTiff", "width": W, "height": H, "count": len(args.bands), "dtype": "uint8", "crs": "EPSG:3857"}
+    profile.update({"transform": from_bounds(w, s, e, n, W, H), "nodata": args.nodata, "tiled": True, "BIGTIFF": "IF_SAFER"})
+    profile.update({"blockxsize": min(width, 512), "blockysize": min(height, 512), "compress": "deflate"})
+
+    tmp = out + ".tmp.tif"  # overviews must be ahead of full resolution data, in a COG: so a copy is needed
+    with rasterio_open(tmp, "w", **profile) as dst:
+        progress = tqdm(desc="Warp {}".format(os.path.basename(out)), total=len(tiles), ascii=True, unit="tile")
+        with futures.ProcessPoolExecutor(args.workers) as executor:
+            tasks, pending = iter(tasks), set()
+            while True:  # blocks in flight bounded, so decoded images never pile up ahead of their write
+                for task in itertools.islice(tasks, 2 * args.workers - len(pending)):
+                    pending.add(executor.submit(worker_block, args, width, height, task))
+                if not pending:
+                    break
+
+                finished, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in finished:
+                    done, images = future.result()
+                    for tile, image in images.items():
+                        dst.write(image, window=Window((tile.x - x0) * width, (tile.y - y0) * height, width, height))
+                    progress.update(done)
+        progress.close()
+
+        factors = [2]  # overviews, down to a single tile
+        while W // factors[-1] > width or H // factors[-1] > height:
+            factors.append(factors[-1] * 2)
+        dst.build_overviews(factors, Resampling.average)
+        dst.update_tags(ns="rio_overview", resampling="average")
+
+    profile.update({"compress": args.compress, "copy_src_overviews": True})
+    profile = {key: value for key, value in profile.items() if key not in ["driver", "width", "height", "count", "dtype"]}
+    rasterio_copy(tmp, out, driver="GTiff", **profile)
+    os.remove(tmp)
+
+    log.log(
+        "abd warp - {}: {}x{} pixels, {} overviews, {} tiles at zoom {}".format(
+            out, W, H, len(factors), len(tiles), args.zoom
+        )
+    )
+
+
+def main(args):
+
+    try:
+        args.bands = list(map(int, args.bands.split(","))) if args.bands else None
+    except:
+        raise ValueError("invalid --args.bands value")
+
+    if not args.workers:
+        args.workers = os.cpu_count()
+
+    if args.gdal_cache:
+        os.environ["GDAL_CACHEMAX"] = str(args.gdal_cache)  # read by GDAL, on its first cache use
+
+    assert len(args.ts.split(",")) == 2, "--ts expect width,height value (e.g 512,512)"
+    width, height = list(map(int, args.ts.split(",")))
+
+    cover = tiles_from_csv(os.path.expanduser(args.cover)) if args.cover else None
+    args.label = False  # imagery only, as overviews are averaged
+
+    args.out = os.path.expanduser(args.out)
+    mosaic = os.path.splitext(args.out)[1].lower() in [".tif", ".tiff"]
+    out_dir = os.path.dirname(os.path.abspath(args.out)) if mosaic else args.out
+    os.makedirs(out_dir, exist_ok=True)
+    log = Logs(os.path.join(out_dir, "log"), out=sys.stderr)
+
+    with rasterio_open(os.path.expanduser(args.rasters[0])) as raster:
+        args.bands = args.bands if args.bands else raster.indexes
+    print(
+        "abd warp {} rasters on bands {}, on CPU with {} workers".format(len(args.rasters), args.bands, args.workers),
+        file=sys.stderr,
+        flush=True,
+    )
+
+    with rasterio.Env(GDAL_TIFF_OVR_BLOCKSIZE=min(width, height, 512)):  # overviews blocks as full resolution ones
+        if mosaic:
+            warp(args, args.rasters, args.out, cover, width, height, log)
+        else:
+            for path in args.rasters:
+                out = os.path.join(args.out, os.path.splitext(os.path.basename(path))[0] + ".tif")
+                warp(args, [path], out, cover, width, height, log)